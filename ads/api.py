@@ -15,7 +15,7 @@ from keys.auth import APIKeyAuth
 
 
 @router.get("/advertisements", response=PaginatedResponseSchema , auth=APIKeyAuth())
-@cache_response()
+@cache_response(tags=["Advertisement"])
 def advertisements(request, page: int = 1, page_size: int = 10, estore_id: int = None, ordering: str = None):
     qs = Advertisement.objects.all()
 
@@ -0,0 +1,123 @@
+"""
+Concurrent checkout throughput when every checkout waits on the payment
+gateway.
+
+A local stub gateway answers after GATEWAY_LATENCY seconds, the way PhonePe /
+Cashfree do for a payment-link request. The sync profile models
+`gunicorn ecommerce.wsgi` with WORKERS sync workers, each blocked on a
+requests.post for the whole round trip. The async profile models
+`gunicorn -c ecommerce/gunicorn_asgi.py ecommerce.asgi` (uvicorn workers): one
+event loop per worker awaiting the call on the shared httpx.AsyncClient.
+
+    python benchmarks/bench_async_checkout.py [checkouts] [latency seconds]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+settings.configure(DEBUG=False)
+django.setup()
+
+import requests
+
+from utils.async_http import enable_shared_clients, async_http_client
+
+
+WORKERS = 4
+GATEWAY_LATENCY = 0.2
+BODY = b'{"orderId": "OMO123", "state": "PENDING", "redirectUrl": "https://example.com/pay"}'
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_gateway(latency):
+    server = GatewayServer(("127.0.0.1", 0), GatewayHandler)
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/checkout/v2/pay"
+
+
+def payload(i):
+    return {"merchantOrderId": f"order-{i}", "amount": 49900, "paymentFlow": {"type": "PG_CHECKOUT"}}
+
+
+# Latencies are measured from the moment all checkouts arrive, so time spent
+# queued for a free worker counts
+
+
+def run_sync(url, checkouts):
+    def checkout(i):
+        requests.post(url, json=payload(i), timeout=10).json()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as workers:
+        latencies = list(workers.map(checkout, range(checkouts)))
+    return time.perf_counter() - started, latencies
+
+
+def run_async(url, checkouts):
+    enable_shared_clients()
+
+    async def checkout(i):
+        async with async_http_client() as client:
+            (await client.post(url, json=payload(i))).json()
+        return time.perf_counter() - started
+
+    async def main():
+        return await asyncio.gather(*(checkout(i) for i in range(checkouts)))
+
+    started = time.perf_counter()
+    latencies = asyncio.run(main())
+    return time.perf_counter() - started, latencies
+
+
+def report(name, elapsed, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:34s} {len(latencies) / elapsed:8.1f} checkouts/s"
+        f"   p50 {statistics.median(latencies) * 1000:7.1f} ms   p95 {p95 * 1000:7.1f} ms"
+    )
+
+
+def main(checkouts=200, latency=GATEWAY_LATENCY):
+    server, url = start_gateway(latency)
+    print(f"{checkouts} concurrent checkouts, gateway latency {latency * 1000:.0f} ms")
+    report(f"sync   ({WORKERS} gunicorn workers)", *run_sync(url, checkouts))
+    report("async  (1 uvicorn worker, httpx)", *run_async(url, checkouts))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 200, float(args[1]) if len(args) > 1 else GATEWAY_LATENCY)
@@ -0,0 +1,108 @@
+"""
+Cache hit latency for a 100-item /product/product-listings/ page.
+
+Compares the old hit path (json.loads of the stored string followed by a
+JsonResponse re-dump) with the stored-bytes path used by cache_response.
+
+    python benchmarks/bench_cache_hit.py
+"""
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+settings.configure(
+    DEBUG=False,
+    GZIP_MIN_LENGTH=100,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+django.setup()
+
+from django.http import JsonResponse
+from django.test import RequestFactory
+
+from utils.cache import build_cache_entry, response_from_entry
+
+
+def listing(i):
+    now = datetime.now(timezone.utc)
+    return {
+        "id": i,
+        "product_id": i,
+        "name": f"Wooden Stacking Blocks | Pack of {i % 5 + 1}, 250 g",
+        "brand": {"id": 3, "name": "Khilona", "logo": None, "details": "Toys and games"},
+        "slug": f"wooden-stacking-blocks-pack-of-{i}",
+        "seller_id": 7,
+        "is_service": False,
+        "variant_name": f"Pack of {i % 5 + 1}",
+        "units_per_pack": 1,
+        "unit_size": 250.0,
+        "size_unit": "g",
+        "category": {
+            "id": 12, "name": "Blocks", "slug": "blocks", "image": None,
+            "description": "Building and stacking blocks", "level": 2,
+            "created": now, "updated": now,
+        },
+        "approved": True,
+        "main_image": f"https://res.cloudinary.com/demo/image/upload/kb/product_listings/{i}.jpg",
+        "thumbnail": None,
+        "price": 499.0,
+        "mrp": 699.0,
+        "stock": 40,
+        "rating": 4.5,
+        "review_count": 12,
+        "buy_limit": 10,
+        "popularity": 100,
+        "created": now,
+        "updated": now,
+    }
+
+
+def main(number=2000):
+    data = {
+        "count": 5000,
+        "next": "https://example.com/api/product/product-listings/?page=2&page_size=100",
+        "previous": None,
+        "results": [listing(i) for i in range(100)],
+    }
+    request = RequestFactory().get("/api/product/product-listings/", HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+    plain_request = RequestFactory().get("/api/product/product-listings/")
+
+    # Before: store json.dumps(data), hit = json.loads + JsonResponse
+    stored = json.dumps(data, default=str)
+
+    def old_hit():
+        return JsonResponse(json.loads(stored), safe=False).content
+
+    # After: store the rendered body, hit = HttpResponse(bytes)
+    entry = build_cache_entry(JsonResponse(data, safe=False), {})
+    raw_entry = build_cache_entry(JsonResponse(data, safe=False), {}, compress=False)
+
+    def new_hit_gzip():
+        return response_from_entry(request, entry).content
+
+    def new_hit_plain_client():
+        return response_from_entry(plain_request, entry).content
+
+    def new_hit_uncompressed():
+        return response_from_entry(request, raw_entry).content
+
+    print(f"payload: {len(stored)} bytes json, {len(entry['body'])} bytes gzipped")
+    for name, fn in [
+        ("before  json.loads + JsonResponse", old_hit),
+        ("after   stored bytes, uncompressed", new_hit_uncompressed),
+        ("after   stored gzip, gzip client", new_hit_gzip),
+        ("after   stored gzip, plain client", new_hit_plain_client),
+    ]:
+        seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        print(f"{name:40s} {seconds * 1e6:9.1f} us/hit")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+PhonePe webhook throughput during a retry storm: every payment's callback
+arrives RETRIES times, shuffled.
+
+Compares the old inline handling (Payment lookup and Payment.save(), which
+saves the Order and deletes its cache key, per callback) with the inbox:
+record_event() per callback, then drain() applying the stored events in
+batches. Runs against a throwaway test database.
+
+    DJANGO_SETTINGS_MODULE=ecommerce.settings python benchmarks/bench_webhooks.py [payments] [retries]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ecommerce.settings")
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import setup_test_environment
+
+from orders.models import Order
+from payments.models import Payment, WebhookEvent
+from payments.webhooks import drain, phonepe_event, record_event
+from utils.payment import map_phonepay_status
+
+
+def callback(i):
+    return {"type": "CHECKOUT_ORDER_COMPLETED", "payload": {"orderId": f"bench-{i}", "state": "COMPLETED", "amount": 49900}}
+
+
+def setup(payments):
+    user = get_user_model().objects.create(username="webhook-bench", mobile="9000000000")
+    orders = Order.objects.bulk_create(
+        [Order(user=user, order_number=f"bench-{i}", total_amount=499) for i in range(payments)]
+    )
+    Payment.objects.bulk_create([
+        Payment(order=order, amount=499, transaction_id=f"bench-{i}", payment_gateway="PhonePe")
+        for i, order in enumerate(orders)
+    ])
+
+
+def reset():
+    WebhookEvent.objects.all().delete()
+    Payment.objects.update(status="pending")
+    Order.objects.update(payment_status="pending")
+
+
+def inline(data):
+    """What phonepe_webhook did per callback before the inbox"""
+    payload = data.get("payload", {})
+    payment = Payment.objects.get(transaction_id=payload.get("orderId"))
+    mapped_status = map_phonepay_status(payload.get("state", "UNKNOWN"))
+    if payment.status != mapped_status:
+        payment.status = mapped_status
+        payment.save()
+
+
+def run_inline(callbacks):
+    latencies = []
+    started = time.perf_counter()
+    for data in callbacks:
+        t = time.perf_counter()
+        inline(data)
+        latencies.append(time.perf_counter() - t)
+    return time.perf_counter() - started, latencies, 0
+
+
+def run_inbox(callbacks):
+    latencies = []
+    started = time.perf_counter()
+    for data in callbacks:
+        t = time.perf_counter()
+        record_event(phonepe_event(data))
+        latencies.append(time.perf_counter() - t)
+    applied_at = time.perf_counter()
+    drain()
+    return time.perf_counter() - started, latencies, time.perf_counter() - applied_at
+
+
+def report(name, elapsed, latencies, drain_seconds):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    line = (
+        f"{name:8s} {len(latencies) / elapsed:8.0f} callbacks/s   ack p50 {statistics.median(latencies) * 1000:6.2f} ms"
+        f"   p95 {p95 * 1000:6.2f} ms"
+    )
+    if drain_seconds:
+        line += f"   (batched apply {drain_seconds * 1000:.0f} ms)"
+    print(line)
+
+
+def main(payments=500, retries=3):
+    settings.WEBHOOK_WORKER = "external"
+    setup(payments)
+    callbacks = [callback(i) for i in range(payments) for _ in range(retries)]
+    random.Random(1).shuffle(callbacks)
+
+    print(f"{len(callbacks)} callbacks for {payments} payments ({retries} deliveries each), {connection.vendor}")
+    for name, run in [("inline", run_inline), ("inbox", run_inbox)]:
+        reset()
+        report(name, *run(callbacks))
+        assert Payment.objects.filter(status="completed").count() == payments
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        main(int(args[0]) if args else 500, int(args[1]) if len(args) > 1 else 3)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
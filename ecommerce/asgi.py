@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+Async views (search, payment creation and verification) only stop holding a
+worker during gateway round trips when served from here, e.g. with
+gunicorn -c ecommerce/gunicorn_asgi.py ecommerce.asgi:application
 """
 
 import os
@@ -14,3 +18,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
 
 application = get_asgi_application()
+
+# One long-lived event loop per worker, so outbound HTTP clients can be shared
+from utils.async_http import enable_shared_clients  # noqa: E402
+
+enable_shared_clients()
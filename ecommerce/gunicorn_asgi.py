@@ -0,0 +1,17 @@
+"""
+Gunicorn settings for the ASGI deployment profile:
+
+    gunicorn -c ecommerce/gunicorn_asgi.py ecommerce.asgi:application
+
+Each uvicorn worker runs one event loop, so a request waiting on a payment
+gateway or Meilisearch no longer occupies the whole worker. Sync views still
+work; Django runs them in a thread pool.
+"""
+from decouple import config
+
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = config("WEB_CONCURRENCY", default=2, cast=int)
+bind = config("BIND", default="0.0.0.0:" + config("PORT", default="8000"))
+timeout = config("GUNICORN_TIMEOUT", default=60, cast=int)
+keepalive = 5
+accesslog = "-"
@@ -96,6 +96,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.query_monitor.QueryMonitorMiddleware',
 ]
 
 ROOT_URLCONF = 'ecommerce.urls'
@@ -210,6 +211,66 @@ else:  # Default to LocMemCache for test/localhost
         }
     }
 
+# Per-worker in-process response cache in front of CACHES["default"],
+# used by cache_response(local=True). Invalidated over Redis pub/sub.
+CACHE_L1_ENABLED = config("CACHE_L1_ENABLED", default=False, cast=bool)
+CACHE_L1_MAX_BYTES = config("CACHE_L1_MAX_BYTES", default=32 * 1024 * 1024, cast=int)
+CACHE_L1_TTL = config("CACHE_L1_TTL", default=30, cast=int)
+CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+
+# SQL count / DB time per request as Server-Timing headers and "query_monitor"
+# log lines. QUERY_BUDGETS caps queries per route (see utils/query_monitor.py);
+# QUERY_MONITOR_RAISE turns an overrun into an exception for test runs.
+QUERY_MONITOR_ENABLED = config("QUERY_MONITOR_ENABLED", default=DEBUG, cast=bool)
+QUERY_MONITOR_DUPLICATE_THRESHOLD = config("QUERY_MONITOR_DUPLICATE_THRESHOLD", default=3, cast=int)
+QUERY_MONITOR_RAISE = config("QUERY_MONITOR_RAISE", default=False, cast=bool)
+QUERY_BUDGETS = {
+    "/api/order/orders/": 4,
+}
+
+# Search backend for search/api.py: "meilisearch" or "local" (in-process
+# index, see search/local_index.py). With SEARCH_FALLBACK, Meilisearch errors
+# and timeouts are answered locally. MEILISEARCH_TIMEOUT is read by search/client.py.
+SEARCH_BACKEND = config("SEARCH_BACKEND", default="meilisearch")
+SEARCH_FALLBACK = config("SEARCH_FALLBACK", default=True, cast=bool)
+SEARCH_FALLBACK_RETRY = config("SEARCH_FALLBACK_RETRY", default=30, cast=int)
+LOCAL_SEARCH_REBUILD_INTERVAL = config("LOCAL_SEARCH_REBUILD_INTERVAL", default=30, cast=int)
+# Per-worker prefix cache of /search/suggest answers (search/suggest.py)
+SUGGEST_CACHE_SIZE = config("SUGGEST_CACHE_SIZE", default=5000, cast=int)
+SUGGEST_CACHE_TTL = config("SUGGEST_CACHE_TTL", default=60, cast=int)
+
+# Outbound calls from async views (payment gateways, Meilisearch), see
+# utils/async_http.py. Under ASGI one client per worker keeps these connections alive.
+OUTBOUND_HTTP_TIMEOUT = config("OUTBOUND_HTTP_TIMEOUT", default=10, cast=float)
+OUTBOUND_HTTP_CONNECT_TIMEOUT = config("OUTBOUND_HTTP_CONNECT_TIMEOUT", default=3, cast=float)
+OUTBOUND_HTTP_MAX_CONNECTIONS = config("OUTBOUND_HTTP_MAX_CONNECTIONS", default=100, cast=int)
+OUTBOUND_HTTP_MAX_KEEPALIVE = config("OUTBOUND_HTTP_MAX_KEEPALIVE", default=20, cast=int)
+
+# Payment gateway calls (utils/gateway_client.py): timeouts in seconds, retries
+# with jittered backoff, and a circuit breaker that fails fast for
+# PAYMENT_GATEWAY_BREAKER_RESET seconds after THRESHOLD failures in a row.
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = config("PAYMENT_GATEWAY_CONNECT_TIMEOUT", default=3, cast=float)
+PAYMENT_GATEWAY_READ_TIMEOUT = config("PAYMENT_GATEWAY_READ_TIMEOUT", default=10, cast=float)
+PAYMENT_GATEWAY_RETRIES = config("PAYMENT_GATEWAY_RETRIES", default=2, cast=int)
+PAYMENT_GATEWAY_BACKOFF = config("PAYMENT_GATEWAY_BACKOFF", default=0.2, cast=float)
+PAYMENT_GATEWAY_BREAKER_THRESHOLD = config("PAYMENT_GATEWAY_BREAKER_THRESHOLD", default=5, cast=int)
+PAYMENT_GATEWAY_BREAKER_RESET = config("PAYMENT_GATEWAY_BREAKER_RESET", default=30, cast=int)
+PAYMENT_GATEWAY_POOL_SIZE = config("PAYMENT_GATEWAY_POOL_SIZE", default=10, cast=int)
+
+# Payment links are created by a queued job (payments/links.py) instead of
+# inside the /payment/payments/ request. PAYMENT_LINK_WORKER "thread" drains the
+# queue in each web process; "external" leaves it to
+# `manage.py process_payment_links --loop`. That command also runs as the
+# Procfile "worker" process either way, to finish jobs a restarted web process
+# left behind.
+PAYMENT_LINKS_QUEUED = config("PAYMENT_LINKS_QUEUED", default=True, cast=bool)
+PAYMENT_LINK_WORKER = config("PAYMENT_LINK_WORKER", default="thread")
+PAYMENT_LINK_MAX_ATTEMPTS = config("PAYMENT_LINK_MAX_ATTEMPTS", default=5, cast=int)
+
+# Gateway webhooks are stored in an inbox and applied by payments/webhooks.py:
+# "thread" in each web process, "external" for `manage.py process_webhooks --loop`
+WEBHOOK_WORKER = config("WEBHOOK_WORKER", default="thread")
+
 ELASTICSEARCH_DSL = {
 
     'default': {
@@ -2,7 +2,7 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Order, OrderItem, DeliveryPackage, PackageItem
+from .models import Order, OrderItem, DeliveryPackage, PackageItem, deferred_totals
 
 
 @admin.register(OrderItem)
@@ -23,6 +23,11 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ("order_number",)
     readonly_fields = ("order_number", "product_listing_count","total_units")
 
+    def save_related(self, request, form, formsets, change):
+        # Saving the item inlines recomputes the order totals once
+        with deferred_totals():
+            super().save_related(request, form, formsets, change)
+
 
 
 class PackageItemInline(admin.TabularInline):
@@ -5,9 +5,11 @@ from django.core.cache import cache
 
 # router.py
 from .models import Order, OrderItem, DeliveryPackage, PackageItem
+from .checkout import CheckoutError, place_order
 
 from .schemas import (
     OrderCreateSchema, OrderOutSchema, OrderUpdateSchema, OrderOutOneSchema,
+    CheckoutSchema, CheckoutErrorSchema,
     OrderItemCreateSchema, OrderItemUpdateSchema, OrderItemOutSchema,
     OrderItemOutOneSchema,
     DeliveryPackageOutSchema,
@@ -18,9 +20,10 @@ from .schemas import (
 
 from django.shortcuts import get_object_or_404
 
-from django.db.models import Sum, Count, F, Avg
+from django.db.models import Sum, Count, F, Avg, Prefetch
 
 from utils.pagination import PaginatedResponseSchema, paginate_queryset
+from utils.eager_loading import eager_load
 
 from ninja_jwt.authentication import JWTAuth
 
@@ -217,10 +220,28 @@ def create_order(request, payload: OrderCreateSchema):
     order.save()
     return order
 
+
+@router.post("/checkout/", response={200: OrderOutSchema, 400: CheckoutErrorSchema}, auth=JWTAuth())
+def checkout(request, payload: CheckoutSchema):
+    """
+    Place an order for the user's cart (cart_id) or a list of items in one
+    transaction: stock is checked and taken, the items are created and the
+    totals computed together, or nothing is changed
+    """
+    data = payload.dict()
+    items = data.pop("items") or None
+    if (data["cart_id"] is None) == (items is None):
+        return 400, {"detail": "Send either cart_id or items"}
+    try:
+        order = place_order(request.auth.id, lines=items, **data)
+    except CheckoutError as e:
+        return 400, {"detail": str(e)}
+    return order
+
 # Read Orders (List)
 
 @router.get("/orders/", response=PaginatedResponseSchema)
-@cache_response()
+@cache_response(tags=["Order:user:{user_id}"])
 def orders(request, 
            page: int = 1, 
            page_size: int = 10, 
@@ -247,98 +268,105 @@ def orders(request,
         qs = qs.order_by(ordering)
         query += f"&ordering={ordering}"
 
-    
-    orders_data = []
+
+    # Only the requested page is loaded and serialized
+    qs = qs.select_related("coupon", "offer")
 
     if items_needed:
         query += f"&items_needed={items_needed}"
+        qs = qs.prefetch_related(
+            Prefetch("order_items", queryset=OrderItem.objects.select_related("product_listing"))
+        )
 
-    for order in qs:
-        order_data = {
-            "id": order.id,
-            "order_number": order.order_number,
-            "user_id": order.user_id,
-            "total_amount": float(order.total_amount or 0),
-            # "subtotal_amount": float(order.subtotal_amount or 0),
-            "total_discount": float(order.total_discount or 0),
-            "shipping_address_id": order.shipping_address_id,
-            "payment_status": order.payment_status,
-            "notes": order.notes,
-            "created": order.created,
-            "updated": order.updated,
-            "product_listing_count": order.product_listing_count,
-            "total_units": order.total_units,
-            "coupon": {
-                "code":order.coupon.code ,
-                "discount_type":order.coupon.discount_type ,
-                "discount_value":order.coupon.discount_value ,
-                "coupon_type":order.coupon.coupon_type,
-            } if order.coupon else None,
-            "offer": {
-                "name": order.offer.name ,
-                "offer_type": order.offer.offer_type ,
-                "get_discount_percent": order.offer.get_discount_percent,
-            } if order.offer else None,
-        }
+    def serialize_orders(page_orders):
+        orders_data = []
+        for order in page_orders:
+            order_data = {
+                "id": order.id,
+                "order_number": order.order_number,
+                "user_id": order.user_id,
+                "total_amount": float(order.total_amount or 0),
+                # "subtotal_amount": float(order.subtotal_amount or 0),
+                "total_discount": float(order.total_discount or 0),
+                "shipping_address_id": order.shipping_address_id,
+                "payment_status": order.payment_status,
+                "notes": order.notes,
+                "created": order.created,
+                "updated": order.updated,
+                "product_listing_count": order.product_listing_count,
+                "total_units": order.total_units,
+                "coupon": {
+                    "code":order.coupon.code ,
+                    "discount_type":order.coupon.discount_type ,
+                    "discount_value":order.coupon.discount_value ,
+                    "coupon_type":order.coupon.coupon_type,
+                } if order.coupon else None,
+                "offer": {
+                    "name": order.offer.name ,
+                    "offer_type": order.offer.offer_type ,
+                    "get_discount_percent": order.offer.get_discount_percent,
+                } if order.offer else None,
+            }
 
-        # Add applied coupons
-        # applied_coupons = [{
-        #     "id": coupon.id,
-        #     "code": coupon.code,
-        #     "discount_type": coupon.discount_type,
-        #     "discount_value": float(coupon.discount_value or 0),
-        #     "discount_amount": float(coupon.discount_amount or 0),
-        #     "created": coupon.created,
-        # } for coupon in order.applied_coupons.all()]
-        # order_data["applied_coupons"] = applied_coupons
-
-        if items_needed:
-            order_items = order.order_items.all()
-            items_data = []
-            for item in order_items:
-                item_data = {
-                    "id": item.id,
-                    "product_listing_id": item.product_listing_id,
-                    "product_listing_name": item.product_listing.name,
-                    "product_slug": item.product_listing.slug,
-                    "product_main_image": item.product_listing.main_image.url if item.product_listing.main_image else None,
-                    "quantity": item.quantity,
-                    "status": item.status,
-                    "price": float(item.price or 0),
-                    "mrp": float(item.product_listing.mrp) if item.product_listing.mrp else float(item.product_listing.mrp or item.price),
-                    "review_added": item.review_added or False,
-                    # "original_price": float(item.original_price or 0),
-                    "discount_amount": float(item.discount_amount or 0),
-                    "subtotal": float(item.subtotal or 0),
-                    "shipped_date": item.shipped_date,
-                    "cancel_requested": item.cancel_requested,
-                    "cancel_reason":item.cancel_reason,
-                    "cancel_approved": item.cancel_approved,
-                    "return_requested": item.return_requested,
-                    "return_reason": item.return_reason,
-                    "return_approved": item.return_approved
-                }
+            # Add applied coupons
+            # applied_coupons = [{
+            #     "id": coupon.id,
+            #     "code": coupon.code,
+            #     "discount_type": coupon.discount_type,
+            #     "discount_value": float(coupon.discount_value or 0),
+            #     "discount_amount": float(coupon.discount_amount or 0),
+            #     "created": coupon.created,
+            # } for coupon in order.applied_coupons.all()]
+            # order_data["applied_coupons"] = applied_coupons
+
+            if items_needed:
+                order_items = order.order_items.all()
+                items_data = []
+                for item in order_items:
+                    item_data = {
+                        "id": item.id,
+                        "product_listing_id": item.product_listing_id,
+                        "product_listing_name": item.product_listing.name,
+                        "product_slug": item.product_listing.slug,
+                        "product_main_image": item.product_listing.main_image.url if item.product_listing.main_image else None,
+                        "quantity": item.quantity,
+                        "status": item.status,
+                        "price": float(item.price or 0),
+                        "mrp": float(item.product_listing.mrp) if item.product_listing.mrp else float(item.product_listing.mrp or item.price),
+                        "review_added": item.review_added or False,
+                        # "original_price": float(item.original_price or 0),
+                        "discount_amount": float(item.discount_amount or 0),
+                        "subtotal": float(item.subtotal or 0),
+                        "shipped_date": item.shipped_date,
+                        "cancel_requested": item.cancel_requested,
+                        "cancel_reason":item.cancel_reason,
+                        "cancel_approved": item.cancel_approved,
+                        "return_requested": item.return_requested,
+                        "return_reason": item.return_reason,
+                        "return_approved": item.return_approved
+                    }
                 
-                # Add applied offers
-                # applied_offers = [{
-                #     "id": offer.id,
-                #     "offer_name": offer.offer_name,
-                #     "offer_type": offer.offer_type,
-                #     "discount_amount": float(offer.discount_amount or 0),
-                #     "buy_quantity": offer.buy_quantity,
-                #     "get_quantity": offer.get_quantity,
-                #     "get_discount_percent": float(offer.get_discount_percent or 0),
-                #     "created": offer.created,
-                # } for offer in item.applied_offers.all()]
-                # item_data["applied_offers"] = applied_offers
+                    # Add applied offers
+                    # applied_offers = [{
+                    #     "id": offer.id,
+                    #     "offer_name": offer.offer_name,
+                    #     "offer_type": offer.offer_type,
+                    #     "discount_amount": float(offer.discount_amount or 0),
+                    #     "buy_quantity": offer.buy_quantity,
+                    #     "get_quantity": offer.get_quantity,
+                    #     "get_discount_percent": float(offer.get_discount_percent or 0),
+                    #     "created": offer.created,
+                    # } for offer in item.applied_offers.all()]
+                    # item_data["applied_offers"] = applied_offers
                 
-                items_data.append(item_data)
-            order_data["items"] = items_data
+                    items_data.append(item_data)
+                order_data["items"] = items_data
             
-        orders_data.append(order_data)
+            orders_data.append(order_data)
 
+        return orders_data
 
-    return paginate_queryset(request, orders_data, OrderOutSchema, page, page_size, query)
+    return paginate_queryset(request, qs, OrderOutSchema, page, page_size, query, transform=serialize_orders)
 
 # Read Single Order (Retrieve)
 @router.get("/orders/{order_id}/", response=OrderOutOneSchema)
@@ -447,7 +475,7 @@ def create_order_item(request, payload: OrderItemCreateSchema):
 # Read OrderItems (List)
 
 @router.get("/order-items/", response=PaginatedResponseSchema)
-@cache_response()
+@cache_response(tags=["OrderItem:order:{order_id}"])
 def order_items(
     request,  
     page: int = 1, 
@@ -482,78 +510,86 @@ def order_items(
     if ordering:
         query += f"&ordering={ordering}"
 
-    # Process items
-    order_items_data = []
-    for item in qs:
-        review = getattr(item, 'order_item_reviews', None)
+    # Load only the requested page, with the relations the items read
+    qs = qs.select_related("product_listing__tax_category")
+    if need_reviews:
+        qs = qs.select_related("order_item_reviews")
+    qs = eager_load(qs, OrderItemOutSchema)
+
+    def serialize_order_items(page_items):
+        order_items_data = []
+        for item in page_items:
+            review = getattr(item, 'order_item_reviews', None) if need_reviews else None
         
-        # Base order data
-        order_data = {
-            "id": item.order.id,
-        }
+            # Base order data
+            order_data = {
+                "id": item.order.id,
+            }
 
-        # Add user data if requested
-        if need_order_user:
-            order_data.update({
-                "user_id": item.order.user.id,
-                "user": {
-                    "id": item.order.user.id,
-                    "username": item.order.user.username,
-                    "first_name": item.order.user.first_name,
-                    "last_name": item.order.user.last_name,
-                }
-            })
+            # Add user data if requested
+            if need_order_user:
+                order_data.update({
+                    "user_id": item.order.user.id,
+                    "user": {
+                        "id": item.order.user.id,
+                        "username": item.order.user.username,
+                        "first_name": item.order.user.first_name,
+                        "last_name": item.order.user.last_name,
+                    }
+                })
         
-        item_data = {
-            "id": item.id,
-            "order_id": item.order.id,
-            "order": order_data,
-            "product_listing": {
-                "name": item.product_listing.name,
-                "id": item.product_listing.id,
-                "slug": item.product_listing.slug,
-                "price": item.product_listing.price,
+            item_data = {
+                "id": item.id,
+                "order_id": item.order.id,
+                "order": order_data,
+                "product_listing": {
+                    "name": item.product_listing.name,
+                    "id": item.product_listing.id,
+                    "slug": item.product_listing.slug,
+                    "price": item.product_listing.price,
+                    "mrp": float(item.product_listing.mrp) if item.product_listing.mrp else float(item.product_listing.mrp or item.product_listing.price),
+                    "cgst_rate": item.product_listing.tax_category.cgst_rate if item.product_listing.tax_category else None,
+                    "sgst_rate": item.product_listing.tax_category.sgst_rate if item.product_listing.tax_category else None,
+                    "igst_rate": item.product_listing.tax_category.igst_rate if item.product_listing.tax_category else None,
+                },
+                "quantity": item.quantity,
+                "price": float(item.price or 0),
                 "mrp": float(item.product_listing.mrp) if item.product_listing.mrp else float(item.product_listing.mrp or item.product_listing.price),
-                "cgst_rate": item.product_listing.tax_category.cgst_rate if item.product_listing.tax_category else None,
-                "sgst_rate": item.product_listing.tax_category.sgst_rate if item.product_listing.tax_category else None,
-                "igst_rate": item.product_listing.tax_category.igst_rate if item.product_listing.tax_category else None,
-            },
-            "quantity": item.quantity,
-            "price": float(item.price or 0),
-            "mrp": float(item.product_listing.mrp) if item.product_listing.mrp else float(item.product_listing.mrp or item.product_listing.price),
-            "subtotal": float(item.subtotal or 0),
-            "status": item.status,
-            "created": item.created,
-            "updated": item.updated,
-            "cancel_requested": item.cancel_requested,
-            "cancel_reason":item.cancel_reason,
-            "cancel_approved": item.cancel_approved,
-            "return_requested": item.return_requested,
-            "return_reason": item.return_reason,
-            "return_approved": item.return_approved,
-            "review": None
-        }
-            
-        # Add review data if requested
-        if need_reviews and review:
-            item_data["review"] = {
-                "id": review.id,
-                "rating": review.rating,
-                "title": review.title,
-                "comment": review.comment,
-                "created": review.created,
-                "updated": review.updated
+                "subtotal": float(item.subtotal or 0),
+                "status": item.status,
+                "created": item.created,
+                "updated": item.updated,
+                "cancel_requested": item.cancel_requested,
+                "cancel_reason":item.cancel_reason,
+                "cancel_approved": item.cancel_approved,
+                "return_requested": item.return_requested,
+                "return_reason": item.return_reason,
+                "return_approved": item.return_approved,
+                "review": None
             }
+            
+            # Add review data if requested
+            if need_reviews and review:
+                item_data["review"] = {
+                    "id": review.id,
+                    "rating": review.rating,
+                    "title": review.title,
+                    "comment": review.comment,
+                    "created": review.created,
+                    "updated": review.updated
+                }
 
-        order_items_data.append(item_data)
+            order_items_data.append(item_data)
 
-    return paginate_queryset(request, order_items_data, OrderItemOutSchema, page, page_size, query)
+        return order_items_data
+
+    return paginate_queryset(request, qs, OrderItemOutSchema, page, page_size, query, transform=serialize_order_items)
      
 
 # Read Single OrderItem (Retrieve)
 
 @router.get("/order-items/{order_item_id}/", response=OrderItemOutOneSchema)
-@cache_response()
+@cache_response(tags=["OrderItem:{order_item_id}"])
 def retrieve_order_item(request, order_item_id: int):
     order_item = get_object_or_404(OrderItem, id=order_item_id)
 
@@ -629,7 +665,7 @@ def delete_order_item(request, order_item_id: int):
 
 # Read Orders (List)
 @router.get("/delivery-packages/", response=PaginatedResponseSchema)
-@cache_response()
+@cache_response(tags=["DeliveryPackage:order:{order_id}"])
 def delivery_packages(request,  page: int = 1, page_size: int = 10, order_id: int = None, ordering: str = None):
     # qs = Order.objects.all()
     qs = DeliveryPackage.objects.all()  # Fetch order items efficiently
@@ -0,0 +1,139 @@
+"""
+Placing an order from a cart or an item list in one transaction.
+
+Clients used to POST /orders/ and then one /order-items/ per line. Each
+OrderItem.save() read and decremented the listing's stock in Python, saved
+the listing (cache, facet and search signals) and recomputed the order
+totals. place_order() does the whole checkout at once:
+- the listings are locked with select_for_update in id order, so concurrent
+  checkouts of overlapping carts wait for each other instead of deadlocking
+  or selling the same units twice
+- the order is refused when a listing does not have the stock
+- the order is created, its items are bulk_created and the stock is taken
+  off with a single UPDATE of F() expressions
+- the order totals are computed once
+The listings' caches, facets and search documents are refreshed once per
+listing. The Order post_save signal still sends the order notification once
+the transaction commits.
+"""
+from django.db import models, transaction
+from django.db.models import Case, F, When
+
+from carts.models import Cart
+from offers.models import Offer
+from products import facets
+from products.models import ProductListing
+from products.signals import product_listing_tags
+from search.signals import enqueue
+from utils.cache import invalidate_tags
+
+from .models import Order, OrderItem
+
+
+class CheckoutError(Exception):
+    """The order cannot be placed; the message is returned to the client"""
+
+
+def _cart_lines(cart_id, user_id):
+    # Only the buyer's own carts can be checked out
+    cart = Cart.objects.select_for_update().filter(id=cart_id, user_id=user_id).first()
+    if cart is None:
+        raise CheckoutError(f"Cart {cart_id} not found")
+    if cart.purchased:
+        raise CheckoutError(f"Cart {cart_id} has already been checked out")
+    lines = [
+        {"product_listing_id": listing_id, "quantity": quantity}
+        for listing_id, quantity in cart.cart_items.filter(product_listing__isnull=False)
+        .order_by("id").values_list("product_listing_id", "quantity")
+    ]
+    return cart, lines
+
+
+def _lock_listings(quantities):
+    """Lock the listings in id order and check they can cover `quantities`"""
+    listings = {
+        listing.id: listing
+        for listing in ProductListing.objects.select_for_update().filter(id__in=quantities).order_by("id")
+    }
+    problems = []
+    for listing_id, quantity in quantities.items():
+        listing = listings.get(listing_id)
+        if listing is None:
+            problems.append(f"Product listing {listing_id} not found")
+        elif listing.stock < quantity:
+            problems.append(f"Only {listing.stock} left of {listing.name}")
+    if problems:
+        raise CheckoutError("; ".join(problems))
+    return listings
+
+
+def _listings_changed(listings):
+    invalidate_tags(*{tag for listing in listings for tag in product_listing_tags(listing)})
+    for listing in listings:
+        facets.record_change(listing.id)
+
+
+def place_order(user_id, lines=None, cart_id=None, **order_fields):
+    """
+    Create an order for user_id with its items and take their stock. `lines`
+    are dicts with product_listing_id, quantity and optionally offer_id; with
+    cart_id the items of that user's cart are ordered instead and the cart is
+    marked purchased.
+    Raises CheckoutError, leaving nothing changed, when the order cannot be
+    placed.
+    """
+    with transaction.atomic():
+        cart = None
+        if cart_id is not None:
+            cart, lines = _cart_lines(cart_id, user_id)
+        if not lines:
+            raise CheckoutError("No items to order")
+
+        quantities = {}
+        for line in lines:
+            if line["quantity"] < 1:
+                raise CheckoutError("Quantity must be at least 1")
+            listing_id = line["product_listing_id"]
+            quantities[listing_id] = quantities.get(listing_id, 0) + line["quantity"]
+
+        listings = _lock_listings(quantities)
+        offers = Offer.objects.in_bulk({line["offer_id"] for line in lines if line.get("offer_id")})
+
+        # total_amount is filled in by update_totals() below
+        order = Order(user_id=user_id, total_amount=0, **order_fields)
+        order.save()
+
+        items = []
+        for line in lines:
+            listing = listings[line["product_listing_id"]]
+            item = OrderItem(
+                order=order,
+                product_listing=listing,
+                quantity=line["quantity"],
+                price=listing.price,
+                offer=offers.get(line.get("offer_id")),
+            )
+            item.subtotal = item.quantity * item.price
+            item.discount_amount = item.offer_discount()
+            items.append(item)
+        OrderItem.objects.bulk_create(items)
+
+        ProductListing.objects.filter(id__in=quantities).update(
+            stock=F("stock") - Case(
+                *[When(id=listing_id, then=quantity) for listing_id, quantity in quantities.items()],
+                default=0,
+                output_field=models.PositiveIntegerField(),
+            )
+        )
+        order.update_totals()
+
+        if cart is not None:
+            cart.purchased = True
+            cart.save(update_fields=["purchased", "updated"])
+
+        # bulk_create() and update() send no signals
+        enqueue("product_listings", list(quantities))
+        changed = list(listings.values())
+        transaction.on_commit(lambda: _listings_changed(changed))
+        transaction.on_commit(lambda: invalidate_tags(f"OrderItem:order:{order.id}"))
+    return order
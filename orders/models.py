@@ -1,4 +1,9 @@
+import threading
+from contextlib import contextmanager
+
 from django.db import models
+from django.db.models import Count, ExpressionWrapper, F, Sum
+from django.db.models.functions import Floor
 from users.models import ShippingAddress
 from products.models import ProductListing
 
@@ -28,6 +33,36 @@ PAYMENT_CHOICES = (
     ('refunded', 'Refunded'),
 )
 
+LINE_TOTAL = ExpressionWrapper(F("quantity") * F("price"), output_field=models.DecimalField(max_digits=14, decimal_places=2))
+
+_deferred = threading.local()
+
+
+def _deferred_orders():
+    return getattr(_deferred, "orders", None)
+
+
+@contextmanager
+def deferred_totals():
+    """
+    Order.update_totals() calls inside the block only mark the order; each
+    marked order is recomputed once when the block exits normally. Use it
+    around saving several OrderItems of the same order.
+    """
+    if _deferred_orders() is not None:
+        # Nested: the outermost block recomputes
+        yield
+        return
+    _deferred.orders = {}
+    try:
+        yield
+        orders = _deferred.orders
+    finally:
+        _deferred.orders = None
+    for order in orders.values():
+        order.update_totals()
+
+
 class Order(models.Model):
 
     estore = models.ForeignKey(EStore, on_delete=models.SET_NULL, null=True, blank=True, related_name="estore_orders")
@@ -81,55 +116,77 @@ class Order(models.Model):
     @property
     def subtotal_amount(self):
         """Calculate the subtotal amount before any discounts"""
-        return sum(item.quantity * item.price for item in self.order_items.all())
+        return self.order_items.aggregate(subtotal=Sum(LINE_TOTAL))["subtotal"] or 0
+
+    def item_totals(self, offer=None):
+        """
+        Item count, units, subtotal and item offer discounts in one query, plus
+        the buy_x_get_y discount for `offer` when given
+        """
+        aggregates = {
+            "count": Count("id"),
+            "units": Sum("quantity"),
+            "subtotal": Sum(LINE_TOTAL),
+            "item_discount": Sum("discount_amount"),
+        }
+        if offer is not None and offer.offer_type == 'buy_x_get_y' and offer.get_discount_percent > 0:
+            # price of the free units: (quantity // buy_quantity) * get_quantity per line
+            aggregates["free_value"] = Sum(
+                F("price") * Floor(F("quantity") / offer.buy_quantity) * offer.get_quantity,
+                output_field=models.DecimalField(max_digits=14, decimal_places=2),
+            )
+        totals = self.order_items.aggregate(**aggregates)
+        return {key: value or 0 for key, value in totals.items()}
 
     def update_totals(self):
+        if _deferred_orders() is not None:
+            # Inside deferred_totals(): computed once when the block ends
+            _deferred_orders()[self.pk] = self
+            return
+
+        offer = self.offer if self.offer and self.offer.is_active else None
+        totals = self.item_totals(offer)
+        subtotal = totals["subtotal"]
+
         # Update product listing count and total units
-        self.product_listing_count = self.order_items.count()
-        self.total_units = sum(item.quantity for item in self.order_items.all())
+        self.product_listing_count = totals["count"]
+        self.total_units = totals["units"]
         
         # Calculate subtotal (before discounts)
-        self.total_amount = sum(item.quantity * item.price for item in self.order_items.all())
+        self.total_amount = subtotal
         
         # Initialize discount amounts
         self.discount_amount_coupon = 0
-        self.discount_amount_offer = 0
         
         # Calculate offer discounts from OrderItems
-        self.discount_amount_offer = sum(item.discount_amount for item in self.order_items.all())
+        self.discount_amount_offer = totals["item_discount"]
         
         # Calculate coupon discount if a valid coupon is applied
         if self.coupon and self.coupon.is_valid():
             print("applying coupon")
             if self.coupon.coupon_type == 'cart':
                 # Cart-wide coupon
-                if self.subtotal_amount >= self.coupon.min_cart_value:
+                if subtotal >= self.coupon.min_cart_value:
                     if self.coupon.discount_type == 'percentage':
-                        discount = (self.coupon.discount_value / 100) * self.subtotal_amount
+                        discount = (self.coupon.discount_value / 100) * subtotal
                         if self.coupon.max_discount_amount:
                             discount = min(discount, self.coupon.max_discount_amount)
                         self.discount_amount_coupon = discount
                     else:  # fixed
-                        self.discount_amount_coupon = min(self.coupon.discount_value, self.subtotal_amount)
+                        self.discount_amount_coupon = min(self.coupon.discount_value, subtotal)
 
         # Calculate offer discount if a valid offer is applied
-        if self.offer and self.offer.is_active:
-            if self.offer.offer_type == 'buy_x_get_y':
-                for item in self.order_items.all():
-                    eligible_sets = item.quantity // self.offer.buy_quantity
-                    free_items = eligible_sets * self.offer.get_quantity
-                    if self.offer.get_discount_percent > 0:
-                        discount = (self.offer.get_discount_percent / 100) * (item.price * free_items)
-                        self.discount_amount_offer += discount
-            elif self.offer.offer_type == 'bundle':
+        if offer:
+            if offer.offer_type == 'buy_x_get_y':
+                if offer.get_discount_percent > 0:
+                    self.discount_amount_offer += (offer.get_discount_percent / 100) * totals["free_value"]
+            elif offer.offer_type == 'bundle':
                 # Bundle offer logic (assumes specific products are bundled)
                 # You may need to verify if order_items match bundle requirements
                 pass  # Implement based on your bundle logic
-            elif self.offer.offer_type == 'discount':
-                # Direct discount logic
-                for item in self.order_items.all():
-                    # Assuming offer applies to specific products
-                    self.discount_amount_offer += (self.offer.get_discount_percent / 100) * (item.price * item.quantity)
+            elif offer.offer_type == 'discount':
+                # Direct discount logic, assuming the offer applies to every item
+                self.discount_amount_offer += (offer.get_discount_percent / 100) * subtotal
             
         # Calculate total discount
         self.discount_amount_coupon = round(self.discount_amount_coupon)
@@ -215,24 +272,29 @@ class OrderItem(models.Model):
         self.order.update_totals()
     
 
+    def offer_discount(self):
+        """Discount from the item's offer for its quantity and price"""
+        if not (self.offer and self.offer.is_active and timezone.now() <= self.offer.valid_until):
+            return 0
+        if self.offer.offer_type == 'buy_x_get_y':
+            eligible_sets = self.quantity // self.offer.buy_quantity
+            free_items = eligible_sets * self.offer.get_quantity
+            if self.offer.get_discount_percent > 0:
+                return (self.offer.get_discount_percent / 100) * (self.price * free_items)
+        elif self.offer.offer_type == 'bundle':
+            # Bundle logic depends on multiple items; skip unless bundle is verified
+            pass
+        elif self.offer.offer_type == 'discount':
+            return (self.offer.get_discount_percent / 100) * (self.price * self.quantity)
+        return 0
+
     def save(self, *args, **kwargs):
         # Calculate offer discount if an offer is applied
         self.discount_amount = 0
         self.price = self.product_listing.price
         if not self.pk:
             self.subtotal = (self.quantity * self.price)
-
-            if self.offer and self.offer.is_active and timezone.now() <= self.offer.valid_until:
-                if self.offer.offer_type == 'buy_x_get_y':
-                    eligible_sets = self.quantity // self.offer.buy_quantity
-                    free_items = eligible_sets * self.offer.get_quantity
-                    if self.offer.get_discount_percent > 0:
-                        self.discount_amount = (self.offer.get_discount_percent / 100) * (self.price * free_items)
-                elif self.offer.offer_type == 'bundle':
-                    # Bundle logic depends on multiple items; skip unless bundle is verified
-                    pass
-                elif self.offer.offer_type == 'discount':
-                    self.discount_amount = (self.offer.get_discount_percent / 100) * (self.price * self.quantity)
+            self.discount_amount = self.offer_discount()
 
             # Calculate subtotal (price * quantity - discount)
 
@@ -312,10 +374,12 @@ class DeliveryPackage(models.Model):
 
     def update_order_items_status(self):
         """Update the status of all related OrderItems to match the package status."""
-        for package_item in self.package_items.all():
-            order_item = package_item.order_item
-            order_item.status = self.status
-            order_item.save()
+        # The order's totals are recomputed once, not once per item
+        with deferred_totals():
+            for package_item in self.package_items.select_related("order_item"):
+                order_item = package_item.order_item
+                order_item.status = self.status
+                order_item.save()
 
     def update_package_metrics(self):
         """Update counts based on package items."""
@@ -201,6 +201,25 @@ class OrderCreateSchema(Schema):
     offer_id: Optional[int] = None
     coupon_id: Optional[int] = None
 
+class CheckoutItemSchema(Schema):
+    product_listing_id: int
+    quantity: int = 1
+    offer_id: Optional[int] = None
+
+class CheckoutSchema(Schema):
+    # The order is placed for the authenticated user
+    # Either a cart to check out or the items to order
+    cart_id: Optional[int] = None
+    items: Optional[List[CheckoutItemSchema]] = None
+    shipping_address_id: Optional[int] = None
+    estore_id: Optional[int] = None
+    notes: Optional[str] = None
+    offer_id: Optional[int] = None
+    coupon_id: Optional[int] = None
+
+class CheckoutErrorSchema(Schema):
+    detail: str
+
 class OrderUpdateSchema(Schema):
     # status: Optional[str] = None
     payment_status: Optional[str] = None
@@ -8,7 +8,7 @@ from utils.constants import wa_plivo_templates
 from .models import Order, DeliveryPackage, OrderItem
 # from utils.send_email import send_mail_thread
 # from django.conf import settings
-from django.core.cache import cache
+from utils.cache import invalidate_tags
 # from django.db.models import Prefetch
 
 from utils.send_mail import send_mail
@@ -32,36 +32,16 @@ def get_order_items_by_seller(order):
 
 @receiver(post_save, sender=Order)
 def clear_order_cache(sender, instance, **kwargs):
-    try:
-        pattern = f"*:/api/order/orders*user_id={instance.user.id}*"   
-        for key in cache.client.get_client().scan_iter(pattern):
-            cache.client.get_client().delete(key)
-    except Exception as e:
-        print(f"Error clearing order cache: {e}")
-        print("Non-Redis cache backend detected, clearing all cache.")
-        cache.clear()
+    if instance.user_id:
+        invalidate_tags(f"Order:user:{instance.user_id}")
 
 @receiver(post_save, sender=OrderItem)
-def clear_order_cache(sender, instance, **kwargs):
-    try:
-        pattern = f"*:/api/order/order-items*order_id={instance.order.id}*" 
-        for key in cache.client.get_client().scan_iter(pattern):
-            cache.client.get_client().delete(key)
-    except Exception as e:
-        print(f"Error clearing order item cache: {e}")
-        print("Non-Redis cache backend detected, clearing all cache.")
-        cache.clear()
+def clear_order_item_cache(sender, instance, **kwargs):
+    invalidate_tags(f"OrderItem:order:{instance.order_id}", f"OrderItem:{instance.id}")
 
 @receiver(post_save, sender=DeliveryPackage)
 def clear_delivery_package_cache(sender, instance, **kwargs):
-    try:
-        pattern = f"*:/api/order/delivery-packages*order_id={instance.order.id}*" 
-        for key in cache.client.get_client().scan_iter(pattern):
-            cache.client.get_client().delete(key)
-    except Exception as e:
-        print(f"Error clearing delivery package cache: {e}")
-        print("Non-Redis cache backend detected, clearing all cache.")
-        cache.clear()
+    invalidate_tags(f"DeliveryPackage:order:{instance.order_id}")
 
 
 @receiver(post_save, sender=Order)
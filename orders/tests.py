@@ -1,3 +1,274 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from carts.models import Cart, CartItem
+from offers.models import Offer
+from products.models import Category, Product, ProductListing
+from utils.query_monitor import QueryBudgetExceeded, QueryMonitorMiddleware
+
+from .checkout import CheckoutError, place_order
+from .models import Order, OrderItem, deferred_totals
+
+
+@override_settings(QUERY_MONITOR_ENABLED=True, QUERY_MONITOR_RAISE=True)
+class OrderListQueryBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="budget", mobile="9000000001")
+        category = Category.add_root(name="Toys", approved=True)
+        product = Product.objects.create(name="Blocks", category=category)
+        listings = [
+            ProductListing.objects.create(product=product, name=f"Blocks {i}", price=100, mrp=120, stock=50)
+            for i in range(3)
+        ]
+        for _ in range(3):
+            order = Order.objects.create(user=cls.user, total_amount=0)
+            for listing in listings:
+                OrderItem(order=order, product_listing=listing, quantity=1, price=0).save()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_order_list_stays_within_budget(self):
+        # QUERY_BUDGETS caps /api/order/orders/; an overrun raises QueryBudgetExceeded
+        response = self.client.get(
+            "/api/order/orders/", {"user_id": self.user.id, "items_needed": "true", "page_size": 10}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 3)
+        self.assertIn("db;dur=", response["Server-Timing"])
+
+    def test_budget_overrun_raises(self):
+        with override_settings(QUERY_BUDGETS={"/api/order/orders/": 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get("/api/order/orders/", {"user_id": self.user.id})
+
+    def test_async_view_queries_are_recorded(self):
+        async def view(request):
+            count = await sync_to_async(Order.objects.count)()
+            return HttpResponse(str(count))
+
+        middleware = QueryMonitorMiddleware(view)
+        response = async_to_sync(middleware)(RequestFactory().get("/api/order/orders/"))
+        self.assertEqual(response.content, b"3")
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
+
+
+class PlaceOrderTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="buyer", mobile="9000000004")
+        category = Category.add_root(name="Toys", approved=True)
+        product = Product.objects.create(name="Blocks", category=category)
+        cls.listings = [
+            ProductListing.objects.create(product=product, name=f"Blocks {i}", price=100 + i, mrp=120, stock=5)
+            for i in range(2)
+        ]
+
+    def stock(self):
+        return [listing.stock for listing in ProductListing.objects.order_by("id")]
+
+    def test_stock_is_taken_once_per_listing(self):
+        first, second = self.listings
+        order = place_order(self.user.id, lines=[
+            {"product_listing_id": first.id, "quantity": 2},
+            {"product_listing_id": second.id, "quantity": 1},
+            {"product_listing_id": first.id, "quantity": 3},
+        ])
+
+        self.assertEqual(self.stock(), [0, 4])
+        self.assertEqual(order.order_items.count(), 3)
+        order.refresh_from_db()
+        self.assertEqual((order.total_units, order.total_amount), (6, 601))
+
+    def test_shortage_leaves_nothing_changed(self):
+        first, second = self.listings
+        lines = [
+            {"product_listing_id": second.id, "quantity": 1},
+            {"product_listing_id": first.id, "quantity": 4},
+            {"product_listing_id": first.id, "quantity": 2},
+        ]
+        with self.assertRaisesMessage(CheckoutError, "Only 5 left of Blocks"):
+            place_order(self.user.id, lines=lines)
+
+        self.assertEqual(self.stock(), [5, 5])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_cart_is_marked_purchased(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product_listing=self.listings[0], quantity=2)
+
+        order = place_order(self.user.id, cart_id=cart.id)
+
+        cart.refresh_from_db()
+        self.assertTrue(cart.purchased)
+        self.assertEqual(list(order.order_items.values_list("product_listing_id", "quantity")), [(self.listings[0].id, 2)])
+        with self.assertRaisesMessage(CheckoutError, f"Cart {cart.id} has already been checked out"):
+            place_order(self.user.id, cart_id=cart.id)
+
+    def test_other_users_cart_is_rejected(self):
+        other = get_user_model().objects.create(username="other", mobile="9000000005")
+        cart = Cart.objects.create(user=other)
+        CartItem.objects.create(cart=cart, product_listing=self.listings[0], quantity=1)
+
+        with self.assertRaisesMessage(CheckoutError, f"Cart {cart.id} not found"):
+            place_order(self.user.id, cart_id=cart.id)
+
+        cart.refresh_from_db()
+        self.assertFalse(cart.purchased)
+        self.assertEqual(self.stock(), [5, 5])
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderTotalsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="totals", mobile="9000000006")
+        category = Category.add_root(name="Toys", approved=True)
+        product = Product.objects.create(name="Blocks", category=category)
+        cls.listings = [
+            ProductListing.objects.create(product=product, name=f"Blocks {i}", price=price, mrp=1000, stock=50)
+            for i, price in enumerate([Decimal("99.99"), Decimal("250.50"), Decimal("13.37"), Decimal("7")])
+        ]
+        valid_until = timezone.now() + timedelta(days=3)
+        cls.buy_x_get_y = Offer.objects.create(
+            name="Buy 2 get 1", description="", offer_type="buy_x_get_y", buy_quantity=2, get_quantity=1,
+            get_discount_percent=Decimal("50"), valid_until=valid_until,
+        )
+        cls.discount = Offer.objects.create(
+            name="12.5% off", description="", offer_type="discount", get_discount_percent=Decimal("12.5"),
+            valid_until=valid_until,
+        )
+
+    def create_order(self, offer=None):
+        order = Order.objects.create(user=self.user, total_amount=0, offer=offer)
+        for listing, quantity in zip(self.listings, [1, 2, 5, 7]):
+            OrderItem(order=order, product_listing=listing, quantity=quantity, price=0, offer=self.discount).save()
+        order.refresh_from_db()
+        return order
+
+    def per_item_totals(self, order):
+        """The totals as update_totals() computed them item by item"""
+        items = list(order.order_items.all())
+        discount = sum(item.discount_amount for item in items)
+        offer = order.offer
+        if offer and offer.is_active:
+            for item in items:
+                if offer.offer_type == "buy_x_get_y":
+                    free = (item.quantity // offer.buy_quantity) * offer.get_quantity
+                    discount += (offer.get_discount_percent / 100) * (item.price * free)
+                elif offer.offer_type == "discount":
+                    discount += (offer.get_discount_percent / 100) * (item.price * item.quantity)
+        return (
+            len(items),
+            sum(item.quantity for item in items),
+            sum(item.price * item.quantity for item in items),
+            round(discount),
+        )
+
+    def assertMatchesPerItemTotals(self, order):
+        self.assertEqual(
+            (order.product_listing_count, order.total_units, order.total_amount, order.discount_amount_offer),
+            self.per_item_totals(order),
+        )
+
+    def test_totals_without_offer(self):
+        self.assertMatchesPerItemTotals(self.create_order())
+
+    def test_totals_with_buy_x_get_y_offer(self):
+        order = self.create_order(self.buy_x_get_y)
+        # free units are floored per line: 0 + 1 + 2 + 3
+        self.assertEqual(order.item_totals(self.buy_x_get_y)["free_value"], Decimal("250.50") + 2 * Decimal("13.37") + 3 * 7)
+        self.assertMatchesPerItemTotals(order)
+
+    def test_totals_with_discount_offer(self):
+        self.assertMatchesPerItemTotals(self.create_order(self.discount))
+
+    def test_deferred_totals_recompute_each_order_once(self):
+        orders = [Order.objects.create(user=self.user, total_amount=0) for _ in range(2)]
+        item_totals = Order.item_totals
+        with mock.patch.object(Order, "item_totals", autospec=True, side_effect=item_totals) as computed:
+            with deferred_totals():
+                for order in orders:
+                    for listing in self.listings:
+                        OrderItem(order=order, product_listing=listing, quantity=1, price=0).save()
+                self.assertEqual(computed.call_count, 0)
+
+        self.assertEqual(computed.call_count, 2)
+        for order in orders:
+            order.refresh_from_db()
+            self.assertEqual((order.product_listing_count, order.total_units), (4, 4))
+            self.assertEqual(order.total_amount, sum(listing.price for listing in self.listings))
+
+
+class OrderCursorPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="cursor", mobile="9000000007")
+        for i in range(7):
+            order = Order.objects.create(user=cls.user, total_amount=0)
+            # total_amount repeats, so the keyset needs the id tie-breaker
+            Order.objects.filter(id=order.id).update(total_amount=[300, 100, 200][i % 3])
+        cls.expected = list(Order.objects.order_by("total_amount", "id").values_list("id", flat=True))
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def follow(self, link):
+        parts = urlsplit(link)
+        return self.get(f"{parts.path}?{parts.query}")
+
+    def first_page(self):
+        return self.get(f"/api/order/orders/?user_id={self.user.id}&ordering=total_amount&page_size=3&pagination=cursor")
+
+    def test_forward_and_backward_traversal(self):
+        pages = [self.first_page()]
+        while pages[-1]["next"]:
+            pages.append(self.follow(pages[-1]["next"]))
+
+        self.assertIsNone(pages[0]["previous"])
+        self.assertEqual([[order["id"] for order in page["results"]] for page in pages],
+                         [self.expected[0:3], self.expected[3:6], self.expected[6:]])
+
+        page = pages[-1]
+        backwards = []
+        while page["previous"]:
+            page = self.follow(page["previous"])
+            backwards.append([order["id"] for order in page["results"]])
+        self.assertEqual(backwards, [self.expected[3:6], self.expected[0:3]])
+
+    def test_response_shape_matches_page_pagination(self):
+        cursor_page = self.first_page()
+        numbered_page = self.get(f"/api/order/orders/?user_id={self.user.id}&ordering=total_amount&page_size=3")
+
+        self.assertEqual(cursor_page.keys(), numbered_page.keys())
+        self.assertEqual(cursor_page["count"], numbered_page["count"])
+        self.assertEqual(cursor_page["results"], numbered_page["results"])
+        self.assertIn("cursor=", cursor_page["next"])
+
+    def test_malformed_cursor_is_rejected(self):
+        for cursor in ["not-a-cursor", "WzEsMl0", "eyJ2IjpbImFiYyIsMV19"]:
+            response = self.client.get("/api/order/orders/", {
+                "user_id": self.user.id, "ordering": "total_amount", "pagination": "cursor", "cursor": cursor,
+            })
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json(), {"detail": "Invalid cursor"})
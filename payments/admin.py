@@ -2,10 +2,23 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Payment 
+from .models import Payment, PaymentLinkJob, WebhookEvent
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     search_fields = ("order", "transaction_id",)
     list_filter = ("transaction_id","status",)
-    list_display = ("order", "transaction_id" ,"status", "amount", "updated")
\ No newline at end of file
+    list_display = ("order", "transaction_id" ,"status", "amount", "updated")
+
+@admin.register(PaymentLinkJob)
+class PaymentLinkJobAdmin(admin.ModelAdmin):
+    search_fields = ("transaction_id",)
+    list_filter = ("status",)
+    list_display = ("transaction_id", "status", "attempts", "next_attempt", "updated")
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    search_fields = ("transaction_id", "event_key")
+    list_filter = ("gateway", "result")
+    list_display = ("transaction_id", "gateway", "gateway_status", "result", "received", "processed")
@@ -8,11 +8,19 @@ router = Router()
 
 from .models import Payment
 from django.shortcuts import get_object_or_404
-from utils.payment import check_payment_status
+from utils.payment import (
+    acheck_payment_status, acreate_payment, check_payment_status, map_cashfree_status, map_phonepay_status,
+)
+from utils.gateway_client import gateway_metrics
+from asgiref.sync import sync_to_async
+from uuid import uuid4
 from utils.pagination import PaginatedResponseSchema, paginate_queryset
-from .schemas import PaymentOutSchema, PaymentCreateSchema
+from .schemas import PaymentOutSchema, PaymentCreateSchema, PaymentLinkOutSchema
+from .webhooks import cashfree_event, phonepe_event, record_event
+from django.conf import settings
 from .models import Payment
-from ninja_jwt.authentication import JWTAuth
+from ninja_jwt.authentication import AsyncJWTAuth
+from utils.auth import AdminJWTAuth
 import hashlib
 
 # logging.basicConfig(filename='webhook.log', level=logging.INFO)
@@ -43,68 +51,8 @@ class PaymentWebhookCallbackSchema(Schema):
     order_id: Optional[int] = None
     platform: Optional[str] = None
 
-def map_phonepay_status(phonepay_status):
-    """
-    Map PhonePe payment status to our payment model status values
-    
-    PhonePe typically returns: PAYMENT_SUCCESS, PAYMENT_PENDING, PAYMENT_ERROR, etc.
-    We need to map these to: completed, pending, failed
-    
-    Args:
-        phonepay_status: Status string from PhonePe API (case-insensitive)
-    
-    Returns:
-        str: Mapped status value ('completed', 'pending', 'failed', 'refunded')
-    """
-    if not phonepay_status:
-        return 'pending'
-    
-    status_lower = str(phonepay_status).lower()
-    
-    # Map various PhonePe status values to our payment statuses
-    if 'success' in status_lower or 'completed' in status_lower:
-        return 'completed'
-    elif 'pending' in status_lower or 'processing' in status_lower:
-        return 'pending'
-    elif 'fail' in status_lower or 'error' in status_lower:
-        return 'failed'
-    elif 'refund' in status_lower:
-        return 'refunded'
-    else:
-        # Default to pending for unknown statuses
-        print(f"Unknown PhonePe status: {phonepay_status}, defaulting to 'pending'")
-        return 'pending'
-
-def map_cashfree_status(cashfree_status):
-    """
-    Map Cashfree payment status to our payment model status values
-    
-    Args:
-        cashfree_status: Status string from Cashfree API
-    
-    Returns:
-        str: Mapped status value ('completed', 'pending', 'failed', 'refunded')
-    """
-    if not cashfree_status:
-        return 'pending'
-    
-    status_lower = str(cashfree_status).lower()
-    
-    # Map Cashfree payment status values to our payment statuses
-    # Cashfree returns: SUCCESS, PENDING, FAILED, etc.
-    if status_lower == 'success' or status_lower == 'paid':
-        return 'completed'
-    elif status_lower == 'pending' or status_lower == 'active' or 'partially' in status_lower:
-        return 'pending'
-    elif status_lower == 'failed' or status_lower == 'expired' or status_lower == 'cancelled' or status_lower == 'user_dropped':
-        return 'failed'
-    elif status_lower == 'refunded' or 'refund' in status_lower:
-        return 'refunded'
-    else:
-        print(f"Unknown Cashfree status: {cashfree_status}, defaulting to 'pending'")
-        return 'pending'
-
-# Enhanced webhook endpoint with platform support
+# Webhooks are stored in the WebhookEvent inbox and acknowledged right away;
+# payments.webhooks applies them in batches and drops gateway retries
 @router.post("/phonepe-webhook/")
 def phonepe_webhook(request):
     # Get the Authorization header from PhonePe
@@ -133,47 +81,24 @@ def phonepe_webhook(request):
             content_type="application/json"
         )
 
-    # Extract payment details
-    payment_status = data.get("payload", {}).get("state", "UNKNOWN")
-    order_id = data.get("payload", {}).get("orderId", None)  # PhonePe's Merchant Reference ID
-    
-    if not order_id:
+    event = phonepe_event(data)
+    if not event["transaction_id"]:
         return HttpResponse(
             content=json.dumps({"error": "Missing orderId in payload"}),
             status=400,
             content_type="application/json"
         )
 
-    # Find and update payment record
     try:
-        # Find payment by transaction_id (which stores the gateway-specific ID)
-        payment = Payment.objects.get(transaction_id=order_id)
-        
-        # Update payment status
-        mapped_status = map_phonepay_status(payment_status)
-        if payment.status != mapped_status:
-            payment.status = mapped_status
-            payment.save()
-            print(f"Payment {payment.id} status updated to: {mapped_status}")
-        else:
-            print(f"Payment {payment.id} status unchanged: {mapped_status}")
-        
-        return {"success": True, "message": "Webhook received and processed"}
-        
-    except Payment.DoesNotExist:
-        print(f"Payment not found for orderId: {order_id}")
-        return HttpResponse(
-            content=json.dumps({"error": "Payment not found"}),
-            status=404,
-            content_type="application/json"
-        )
+        record_event(event)
     except Exception as e:
-        print(f"Error processing webhook: {e}")
+        print(f"Error storing webhook: {e}")
         return HttpResponse(
             content=json.dumps({"error": "Error processing webhook"}),
             status=500,
             content_type="application/json"
         )
+    return {"success": True, "message": "Webhook received"}
 
 # Cashfree webhook endpoint
 @router.post("/cashfree-webhook/")
@@ -187,67 +112,6 @@ def cashfree_webhook(request):
         raw_data = request.body.decode("utf-8")
         data = json.loads(raw_data)
         print("Cashfree webhook data:", json.dumps(data, indent=2))
-        
-        # Cashfree webhook structure:
-        # {
-        #   "data": {
-        #     "order": {
-        #       "order_tags": {
-        #         "link_id": "e9fa3014-f82c-4aa9-bbc3-f0897215c159"
-        #       }
-        #     },
-        #     "payment": {
-        #       "payment_status": "SUCCESS"
-        #     }
-        #   }
-        # }
-        webhook_data = data.get("data", {})
-        order_data = webhook_data.get("order", {})
-        payment_data = webhook_data.get("payment", {})
-        
-        # Extract link_id from order_tags.link_id (this is what we stored in transaction_id)
-        order_tags = order_data.get("order_tags", {})
-        link_id = order_tags.get("link_id")
-        
-        # Extract payment status from payment.payment_status (e.g., "SUCCESS", "FAILED", "PENDING")
-        payment_status = payment_data.get("payment_status", "")
-        
-        if not link_id:
-            print(f"Warning: link_id not found in webhook. order_tags: {order_tags}")
-            return HttpResponse(
-                content=json.dumps({"error": "Missing link_id in webhook payload"}),
-                status=400,
-                content_type="application/json"
-            )
-        
-        # Find payment record
-        try:
-            # Find payment by transaction_id (which stores the link_id)
-            payment = Payment.objects.get(transaction_id=link_id)
-            
-            # Map Cashfree payment status to our payment status
-            if payment_status:
-                mapped_status = map_cashfree_status(payment_status)
-                if payment.status != mapped_status:
-                    old_status = payment.status
-                    payment.status = mapped_status
-                    payment.save()
-                    print(f"Payment {payment.id} status updated from '{old_status}' to '{mapped_status}' (from Cashfree: {payment_status})")
-                else:
-                    print(f"Payment {payment.id} status unchanged: {mapped_status}")
-            else:
-                print(f"Warning: No payment_status in Cashfree webhook for link_id: {link_id}")
-            
-            return {"success": True, "message": "Cashfree webhook received and processed"}
-            
-        except Payment.DoesNotExist:
-            print(f"Payment not found for Cashfree link_id: {link_id}")
-            return HttpResponse(
-                content=json.dumps({"error": "Payment not found"}),
-                status=404,
-                content_type="application/json"
-            )
-            
     except (json.JSONDecodeError, UnicodeDecodeError) as e:
         print(f"JSON decode error: {e}")
         return HttpResponse(
@@ -255,15 +119,26 @@ def cashfree_webhook(request):
             status=400,
             content_type="application/json"
         )
+
+    event = cashfree_event(data)
+    if not event["transaction_id"]:
+        print(f"Warning: link_id not found in webhook: {data}")
+        return HttpResponse(
+            content=json.dumps({"error": "Missing link_id in webhook payload"}),
+            status=400,
+            content_type="application/json"
+        )
+
+    try:
+        record_event(event)
     except Exception as e:
-        print(f"Error processing Cashfree webhook: {e}")
-        import traceback
-        traceback.print_exc()
+        print(f"Error storing Cashfree webhook: {e}")
         return HttpResponse(
             content=json.dumps({"error": "Error processing webhook"}),
             status=500,
             content_type="application/json"
         )
+    return {"success": True, "message": "Cashfree webhook received"}
 
 # def notify_customer_by_platform(payment, payment_status, amount):
 #     """
@@ -328,11 +203,15 @@ def cashfree_webhook(request):
 #         print(f"Error sending mobile notification: {e}")
 #         return False
 
-@router.post("/payments/", response=PaymentOutSchema, auth=JWTAuth())
-def create_payment(request, payload: PaymentCreateSchema):
+@router.post("/payments/", response=PaymentOutSchema, auth=AsyncJWTAuth())
+async def create_payment(request, payload: PaymentCreateSchema):
     """
     Enhanced payment creation with platform support
     Defaults to 'web' platform for backward compatibility
+
+    Returns without waiting for the gateway: payment_url is empty until the
+    queued link job (payments.links) has run. With PAYMENT_LINKS_QUEUED off
+    the gateway call is awaited here over the shared HTTP client.
     """
     payment_data = payload.dict()
     
@@ -357,9 +236,31 @@ def create_payment(request, payload: PaymentCreateSchema):
             print(f"Device info: {payment_data['device_info']}")
     
     payment = Payment(**payment_data)
-    payment.save()
+    if payment.payment_method == "pg" and not settings.PAYMENT_LINKS_QUEUED:
+        payment.transaction_id = str(uuid4())
+        gateway_kwargs = await sync_to_async(payment.gateway_payment_kwargs)()
+        payment.set_gateway_response(await acreate_payment(**gateway_kwargs))
+    # With PAYMENT_LINKS_QUEUED the link is created in the background: poll
+    # /payment-link/{transaction_id} until payment_url is set
+    await sync_to_async(payment.save)()
     return payment
 
+@router.get("/payment-link/{transaction_id}", response=PaymentLinkOutSchema)
+def payment_link_status(request, transaction_id: str):
+    """
+    Poll after creating a payment: link_status is pending / running until
+    payment_url is set (completed) or every attempt failed (failed)
+    """
+    payment = get_object_or_404(Payment.objects.select_related("link_job"), transaction_id=transaction_id)
+    job = getattr(payment, "link_job", None)
+    return {
+        "transaction_id": payment.transaction_id,
+        "link_status": job.status if job else ("completed" if payment.payment_url else None),
+        "payment_url": payment.payment_url,
+        "attempts": job.attempts if job else 0,
+        "error": job.last_error if job else None,
+    }
+
 @router.get("/payments/", response=PaginatedResponseSchema)
 def payments(request,  
               page: int = 1, 
@@ -386,12 +287,63 @@ def payments(request,
 
     return paginate_queryset(request, qs, PaymentOutSchema, page, page_size, query)
 
+def apply_status_response(payment, order_status_response):
+    """Update the payment from a check_payment_status() response"""
+    gateway = payment.payment_gateway or "PhonePe"
+    print(f"Payment verification response: {order_status_response}")
+    
+    # Check if we got an error response from the utility function
+    if 'error_type' in order_status_response:
+        print(f"{gateway} API error detected: {order_status_response['error_type']}")
+        
+        # For API errors, keep the current status but log the issue
+        if order_status_response['error_type'] in ['API_EMPTY_RESPONSE', 'API_CONNECTION_ERROR', 'API_NO_CONTENT', 'API_INVALID_RESPONSE', 'API_NOT_FOUND']:
+            print(f"Keeping current payment status '{payment.status}' due to API issues: {order_status_response.get('message', '')}")
+            return payment
+        elif order_status_response['error_type'] == 'UNKNOWN_ERROR':
+            print(f"Unknown error occurred, keeping current status: {order_status_response.get('message', '')}")
+            return payment
+        elif order_status_response['error_type'] == 'API_HTTP_ERROR':
+            # For HTTP errors (4xx, 5xx), also keep current status
+            print(f"HTTP error from {gateway} API, keeping current status: {order_status_response.get('message', '')}")
+            return payment
+    
+    # Normal response - update payment status based on gateway
+    if gateway.lower() == "cashfree":
+        # Cashfree returns link_status in the response
+        cashfree_status = order_status_response.get('link_status') or order_status_response.get('state', 'pending')
+        status = map_cashfree_status(cashfree_status)
+        print(f"Payment status from Cashfree: {cashfree_status} -> mapped to: {status}, Current status: {payment.status}")
+    else:
+        # PhonePe returns state in the response
+        phonepay_status = order_status_response.get('state', 'pending')
+        status = map_phonepay_status(phonepay_status)
+        print(f"Payment status from PhonePe: {phonepay_status} -> mapped to: {status}, Current status: {payment.status}")
+    
+    if payment.status != status:
+        old_status = payment.status
+        payment.status = status
+        payment.save()
+        print(f"Payment status updated from '{old_status}' to '{status}'")
+        
+        # Notification functionality commented out
+        # if status in ['completed', 'failed']:
+        #     notify_customer_by_platform(payment, status.upper(), float(payment.amount))
+    else:
+        print("Payment status unchanged")
+    return payment
+
+
 @router.get("/verify-payment", response=PaymentOutSchema)
-def verify_payment(request, transaction_id: str = None):
+async def verify_payment(request, transaction_id: str = None):
     """
     Verify payment status with enhanced error handling
+
+    Async: the gateway status call is awaited over the shared HTTP client
     """
-    payment = get_object_or_404(Payment, transaction_id=transaction_id)
+    payment = await sync_to_async(get_object_or_404)(
+        Payment.objects.select_related("order__user"), transaction_id=transaction_id
+    )
     print(f"Verifying payment: {payment.id} with transaction_id: {transaction_id}")
 
     if payment.payment_method == "pg":
@@ -407,50 +359,8 @@ def verify_payment(request, transaction_id: str = None):
             
             print(f"Using {gateway} with transaction_id: {status_check_id}")
             
-            order_status_response = check_payment_status(merchant_order_id=status_check_id, gateway=gateway)
-            print(f"Payment verification response: {order_status_response}")
-            
-            # Check if we got an error response from the utility function
-            if 'error_type' in order_status_response:
-                print(f"{gateway} API error detected: {order_status_response['error_type']}")
-                
-                # For API errors, keep the current status but log the issue
-                if order_status_response['error_type'] in ['API_EMPTY_RESPONSE', 'API_CONNECTION_ERROR', 'API_NO_CONTENT', 'API_INVALID_RESPONSE', 'API_NOT_FOUND']:
-                    print(f"Keeping current payment status '{payment.status}' due to API issues: {order_status_response.get('message', '')}")
-                    return payment
-                elif order_status_response['error_type'] == 'UNKNOWN_ERROR':
-                    print(f"Unknown error occurred, keeping current status: {order_status_response.get('message', '')}")
-                    return payment
-                elif order_status_response['error_type'] == 'API_HTTP_ERROR':
-                    # For HTTP errors (4xx, 5xx), also keep current status
-                    print(f"HTTP error from {gateway} API, keeping current status: {order_status_response.get('message', '')}")
-                    return payment
-            
-            # Normal response - update payment status based on gateway
-            gateway = payment.payment_gateway or "PhonePe"
-            
-            if gateway.lower() == "cashfree":
-                # Cashfree returns link_status in the response
-                cashfree_status = order_status_response.get('link_status') or order_status_response.get('state', 'pending')
-                status = map_cashfree_status(cashfree_status)
-                print(f"Payment status from Cashfree: {cashfree_status} -> mapped to: {status}, Current status: {payment.status}")
-            else:
-                # PhonePe returns state in the response
-                phonepay_status = order_status_response.get('state', 'pending')
-                status = map_phonepay_status(phonepay_status)
-                print(f"Payment status from PhonePe: {phonepay_status} -> mapped to: {status}, Current status: {payment.status}")
-            
-            if payment.status != status:
-                old_status = payment.status
-                payment.status = status
-                payment.save()
-                print(f"Payment status updated from '{old_status}' to '{status}'")
-                
-                # Notification functionality commented out
-                # if status in ['completed', 'failed']:
-                #     notify_customer_by_platform(payment, status.upper(), float(payment.amount))
-            else:
-                print("Payment status unchanged")
+            order_status_response = await acheck_payment_status(merchant_order_id=status_check_id, gateway=gateway)
+            await sync_to_async(apply_status_response)(payment, order_status_response)
                 
         except Exception as e:
             print(f"Unexpected error in verify_payment: {e}")
@@ -585,3 +495,12 @@ def payment_stats(request):
         return {"success": True, "data": list(stats)}
     except Exception as e:
         return {"success": False, "message": f"Error fetching stats: {e}"}
+
+
+@router.get("/gateway-metrics/", auth=AdminJWTAuth())
+def gateway_metrics_view(request):
+    """
+    Gateway call counts, failures, retries, circuit breaker state and latency
+    percentiles (ms) for the worker process answering the request
+    """
+    return gateway_metrics()
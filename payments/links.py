@@ -0,0 +1,161 @@
+"""
+Gateway payment links created off the request path.
+
+Payment.save() stores a new "pg" payment without a payment_url and queues a
+PaymentLinkJob in the same transaction. Once committed, a worker thread in
+the same process is woken to create the link (PAYMENT_LINK_WORKER = "thread");
+`manage.py process_payment_links --loop` drains the queue from a separate
+process and picks up anything a web worker left behind.
+
+Every attempt sends the payment's transaction_id as the merchant order / link
+id, so the gateway treats a retry as the same payment. Before a retry the
+gateway is asked whether an earlier attempt already created the payment,
+e.g. when its response was lost to a timeout or a crashed worker. A Cashfree
+link is recovered from the link status. PhonePe's order status carries no
+redirect URL and a second create with the same merchantOrderId is rejected,
+so the payment gets a new transaction_id instead; the orphaned PhonePe order
+was never shown to the buyer. Failed attempts are retried with
+exponential backoff up to PAYMENT_LINK_MAX_ATTEMPTS times; the worker thread
+polls every RETRY_DELAY seconds so retries run without a new payment. Jobs
+left "running" by a dead worker are claimed again after LEASE_SECONDS by the
+`process_payment_links --loop` worker process (see Procfile).
+"""
+import logging
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from utils.background import BackgroundWorker
+from utils.payment import check_payment_status_cashfree, check_payment_status_phonepe, create_payment
+
+from .models import Payment, PaymentLinkJob
+
+
+logger = logging.getLogger("payments")
+
+BATCH_SIZE = 20
+LEASE_SECONDS = 120
+RETRY_DELAY = 5
+
+
+def queue_payment_link(payment):
+    job = PaymentLinkJob.objects.create(payment=payment, transaction_id=payment.transaction_id)
+    if getattr(settings, "PAYMENT_LINK_WORKER", "thread") == "thread":
+        transaction.on_commit(worker.wake)
+    return job
+
+
+def _claim_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        qs = PaymentLinkJob.objects.filter(
+            Q(status="pending", next_attempt__lte=now)
+            | Q(status="running", updated__lt=now - timedelta(seconds=LEASE_SECONDS))
+        ).order_by("id")
+        if connection.features.has_select_for_update_skip_locked:
+            qs = qs.select_for_update(skip_locked=True)
+        ids = list(qs.values_list("id", flat=True)[:batch_size])
+        PaymentLinkJob.objects.filter(id__in=ids).update(status="running", updated=now)
+    return ids
+
+
+def _recover_link(job, payment):
+    """
+    Before a retry: the link an earlier attempt already created, if the
+    gateway can tell us. A PhonePe order that already exists is given up for
+    a new transaction_id, see the module docstring.
+    """
+    if (payment.payment_gateway or "PhonePe").lower() == "cashfree":
+        return check_payment_status_cashfree(payment.transaction_id).get("link_url")
+
+    status = check_payment_status_phonepe(payment.transaction_id)
+    # Unknown orders and failed checks come back with an error_type
+    if "error_type" not in status:
+        transaction_id = str(uuid4())
+        logger.warning(
+            "PhonePe order %s exists without a stored link, retrying as %s", payment.transaction_id, transaction_id
+        )
+        Payment.objects.filter(id=payment.id).update(transaction_id=transaction_id, updated=timezone.now())
+        PaymentLinkJob.objects.filter(id=job.id).update(transaction_id=transaction_id)
+        payment.transaction_id = job.transaction_id = transaction_id
+    return None
+
+
+def _attempt_failed(job, error):
+    """Schedule the job's next attempt with backoff, or fail it after the last one"""
+    logger.warning("Payment link %s attempt %s failed: %s", job.transaction_id, job.attempts, error)
+    now = timezone.now()
+    if job.attempts >= getattr(settings, "PAYMENT_LINK_MAX_ATTEMPTS", 5):
+        status, next_attempt = "failed", job.next_attempt
+    else:
+        status, next_attempt = "pending", now + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+    PaymentLinkJob.objects.filter(id=job.id).update(
+        status=status, attempts=job.attempts, next_attempt=next_attempt, last_error=str(error)[:1000], updated=now
+    )
+
+
+def run_job(job):
+    """Create the link for one claimed job; True once the payment has its link"""
+    job.attempts += 1
+    payment = job.payment
+
+    if not payment.payment_url and job.attempts > 1:
+        payment.payment_url = _recover_link(job, payment)
+
+    if not payment.payment_url:
+        try:
+            payment.set_gateway_response(create_payment(**payment.gateway_payment_kwargs()))
+        except Exception as e:
+            _attempt_failed(job, e)
+            return False
+
+        # Only the link changes, so skip Payment.save() and its order update
+        Payment.objects.filter(id=payment.id).update(payment_url=payment.payment_url, updated=timezone.now())
+
+    job.status = "completed"
+    job.last_error = None
+    job.save()
+    return True
+
+
+def process_payment_links(batch_size=BATCH_SIZE):
+    """Run one batch of due jobs, returns the number of jobs run"""
+    ids = _claim_batch(batch_size)
+    jobs = PaymentLinkJob.objects.filter(id__in=ids).select_related(
+        "payment__order__user", "payment__estore"
+    )
+    for job in jobs:
+        try:
+            run_job(job)
+        except Exception as e:
+            _attempt_failed(job, e)
+    return len(ids)
+
+
+def drain(batch_size=BATCH_SIZE):
+    """Run due jobs until none are left, returns the number of jobs run"""
+    total = 0
+    while True:
+        processed = process_payment_links(batch_size)
+        if not processed:
+            return total
+        total += processed
+
+
+def run_link_worker(interval=1, batch_size=BATCH_SIZE):
+    while True:
+        try:
+            processed = drain(batch_size)
+            if processed:
+                logger.info("Payment links: %s jobs run", processed)
+        except Exception:
+            logger.exception("Payment link worker failed")
+        time.sleep(interval)
+
+
+worker = BackgroundWorker("payment-links", drain, interval=RETRY_DELAY)
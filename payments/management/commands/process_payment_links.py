@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from payments.links import BATCH_SIZE, drain, run_link_worker
+
+class Command(BaseCommand):
+    help = "Create queued gateway payment links"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep running and poll the queue")
+        parser.add_argument("--interval", type=float, default=1, help="Seconds between polls with --loop")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options["loop"]:
+            run_link_worker(interval=options["interval"], batch_size=options["batch_size"])
+            return
+        processed = drain(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"{processed} payment link jobs run."))
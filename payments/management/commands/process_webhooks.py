@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from payments.webhooks import BATCH_SIZE, drain, run_webhook_worker
+
+class Command(BaseCommand):
+    help = "Apply stored payment gateway webhooks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep running and poll the inbox")
+        parser.add_argument("--interval", type=float, default=1, help="Seconds between polls with --loop")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options["loop"]:
+            run_webhook_worker(interval=options["interval"], batch_size=options["batch_size"])
+            return
+        processed = drain(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"{processed} webhook events applied."))
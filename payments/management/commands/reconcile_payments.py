@@ -0,0 +1,52 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from payments.reconcile import BATCH_SIZE, MIN_AGE, RATE, WORKERS, reconcile
+
+class Command(BaseCommand):
+    help = "Check pending gateway payments with PhonePe / Cashfree and update their status"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-age", type=int, default=MIN_AGE, help="Only payments older than this many minutes")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Payments per page and transaction")
+        parser.add_argument("--workers", type=int, default=WORKERS, help="Concurrent gateway calls")
+        parser.add_argument("--rate", type=float, default=RATE, help="Gateway calls per second")
+        parser.add_argument("--gateway", help="Only PhonePe or Cashfree payments")
+        parser.add_argument("--limit", type=int, help="Check at most this many payments")
+        parser.add_argument("--dry-run", action="store_true", help="Report changes without saving them")
+        parser.add_argument("--output", help="Write the full report as JSON to this file")
+        parser.add_argument("--loop", action="store_true", help="Keep running, every --interval seconds")
+        parser.add_argument("--interval", type=float, default=300)
+
+    def handle(self, *args, **options):
+        while True:
+            report = reconcile(
+                min_age=options["min_age"],
+                batch_size=options["batch_size"],
+                workers=options["workers"],
+                rate=options["rate"],
+                gateway=options["gateway"],
+                limit=options["limit"],
+                dry_run=options["dry_run"],
+            )
+            self.write_report(report, options["output"])
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
+
+    def write_report(self, report, output):
+        updated = ", ".join(f"{count} {status}" for status, count in report["updated"].items()) or "none"
+        errors = ", ".join(f"{count} {error_type}" for error_type, count in report["errors"].items()) or "none"
+        prefix = "[dry run] " if report["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{report['checked']} payments checked in {report['seconds']}s: "
+            f"updated {updated}; {report['unchanged']} unchanged, {report['skipped']} skipped; errors: {errors}"
+        ))
+        for change in report["changes"][:50]:
+            self.stdout.write(f"  payment {change['id']} ({change['transaction_id']}): {change['from']} -> {change['to']}")
+        if len(report["changes"]) > 50:
+            self.stdout.write(f"  ... {len(report['changes']) - 50} more")
+        if output:
+            with open(output, "w") as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from payments.models import WebhookEvent
+from payments.webhooks import EVENT_PARSERS, drain, load_payloads, replay_events
+
+class Command(BaseCommand):
+    help = (
+        "Re-apply stored payment webhooks matching the filters, or load captured "
+        "callback bodies (one JSON object per line) with --file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--id", type=int, action="append", dest="ids", help="Event id, can be repeated")
+        parser.add_argument("--transaction-id")
+        parser.add_argument("--gateway", choices=sorted(EVENT_PARSERS))
+        parser.add_argument("--result", action="append", help="Only events with this result, e.g. not_found or error")
+        parser.add_argument("--since", help="Only events received at or after this ISO datetime")
+        parser.add_argument("--file", help="JSON lines file of callback bodies, needs --gateway")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the matching events")
+        parser.add_argument("--no-process", action="store_true", help="Queue the events without applying them now")
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            if not options["gateway"]:
+                raise CommandError("--file needs --gateway")
+            with open(options["file"]) as f:
+                payloads = [json.loads(line) for line in f if line.strip()]
+            stored, duplicates = load_payloads(options["gateway"], payloads)
+            self.stdout.write(f"{stored} events stored, {duplicates} duplicates skipped.")
+        else:
+            events = WebhookEvent.objects.all()
+            if options["ids"]:
+                events = events.filter(id__in=options["ids"])
+            if options["transaction_id"]:
+                events = events.filter(transaction_id=options["transaction_id"])
+            if options["gateway"]:
+                events = events.filter(gateway=options["gateway"])
+            if options["result"]:
+                events = events.filter(result__in=options["result"])
+            if options["since"]:
+                since = parse_datetime(options["since"])
+                if since is None:
+                    raise CommandError(f"Invalid --since: {options['since']}")
+                events = events.filter(received__gte=since)
+
+            if options["dry_run"]:
+                self.stdout.write(f"{events.count()} events match.")
+                return
+            self.stdout.write(f"{replay_events(events)} events queued for replay.")
+
+        if not options["no_process"]:
+            processed = drain()
+            self.stdout.write(self.style.SUCCESS(f"{processed} webhook events applied."))
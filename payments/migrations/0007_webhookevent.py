@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_paymentlinkjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gateway', models.CharField(choices=[('Cashfree', 'Cashfree'), ('PhonePe', 'PhonePe')], max_length=50)),
+                ('event_key', models.CharField(max_length=255, unique=True)),
+                ('transaction_id', models.CharField(db_index=True, max_length=100)),
+                ('gateway_status', models.CharField(blank=True, max_length=50)),
+                ('payload', models.JSONField()),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('result', models.CharField(blank=True, choices=[('applied', 'Applied'), ('unchanged', 'Unchanged'), ('ignored', 'Ignored'), ('not_found', 'Payment not found'), ('error', 'Error')], max_length=20, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['processed', 'id'], name='payments_we_process_112c8e_idx')],
+            },
+        ),
+    ]
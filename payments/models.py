@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 from orders.models import Order
 
@@ -8,7 +10,6 @@ from estores.models import EStore
 
 from uuid import uuid4
 
-from django.core.cache import cache
 
 
 
@@ -87,57 +88,78 @@ class Payment(models.Model):
             else:
                 return f"{base_url}/checkout/{merchant_order_id}"
     
+    def gateway_payment_kwargs(self):
+        """
+        Arguments for utils.payment.create_payment() / acreate_payment(),
+        for the merchant order id already stored in transaction_id
+        """
+        merchant_order_id = self.transaction_id
+
+        # Default to PhonePe if no gateway specified
+        gateway = self.payment_gateway or "PhonePe"
+        
+        # Generate platform-specific redirect URL
+        redirect_url = self.generate_redirect_url(merchant_order_id)
+        
+        # Get customer details from order if available (for Cashfree)
+        customer_details = None
+        if self.order and hasattr(self.order, 'user'):
+            user = self.order.user
+            name = user.first_name + " " + user.last_name
+            customer_details = {
+                "customer_name": name,
+                "customer_email": getattr(user, 'email', '[email protected]') or '[email protected]',
+                "customer_phone": getattr(user, 'mobile', '9999999999') or '9999999999'
+            }
+        
+        return {
+            "amount": self.amount,
+            "redirect_url": redirect_url,
+            "merchant_order_id": merchant_order_id,
+            "gateway": gateway,
+            "customer_details": customer_details,
+            "link_purpose": f"Payment for Order #{self.order.id}",
+        }
+
+    def set_gateway_response(self, standard_pay_response):
+        # Handle payment URL from both gateways
+        self.payment_url = (
+            standard_pay_response.get("redirectUrl") or 
+            standard_pay_response.get("link_url") or
+            standard_pay_response.get("redirect_url")
+        )
+
     def save(self, *args, **kwargs):
-        if not self.pk:
-            merchant_order_id = str(uuid4())
-            self.transaction_id = merchant_order_id
+        # A transaction_id set before the first save means the gateway was
+        # already called (the async create view awaits acreate_payment itself)
+        queue_link = False
+        if not self.pk and not self.transaction_id:
+            self.transaction_id = str(uuid4())
 
             if not self.platform:
                 self.platform = 'web'
                             
             if self.payment_method == "pg":
-                # Default to PhonePe if no gateway specified
-                gateway = self.payment_gateway or "PhonePe"
-                
-                # Generate platform-specific redirect URL
-                redirect_url = self.generate_redirect_url(merchant_order_id)
-                
-                # Get customer details from order if available (for Cashfree)
-                customer_details = None
-                if self.order and hasattr(self.order, 'user'):
-                    user = self.order.user
-                    name = user.first_name + " " + user.last_name
-                    customer_details = {
-                        "customer_name": name,
-                        "customer_email": getattr(user, 'email', '[email protected]') or '[email protected]',
-                        "customer_phone": getattr(user, 'mobile', '9999999999') or '9999999999'
-                    }
-                
-                # Create payment with selected gateway
-                standard_pay_response = create_payment(
-                    amount=self.amount,
-                    redirect_url=redirect_url,
-                    merchant_order_id=merchant_order_id,
-                    gateway=gateway,
-                    customer_details=customer_details,
-                    link_purpose=f"Payment for Order #{self.order.id}"
-                )
-                
-                # Handle payment URL from both gateways
-                self.payment_url = (
-                    standard_pay_response.get("redirectUrl") or 
-                    standard_pay_response.get("link_url") or
-                    standard_pay_response.get("redirect_url")
-                )
+                if getattr(settings, "PAYMENT_LINKS_QUEUED", True):
+                    # Created by payments.links once this row is committed
+                    queue_link = True
+                else:
+                    # Create payment with selected gateway
+                    self.set_gateway_response(create_payment(**self.gateway_payment_kwargs()))
             
         order = self.order
-        order.payment_status = self.status  # Update the order status to match the payment status
-        order.save()  # Save the updated
+        if order.payment_status != self.status:
+            # Keep the order status in step with the payment; Order.save()
+            # invalidates the user's cached order lists
+            order.payment_status = self.status
+            order.save(update_fields=["payment_status", "updated"])
 
-        cache_key = f"cache:/api/order/orders/?items_needed=true&user_id={self.order.user.id}&ordering=-id"
-        cache.delete(cache_key)
         super().save(*args, **kwargs)
 
+        if queue_link:
+            from .links import queue_payment_link
+            queue_payment_link(self)
+
 
     class Meta:
         ordering = ['-created']
@@ -145,4 +167,68 @@ class Payment(models.Model):
     def __str__(self):
         platform_str = f" ({self.platform})" if self.platform != 'web' else ""
         return f"Payment for Order #{self.order.id} - {self.amount}{platform_str}"
-    
\ No newline at end of file
+    
+
+
+class PaymentLinkJob(models.Model):
+    """
+    Gateway payment-link creation for a Payment, queued by Payment.save() and
+    run by payments.links. transaction_id is the idempotency key: it is the
+    merchant order / link id sent to the gateway on every attempt.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='link_job')
+    transaction_id = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Payment link {self.transaction_id} ({self.status})"
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'next_attempt'])]
+
+
+class WebhookEvent(models.Model):
+    """
+    A gateway callback as received, stored by the webhook endpoints and
+    applied to its Payment by payments.webhooks. event_key is unique, so a
+    callback the gateway retries is stored once.
+    """
+    RESULT_CHOICES = [
+        ('applied', 'Applied'),
+        ('unchanged', 'Unchanged'),
+        ('ignored', 'Ignored'),
+        ('not_found', 'Payment not found'),
+        ('error', 'Error'),
+    ]
+
+    gateway = models.CharField(max_length=50, choices=PAYMENT_GATEWAY_CHOICES)
+    event_key = models.CharField(max_length=255, unique=True)
+    transaction_id = models.CharField(max_length=100, db_index=True)
+    gateway_status = models.CharField(max_length=50, blank=True)
+    payload = models.JSONField()
+
+    received = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    result = models.CharField(max_length=20, choices=RESULT_CHOICES, blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.gateway} {self.transaction_id} {self.gateway_status}"
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['processed', 'id'])]
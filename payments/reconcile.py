@@ -0,0 +1,144 @@
+"""
+Reconciliation of payments stuck in "pending".
+
+Pending gateway payments older than a cut-off are read in id-ordered pages.
+Each page's statuses are fetched from PhonePe / Cashfree concurrently on a
+bounded thread pool, with calls spaced to stay under a request rate. The new
+statuses are then written in one transaction per page. The payments are
+locked and re-checked first, so a webhook applied in the meantime wins; the
+write goes through payments.webhooks.save_status_changes, so orders and
+caches follow as they do for webhooks.
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from utils.payment import check_payment_status, map_cashfree_status, map_phonepay_status
+
+from .models import Payment
+from .webhooks import can_transition, save_status_changes
+
+
+BATCH_SIZE = 100
+WORKERS = 8
+RATE = 10          # gateway calls per second, over all threads
+MIN_AGE = 15       # minutes; younger payments may still be in checkout
+
+
+class RateLimiter:
+    """Spaces calls at least 1 / rate seconds apart across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def gateway_status(response, gateway):
+    """Our status for a check_payment_status() response, or None when the check failed"""
+    if "error_type" in response:
+        return None
+    if gateway.lower() == "cashfree":
+        return map_cashfree_status(response.get("link_status") or response.get("state", "pending"))
+    return map_phonepay_status(response.get("state", "pending"))
+
+
+def _check(row, limiter):
+    limiter.wait()
+    gateway = row["payment_gateway"] or "PhonePe"
+    response = check_payment_status(merchant_order_id=row["transaction_id"], gateway=gateway)
+    return row["id"], gateway_status(response, gateway), response.get("error_type")
+
+
+def _apply(statuses, report, dry_run):
+    """Write one page's new statuses; statuses is {payment id: status}"""
+    now = timezone.now()
+    with transaction.atomic():
+        payments = Payment.objects.select_for_update().filter(id__in=statuses).order_by("id")
+        changed = []
+        for payment in payments:
+            status = statuses[payment.id]
+            if payment.status == status:
+                report["unchanged"] += 1
+                continue
+            if not can_transition(payment.status, status):
+                report["skipped"] += 1
+                continue
+            report["changes"].append({
+                "id": payment.id,
+                "transaction_id": payment.transaction_id,
+                "from": payment.status,
+                "to": status,
+            })
+            report["updated"][status] += 1
+            payment.status = status
+            payment.updated = now
+            changed.append(payment)
+        if not dry_run:
+            save_status_changes(changed, now)
+
+
+def reconcile(min_age=MIN_AGE, batch_size=BATCH_SIZE, workers=WORKERS, rate=RATE, gateway=None, limit=None,
+              dry_run=False):
+    """
+    Check pending payments with their gateways and apply the results.
+    Returns a report: counts per outcome, errors per error_type and the list
+    of status changes. With dry_run nothing is written.
+    """
+    started = time.monotonic()
+    report = {
+        "checked": 0,
+        "updated": Counter(),
+        "unchanged": 0,
+        "skipped": 0,
+        "errors": Counter(),
+        "changes": [],
+        "dry_run": dry_run,
+    }
+    qs = Payment.objects.filter(
+        status="pending",
+        payment_method="pg",
+        transaction_id__isnull=False,
+        created__lt=timezone.now() - timedelta(minutes=min_age),
+    ).order_by("id")
+    if gateway:
+        qs = qs.filter(payment_gateway__iexact=gateway)
+
+    limiter = RateLimiter(rate)
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reconcile") as executor:
+        while limit is None or report["checked"] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - report["checked"])
+            rows = list(qs.filter(id__gt=last_id).values("id", "transaction_id", "payment_gateway")[:size])
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+
+            statuses = {}
+            for payment_id, status, error_type in executor.map(lambda row: _check(row, limiter), rows):
+                if status is None:
+                    report["errors"][error_type] += 1
+                else:
+                    statuses[payment_id] = status
+            report["checked"] += len(rows)
+            if statuses:
+                _apply(statuses, report, dry_run)
+            print(f"Reconciled {report['checked']} payments, {sum(report['updated'].values())} updated")
+
+    report["updated"] = dict(report["updated"])
+    report["errors"] = dict(report["errors"])
+    report["seconds"] = round(time.monotonic() - started, 1)
+    return report
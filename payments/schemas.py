@@ -24,6 +24,13 @@ class PaymentOutSchema(Schema):
     created: datetime
     updated: datetime
 
+class PaymentLinkOutSchema(Schema):
+    transaction_id: str
+    link_status: Optional[str] = None  # pending, running, completed or failed
+    payment_url: Optional[str] = None
+    attempts: int = 0
+    error: Optional[str] = None
+
 class PaymentCreateSchema(Schema):
     order_id: int
     amount: Decimal = Field(..., max_digits=10, decimal_places=2)
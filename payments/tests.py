@@ -1,3 +1,117 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from orders.models import Order
+
+from . import links, webhooks
+from .models import Payment, PaymentLinkJob, WebhookEvent
+
+
+@override_settings(PAYMENT_LINK_WORKER="external", PAYMENT_LINK_MAX_ATTEMPTS=3)
+class PaymentLinkRetryTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create(username="links", mobile="9000000002")
+        order = Order.objects.create(user=user, total_amount=100)
+        self.payment = Payment.objects.create(order=order, amount=100, payment_method="pg", payment_gateway="PhonePe")
+        self.first_id = self.payment.transaction_id
+        self.sent = []
+
+    def create_payment(self, **kwargs):
+        self.sent.append(kwargs["merchant_order_id"])
+        if len(self.sent) == 1:
+            # PhonePe created the order but the response never arrived
+            raise TimeoutError("read timed out")
+        if kwargs["merchant_order_id"] == self.first_id:
+            raise Exception("Payment creation failed with HTTP 400")
+        return {"orderId": "OMO2", "redirectUrl": "https://phonepe.test/pay"}
+
+    def run_links(self, status):
+        with mock.patch.object(links, "create_payment", side_effect=self.create_payment), \
+                mock.patch.object(links, "check_payment_status_phonepe", return_value=status) as check:
+            links.drain()
+            # The retry is due after the backoff
+            PaymentLinkJob.objects.update(next_attempt=timezone.now())
+            links.drain()
+        self.payment.refresh_from_db()
+        return check
+
+    def test_existing_phonepe_order_is_retried_with_new_transaction_id(self):
+        check = self.run_links({"orderId": "OMO1", "state": "PENDING"})
+
+        check.assert_called_once_with(self.first_id)
+        self.assertNotEqual(self.payment.transaction_id, self.first_id)
+        self.assertEqual(self.sent, [self.first_id, self.payment.transaction_id])
+        self.assertEqual(self.payment.payment_url, "https://phonepe.test/pay")
+        job = PaymentLinkJob.objects.get(payment=self.payment)
+        self.assertEqual((job.status, job.attempts, job.transaction_id), ("completed", 2, self.payment.transaction_id))
+
+    def test_unknown_phonepe_order_keeps_its_transaction_id(self):
+        self.run_links({"state": "PENDING", "error_type": "API_HTTP_ERROR", "merchant_order_id": self.first_id})
+
+        self.assertEqual(self.payment.transaction_id, self.first_id)
+        self.assertEqual(self.sent, [self.first_id, self.first_id])
+        self.assertIsNone(self.payment.payment_url)
+        job = PaymentLinkJob.objects.get(payment=self.payment)
+        self.assertEqual((job.status, job.attempts), ("pending", 2))
+
+
+@override_settings(WEBHOOK_WORKER="external")
+class WebhookInboxTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create(username="webhooks", mobile="9000000003")
+        self.payments = []
+        for i in range(2):
+            order = Order.objects.create(user=user, total_amount=10)
+            payment = Payment(order=order, amount=10, transaction_id=f"tx{i}", payment_gateway="PhonePe")
+            payment.save()
+            self.payments.append(payment)
+
+    def receive(self, transaction_id, state):
+        return webhooks.record_event(webhooks.phonepe_event(
+            {"type": "CHECKOUT_ORDER_COMPLETED", "payload": {"orderId": transaction_id, "state": state}}
+        ))
+
+    def test_duplicate_event_is_dropped(self):
+        self.assertTrue(self.receive("tx0", "COMPLETED"))
+        self.assertFalse(self.receive("tx0", "COMPLETED"))
+
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(webhooks.drain(), 1)
+        self.payments[0].refresh_from_db()
+        self.assertEqual(self.payments[0].status, "completed")
+
+    def test_completed_payment_is_not_moved_back_to_pending(self):
+        self.receive("tx0", "COMPLETED")
+        webhooks.drain()
+        self.receive("tx0", "PENDING")
+        webhooks.drain()
+
+        self.assertEqual(WebhookEvent.objects.latest("id").result, "ignored")
+        self.payments[0].refresh_from_db()
+        self.assertEqual(self.payments[0].status, "completed")
+        self.assertEqual(self.payments[0].order.payment_status, "completed")
+
+    def test_failing_batch_is_applied_one_event_at_a_time(self):
+        self.receive("tx0", "COMPLETED")
+        # No status mapper for this gateway, so applying it raises
+        WebhookEvent.objects.create(
+            gateway="Unknown", event_key="Unknown:tx1", transaction_id="tx1", gateway_status="COMPLETED", payload={}
+        )
+        self.receive("txX", "COMPLETED")
+
+        self.assertEqual(webhooks.process_webhooks(), 3)
+
+        self.assertEqual(
+            list(WebhookEvent.objects.order_by("id").values_list("transaction_id", "result")),
+            [("tx0", "applied"), ("tx1", "error"), ("txX", "not_found")],
+        )
+        self.assertFalse(WebhookEvent.objects.filter(processed__isnull=True).exists())
+        self.assertEqual(
+            [p.status for p in Payment.objects.order_by("id")],
+            ["completed", "pending"],
+        )
@@ -0,0 +1,257 @@
+"""
+Webhook inbox for PhonePe and Cashfree callbacks.
+
+The webhook endpoints only store the callback as a WebhookEvent and answer.
+Gateways retry a callback until they get a 2xx, sometimes many times over, so
+each event gets a key built from the gateway's own identifiers and status;
+a retry hits the unique constraint and is dropped before any payment is read.
+
+Stored events are applied in batches by process_webhooks(): the batch's
+payments are locked with select_for_update, each payment's status follows its
+events in arrival order (see TRANSITIONS), and the changed payments and their
+orders are written with one UPDATE per table instead of a Payment.save() /
+Order.save() per callback. A worker thread in each web process is woken on
+commit (WEBHOOK_WORKER = "thread"); `manage.py process_webhooks --loop` does
+the same from a separate process and `manage.py replay_webhooks` re-applies
+stored events or loads captured payloads.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from orders.models import Order
+from utils.background import BackgroundWorker
+from utils.cache import invalidate_tags
+from utils.payment import map_cashfree_status, map_phonepay_status
+
+from .models import Payment, WebhookEvent
+
+
+logger = logging.getLogger("payments")
+
+BATCH_SIZE = 200
+
+# Statuses a payment may move to from its current one, so a late or replayed
+# "pending" callback cannot undo a completed payment
+TRANSITIONS = {
+    "pending": {"completed", "failed", "refunded"},
+    "failed": {"completed", "refunded"},
+    "completed": {"refunded"},
+    "refunded": set(),
+}
+
+STATUS_MAPPERS = {
+    "PhonePe": map_phonepay_status,
+    "Cashfree": map_cashfree_status,
+}
+
+
+############################ Ingestion ############################
+
+def phonepe_event(data):
+    payload = data.get("payload") or {}
+    order_id = payload.get("orderId")  # PhonePe's Merchant Reference ID
+    state = payload.get("state", "UNKNOWN")
+    return {
+        "gateway": "PhonePe",
+        "event_key": f"PhonePe:{data.get('type', '')}:{order_id}:{state}",
+        "transaction_id": order_id,
+        "gateway_status": state,
+        "payload": data,
+    }
+
+
+def cashfree_event(data):
+    # Cashfree webhook structure:
+    # {"type": "...", "data": {"order": {"order_tags": {"link_id": "..."}},
+    #                          "payment": {"cf_payment_id": ..., "payment_status": "SUCCESS"}}}
+    webhook_data = data.get("data") or {}
+    link_id = ((webhook_data.get("order") or {}).get("order_tags") or {}).get("link_id")
+    payment_data = webhook_data.get("payment") or {}
+    payment_status = payment_data.get("payment_status", "")
+    reference = payment_data.get("cf_payment_id") or link_id
+    return {
+        "gateway": "Cashfree",
+        "event_key": f"Cashfree:{data.get('type', '')}:{reference}:{payment_status}",
+        "transaction_id": link_id,
+        "gateway_status": payment_status,
+        "payload": data,
+    }
+
+
+EVENT_PARSERS = {
+    "PhonePe": phonepe_event,
+    "Cashfree": cashfree_event,
+}
+
+
+def record_event(event):
+    """Store a parsed callback; False when the same event was already received"""
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(**event)
+    except IntegrityError:
+        logger.info("Duplicate webhook ignored: %s", event["event_key"])
+        return False
+    if getattr(settings, "WEBHOOK_WORKER", "thread") == "thread":
+        transaction.on_commit(worker.wake)
+    return True
+
+
+############################ Processing ############################
+
+def _claim_batch(batch_size):
+    qs = WebhookEvent.objects.filter(processed__isnull=True).order_by("id")
+    if connection.features.has_select_for_update_skip_locked:
+        # Several workers can drain the inbox side by side
+        qs = qs.select_for_update(skip_locked=True)
+    return list(qs[:batch_size])
+
+
+def _invalidate_orders(user_ids):
+    invalidate_tags(*[f"Order:user:{user_id}" for user_id in user_ids])
+
+
+def save_status_changes(payments, now):
+    """
+    Write new statuses of locked payments with one UPDATE per table and mirror
+    them on their orders, as Payment.save() does
+    """
+    payments = list(payments)
+    if not payments:
+        return
+    Payment.objects.bulk_update(payments, ["status", "updated"])
+    order_ids = {}
+    for payment in payments:
+        order_ids.setdefault(payment.status, []).append(payment.order_id)
+    for status, ids in order_ids.items():
+        Order.objects.filter(id__in=ids).update(payment_status=status, updated=now)
+    user_ids = set(
+        Order.objects.filter(id__in=[p.order_id for p in payments], user__isnull=False)
+        .values_list("user_id", flat=True)
+    )
+    transaction.on_commit(lambda: _invalidate_orders(user_ids))
+
+
+def can_transition(old_status, new_status):
+    return new_status in TRANSITIONS.get(old_status, ())
+
+
+def apply_events(events):
+    """Apply events to their payments inside the caller's transaction"""
+    now = timezone.now()
+    payments = {
+        payment.transaction_id: payment
+        for payment in Payment.objects.select_for_update()
+        .filter(transaction_id__in={event.transaction_id for event in events})
+        .order_by("id")
+    }
+
+    changed = {}
+    for event in events:
+        event.processed = now
+        event.error = None
+        payment = payments.get(event.transaction_id)
+        if payment is None:
+            event.result = "not_found"
+            continue
+        status = STATUS_MAPPERS[event.gateway](event.gateway_status)
+        if status == payment.status:
+            event.result = "unchanged"
+        elif not can_transition(payment.status, status):
+            logger.warning(
+                "Webhook %s: ignoring %s -> %s for payment %s", event.event_key, payment.status, status, payment.id
+            )
+            event.result = "ignored"
+        else:
+            payment.status = status
+            payment.updated = now
+            changed[payment.id] = payment
+            event.result = "applied"
+
+    save_status_changes(changed.values(), now)
+    WebhookEvent.objects.bulk_update(events, ["processed", "result", "error"])
+    return len(changed)
+
+
+def process_webhooks(batch_size=BATCH_SIZE):
+    """
+    Apply one batch of stored events, returns the number of events handled.
+    If the batch fails as a whole its events are applied one at a time and
+    the failing ones are marked as errors.
+    """
+    try:
+        with transaction.atomic():
+            events = _claim_batch(batch_size)
+            if events:
+                apply_events(events)
+            return len(events)
+    except Exception:
+        logger.exception("Webhook batch failed, applying events one at a time")
+
+    with transaction.atomic():
+        events = _claim_batch(batch_size)
+        for event in events:
+            try:
+                with transaction.atomic():
+                    apply_events([event])
+            except Exception as e:
+                logger.exception("Webhook %s failed", event.event_key)
+                event.processed = timezone.now()
+                event.result = "error"
+                event.error = str(e)[:1000]
+                event.save(update_fields=["processed", "result", "error"])
+    return len(events)
+
+
+def drain(batch_size=BATCH_SIZE):
+    """Apply stored events until none are left, returns the number handled"""
+    total = 0
+    while True:
+        processed = process_webhooks(batch_size)
+        if not processed:
+            return total
+        total += processed
+
+
+def run_webhook_worker(interval=1, batch_size=BATCH_SIZE):
+    while True:
+        try:
+            processed = drain(batch_size)
+            if processed:
+                logger.info("Webhooks: %s events applied", processed)
+        except Exception:
+            logger.exception("Webhook worker failed")
+        time.sleep(interval)
+
+
+worker = BackgroundWorker("webhooks", drain)
+
+
+############################ Replay ############################
+
+def replay_events(queryset):
+    """Mark stored events as unprocessed so the next drain applies them again"""
+    return queryset.update(processed=None, result=None, error=None)
+
+
+def load_payloads(gateway, payloads):
+    """
+    Store captured callback bodies (e.g. from the "Webhook data:" logs) as
+    events; returns (stored, duplicates)
+    """
+    parse = EVENT_PARSERS[gateway]
+    stored = duplicates = 0
+    for data in payloads:
+        event = parse(data)
+        if not event["transaction_id"]:
+            logger.warning("Skipping %s payload without a transaction id: %s", gateway, data)
+            continue
+        if record_event(event):
+            stored += 1
+        else:
+            duplicates += 1
+    return stored, duplicates
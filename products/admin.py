@@ -104,4 +104,15 @@ class ProductListingAdmin(admin.ModelAdmin):
         queryset.update(approved=False)
     
     def make_out_of_stock(self, request, queryset):
-        queryset.update(stock=0)
\ No newline at end of file
+        queryset.update(stock=0)
+
+from .models import ProductImportJob
+
+@admin.register(ProductImportJob)
+class ProductImportJobAdmin(admin.ModelAdmin):
+    list_display = ("file_name", "id", "status", "processed_rows", "created_count", "error_count", "seller", "estore", "created", "finished")
+    list_filter = ("status",)
+    readonly_fields = ("processed_rows", "created_count", "error_count", "created", "updated", "finished")
+    formfield_overrides = {
+        models.JSONField: {'widget': JSONEditorWidget},
+    }
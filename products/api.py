@@ -18,18 +18,24 @@ from .schemas import (
     ReturnExchangePolicySchema, ReturnExchangePolicyCreateSchema, ReturnExchangePolicyUpdateSchema
 )
 from django.shortcuts import get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, StreamingHttpResponse
 from utils.pagination import PaginatedResponseSchema, paginate_queryset
+from utils.eager_loading import eager_load
 from ninja.files import UploadedFile
 
 import json 
-from django.db.models import Min, Max, Count
 
 from utils.cache import cache_response
+from utils.local_cache import get_cache_stats
+from .facets import ORDERINGS as FACET_ORDERINGS, get_facet_index, search_listing_ids
+from .category_tree import category_subtree_q, get_category_tree
 
 
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
 
 from ninja_jwt.authentication import JWTAuth
+from utils.auth import AdminJWTAuth
 
 from typing import Optional
 
@@ -41,140 +47,116 @@ router = Router()
 class ErrorSchema(Schema):
     detail: str
 
-from openpyxl import load_workbook
 from users.models import Entity
 from users.schemas import EntityOut2Schema
-from taxations.models import TaxCategory
 from estores.models import EStore
-from ast import literal_eval
 from django.db import IntegrityError
+import os
+import tempfile
+from .importer import expire_if_stale, import_file, start_import
+from .exporter import CONTENT_TYPES, as_async, export_listings
+from .models import ProductImportJob
 
 ############################ Product Listing Upload from files ############################
 
-def parse_bool(value):
-    if isinstance(value, bool):
-        return value
-    if isinstance(value, str):
-        return value.strip().lower() in ['true', '1', 'yes']
-    if isinstance(value, int):
-        return value == 1
-    return False
-
-
-def get_or_create_entity(name, entity_type, estore_id=None):
-    if not name:
-        return None
-    
-    if estore_id:
-        estore=EStore.objects.filter(id=estore_id).first()
-        return Entity.objects.get_or_create(name=name.strip(), entity_type=entity_type, estore=estore)[0]
-    return Entity.objects.get_or_create(name=name.strip(), entity_type=entity_type)[0]
-
-def get_or_create_category(name):
-    if not name or str(name).strip() == "":
-        return None
-    return Category.objects.get_or_create(name=name.strip())[0]
-
-def get_category_by_id(category_id):
-    if not category_id:
-        return None
-    return Category.objects.filter(id=category_id).first()
-
-
-def get_tax_category_by_id(tax_id):
-    if not tax_id:
-        return None
-    return TaxCategory.objects.filter(id=tax_id).first()
+def import_job_response(job):
+    return {
+        "job_id": job.id,
+        "file_name": job.file_name,
+        "status": job.status,
+        "total_rows": job.total_rows,
+        "processed_rows": job.processed_rows,
+        "created": job.created_count,
+        "error_count": job.error_count,
+        "errors": job.errors,
+        "created_at": job.created,
+        "finished_at": job.finished,
+    }
 
 
-@router.post("/upload-products/")
+@router.post("/upload-products/", auth=JWTAuth())
 def upload_products_from_excel(request, 
         seller_id: int = None,
         estore_id: int = None,
+        background: bool = True,
         file: UploadedFile = File(...)
     ):
+    """
+    Import products, variants and listings from an .xlsx or .csv file.
 
-    wb = load_workbook(filename=file.file)
-    sheet = wb.active
-    headers = [cell.value for cell in sheet[1]]
-
-    created_count = 0
-    errors = []
+    By default the file is queued as a ProductImportJob and imported in the
+    background; poll /upload-products/{job_id}/ for progress. With
+    background=false the import runs inside the request and returns the
+    summary directly. seller_id / estore_id are used for rows that leave
+    those columns empty.
+    """
+    suffix = ".csv" if (file.name or "").lower().endswith(".csv") else ".xlsx"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        for data in file.chunks():
+            tmp.write(data)
+        path = tmp.name
 
-    empty_row_count = 0
+    if not background:
+        try:
+            importer = import_file(path, seller_id, estore_id)
+        finally:
+            os.remove(path)
+        return {
+            "status": "success" if not importer.errors else "partial",
+            "created": importer.created,
+            "errors": importer.errors
+        }
+
+    job = ProductImportJob.objects.create(
+        file_name=file.name or "upload",
+        seller=Entity.objects.filter(id=seller_id).first() if seller_id else None,
+        estore=EStore.objects.filter(id=estore_id).first() if estore_id else None,
+    )
+    start_import(job, path)
+    return import_job_response(job)
 
-    for idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-        
-        if not any(cell not in (None, "", " ") for cell in row):
-            empty_row_count += 1
-            if empty_row_count >= 2:
-                break  # stop after 2 consecutive empty rows
-            continue  # skip this empty row
-        else:
-            empty_row_count = 0  # reset if row is not empty
 
+@router.get("/upload-products/{job_id}/", auth=JWTAuth())
+def upload_products_status(request, job_id: int):
+    job = get_object_or_404(ProductImportJob, id=job_id)
+    return import_job_response(expire_if_stale(job))
 
-        row_data = dict(zip(headers, row))
-        try:
-            product, _ = Product.objects.get_or_create(
-                name=row_data['product_name'],
-                defaults={
-                    'about': row_data.get('product_about') or "",
-                    'description': row_data.get('product_description') or "",
-                    'base_price': row_data.get('base_price') or 0,
-                    'is_service': parse_bool(row_data.get('is_service')),
-                    'category': get_category_by_id(row_data.get('category_id')),
-                    'brand': get_or_create_entity(row_data.get('brand_name'), 'brand', row_data.get("estore_id")),
-                    'unit_size': row_data.get('unit_size') or 1,
-                    'size_unit': row_data.get('size_unit') or None,
-                    'tax_category': get_tax_category_by_id(row_data.get('tax_category_id')),
-                }
-            )
-
-            # Create Variant
-            try:
-                attributes = literal_eval(row_data.get('variant_attributes') or "[]")
-            except:
-                attributes = []
-            
-            if row_data.get('variant_name'):
-                variant, _ = Variant.objects.get_or_create(
-                    product=product,
-                    name=row_data['variant_name'],
-                    defaults={'attributes': attributes}
-                )
-            else:
-                variant = None
-
-            # Create ProductListing
-            ProductListing.objects.create(
-                product=product,
-                variant=variant,
-                name="",
-                price=row_data.get('price') or 0,
-                mrp=row_data.get('mrp') or 0,
-                stock=row_data.get('stock') or 0,
-                approved=False,
-                featured=False,
-                units_per_pack=row_data.get('units_per_pack') or 1,
-                seller=Entity.objects.filter(id=row_data.get('seller_id')).first(),
-                estore=EStore.objects.filter(id=row_data.get('estore_id')).first()
-            )
-
-            created_count += 1
 
-        except Exception as e:
-            errors.append({
-                "row": idx,
-                "error": str(e),
-                "data": row_data
-            })
+@router.get("/export-products/", response={400: ErrorSchema}, auth=JWTAuth())
+def export_products(
+    request,
+    format: str = Query("csv", description="csv, ndjson or xlsx"),
+    seller_id: int = None,
+    estore_id: int = None,
+    category_id: int = Query(None, description="Category and its subcategories"),
+    approved: bool = None,
+):
+    """
+    Stream the catalog (listings with product, variant, brand, category and
+    features). The csv/xlsx layout can be uploaded again to /upload-products/.
+    """
+    if format not in CONTENT_TYPES:
+        return 400, {"detail": f"Unsupported format, use one of: {', '.join(CONTENT_TYPES)}"}
 
-    return {
-        "status": "success" if not errors else "partial",
-        "created": created_count,
-        "errors": errors
-    }
+    qs = ProductListing.objects.all()
+    if seller_id:
+        qs = qs.filter(seller_id=seller_id)
+    if estore_id:
+        qs = qs.filter(estore_id=estore_id)
+    if approved is not None:
+        qs = qs.filter(approved=approved)
+    if category_id:
+        category_q = category_subtree_q(category_id)
+        if category_q is None:
+            return 400, {"detail": "Category not found"}
+        qs = qs.filter(category_q)
+
+    chunks = export_listings(qs, format)
+    if isinstance(request, ASGIRequest):
+        chunks = as_async(chunks)
+    response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[format])
+    response["Content-Disposition"] = f'attachment; filename="products.{format}"'
+    return response
 
 ############################ Category ############################
 # Create Category
@@ -205,9 +187,17 @@ def create_category(request, payload: CategoryCreateSchema):
     category.save()
     return category
 
+@router.get("/cache-stats/", auth=AdminJWTAuth())
+def cache_stats(request):
+    """
+    Response cache hits and misses per tier (L1 in-process, L2 shared) and
+    L1 size, for the worker process answering the request
+    """
+    return get_cache_stats()
+
 # Read Users (List)
 @router.get("/categories/", response=PaginatedResponseSchema)
-@cache_response()
+@cache_response(tags=["Category"], local=True)
 def categories(
         request,
         page: int = Query(1, description="Page number"),
@@ -218,10 +208,23 @@ def categories(
         category_type: Optional[str] = Query("product", description="Type of category"),
         search: Optional[str] = Query(None, description="Search by category name"),
     ):
-    qs = Category.objects.filter(approved=True)
-
     query = ""
 
+    if not has_blogs:
+        # Everything but has_blogs can be answered from the in-memory tree
+        tree = get_category_tree()
+        nodes = [
+            c for c in tree.nodes
+            if c.approved
+            and (estore_id is None or c.estore_id == estore_id)
+            and (not level or c.level == level)
+            and (not category_type or c.category_type == category_type)
+            and (not search or search.lower() in c.name.lower())
+        ]
+        return paginate_queryset(request, nodes, CategoryOutSchema, page, page_size)
+
+    qs = Category.objects.filter(approved=True)
+
     if search:
         qs = qs.filter(name__icontains=search)
         query = query + "&search=" + search
@@ -246,74 +249,50 @@ def categories(
 
 
 @router.get("/categories/parents-children/{category_id}/", response=CategoryParentChildrenOutSchema)
-@cache_response()
+@cache_response(tags=["Category"])
 def retrieve_category_parents_children(request, category_id: int, estore_id: int = None):
-    category = get_object_or_404(Category, id=category_id)
+    tree = get_category_tree()
+    if tree.get(category_id) is None:
+        raise Http404("No Category matches the given query.")
 
-    # Get all parents with filters
     print("Category Parents Children", category_id, estore_id)
-    def get_all_parents(category, estore_id=None):
-        parents = []
-        while True:
-            parent = category.get_parent()
-            if not parent:
-                break
-            # Filter conditions for parents
-            if parent.approved and (estore_id is None or parent.estore.id == estore_id):
-                parents.insert(0, parent)
-            category = parent
-        return parents
-
-    parents = get_all_parents(category, estore_id)
-
-    # Get children categories with filters
-    children_qs = category.get_children()
-    if estore_id is not None:
-        children_qs = children_qs.filter(estore_id=estore_id)
-    children_qs = children_qs.filter(approved=True)
 
+    # Parents and children come from the in-memory tree, no queries
     return {
-        "parents": [CategorySchema.from_orm(parent) for parent in parents],
-        "children": [CategorySchema.from_orm(child) for child in children_qs],
+        "parents": [CategorySchema.from_orm(parent) for parent in tree.ancestors(category_id, estore_id)],
+        "children": [CategorySchema.from_orm(child) for child in tree.get_children(category_id, estore_id)],
     }
 
 
 
 
 @router.get("/categories/siblings/{category_id}/", response=list[CategoryOutSchema])
-@cache_response()
+@cache_response(tags=["Category"])
 def retrieve_category_siblings(request, category_id: int, estore_id: int = None):
-    category = get_object_or_404(Category, id=category_id)
+    tree = get_category_tree()
+    if tree.get(category_id) is None:
+        raise Http404("No Category matches the given query.")
 
-    # Get the parent of the current category
-    parent = category.get_parent()
-
-    if parent:
-        siblings_qs = parent.get_children()
-    else:
-        siblings_qs = Category.get_root_nodes()
-
-    # Apply filters
-    siblings_qs = siblings_qs.exclude(id=category.id)  # Exclude current category
-    siblings_qs = siblings_qs.filter(approved=True)
-    if estore_id is not None:
-        siblings_qs = siblings_qs.filter(estore_id=estore_id)
-
-    return [CategoryOutSchema.from_orm(sibling) for sibling in siblings_qs]
+    # Approved children of the same parent (or other roots), excluding this category
+    return [CategoryOutSchema.from_orm(sibling) for sibling in tree.siblings(category_id, estore_id)]
 
 
 
 # Read Single User (Retrieve)
 @router.get("/categories/{category_id}/", response=CategoryOutSchema)
 def retrieve_category(request, category_id: int):
-    category = get_object_or_404(Category, id=category_id)
+    category = get_category_tree().get(category_id)
+    if category is None:
+        raise Http404("No Category matches the given query.")
     return category
 
 
 @router.get("/categories/slug/{category_slug}/", response=CategoryOutSchema)
-@cache_response()
+@cache_response(tags=["Category"])
 def retrieve_category_slug(request, category_slug: str):
-    category = get_object_or_404(Category, slug=category_slug)
+    category = get_category_tree().get_by_slug(category_slug)
+    if category is None:
+        raise Http404("No Category matches the given query.")
     return CategoryOutSchema.from_orm(category)
 
 # Update User
@@ -371,7 +350,7 @@ def create_product(request, payload: ProductCreateSchema):
 
 # Read Products (List)
 @router.get("/products/", response=PaginatedResponseSchema)
-@cache_response()
+@cache_response(tags=["Product"])
 def products(request,  page: int = 1, page_size: int = 10, category_id:str = None , ordering: str = None, seller_id: int = None):
     qs = Product.objects.all()
 
@@ -394,7 +373,7 @@ def products(request,  page: int = 1, page_size: int = 10, category_id:str = Non
 
 # Read Single Product (Retrieve)
 @router.get("/products/{product_id}/", response=ProductOutOneSchema)
-@cache_response()
+@cache_response(tags=["Product:{product_id}"])
 def retrieve_product(request, product_id: int):
 
     product = get_object_or_404(Product.objects.prefetch_related('product_variants'), id=product_id)
@@ -508,8 +487,20 @@ def create_product_listing(
 
 
 
+def product_listing_list_tags(request, *args, **kwargs):
+    # An estore's pages are dropped when one of its listings changes, pages
+    # across estores when any listing does
+    params = request.GET
+    tags = [f"estore:{params['estore_id']}" if params.get("estore_id") else "ProductListing"]
+    if params.get("product_id"):
+        tags.append(f"Product:{params['product_id']}")
+    if params.get("category_id"):
+        tags.append(f"Category:{params['category_id']}")
+    return tags
+
+
 @router.get("/product-listings/", response=PaginatedResponseSchema)
-@cache_response()
+@cache_response(tags=product_listing_list_tags, stale_timeout=60, single_flight=True, early_expiration=1.0)
 def product_listings(
     request,
     page: int = 1,
@@ -545,13 +536,11 @@ def product_listings(
         
     # Filter by category and its children
     if category_id:
-        try:
-            category = Category.objects.get(id=category_id)
-            descendants = category.get_descendants()
-            qs = qs.filter(category__in=[category] + list(descendants))
-            query = query + "&category_id=" + category_id
-        except Category.DoesNotExist:
+        subtree = category_subtree_q(category_id)
+        if subtree is None:
             return {"error": "Category not found"}
+        qs = qs.filter(subtree)
+        query = query + "&category_id=" + category_id
         
     if featured:
         qs = qs.filter(featured =featured)
@@ -590,23 +579,60 @@ def product_listings(
         qs = qs.filter(is_service=is_service)
         query = query + "&is_service=" + str(is_service)
         
-    # Filter by features
+    # Ordering
+    if ordering:
+        query = query + "&ordering=" + ordering
+        qs = qs.order_by(ordering)
+
+    # Filter by features with the in-memory facet index (products/facets.py)
+    # instead of one JOIN on product_listing_features per feature template
     if feature_filters:
         query = query + "&feature_filters=" + feature_filters
         try:
-            feature_filters = json.loads(feature_filters)  # Parse the JSON string
-            for feature_template_id, values in feature_filters.items():
-                qs = qs.filter(
-                    product_listing_features__feature_template__id=feature_template_id,
-                    product_listing_features__value__in=values,
-                )
+            features = {
+                int(feature_template_id): [str(v) for v in values]
+                for feature_template_id, values in json.loads(feature_filters).items()
+            }
         except Exception as e:
             return {"error": f"Feature filter error: {str(e)}"}
 
-    # Ordering
-    if ordering:
-        query = query + "&ordering=" + ordering
-        qs = qs.order_by(ordering)
+        cursor = request.GET.get("pagination") == "cursor" or request.GET.get("cursor")
+        if (ordering or "-id") in FACET_ORDERINGS and not cursor:
+            # Every filter and the ordering are answered by the index, only
+            # the rows of the requested page are read from the database
+            search_ids = search_listing_ids(search) if search else None
+            index = get_facet_index()
+            with index.lock:
+                bits = index.select(
+                    category_id=int(category_id) if category_id else None,
+                    estore_id=estore_id or None,
+                    seller_id=seller_id or None,
+                    product_id=product_id or None,
+                    approved=approved,
+                    is_service=is_service,
+                    featured=True if featured else None,
+                    brand_ids=[int(b) for b in brand_ids.split(",") if b] if brand_ids else None,
+                    feature_filters=features,
+                    min_price=min_price,
+                    max_price=max_price,
+                    listing_ids=search_ids,
+                )
+                if bits is None:
+                    return {"error": "Category not found"}
+                listing_ids = index.listing_ids(bits, ordering)
+
+            def load_page(page_ids):
+                rows = eager_load(ProductListing.objects.all(), ProductListingOutSchema).in_bulk(page_ids)
+                return [rows[i] for i in page_ids if i in rows]
+
+            return paginate_queryset(request, listing_ids, ProductListingOutSchema, page, page_size, query, transform=load_page)
+
+        # Orderings the index can't sort by and cursor pagination stay in
+        # SQL, with one EXISTS per feature template
+        for feature_template_id, values in features.items():
+            qs = qs.filter(Exists(Feature.objects.filter(
+                product_listing=OuterRef("pk"), feature_template_id=feature_template_id, value__in=values,
+            )))
 
     # Paginate the results
     return paginate_queryset(request, qs, ProductListingOutSchema, page, page_size, query)
@@ -649,7 +675,6 @@ def update_product_listing_image(
 
 
 @router.get("/sidebar-filters/", tags=["Sidebar filters"])
-@cache_response()
 def get_sidebar_filters(
     request, 
     category_id: str = None,
@@ -664,94 +689,40 @@ def get_sidebar_filters(
     ):
     """
     API to fetch sidebar filters for product listings.
-    """
-    filters = {}
 
-    # print(category_id, brand_ids, min_price, max_price, feature_filters)
-    
-    # Filter listings by category if category_id is provided
-    qs = ProductListing.objects.all()
-    
-    # Filter by category
-    
-    if category_id:
-        try:
-            category = Category.objects.get(id=category_id)
-            descendants = category.get_descendants()
-            qs = qs.filter(category__in=[category] + list(descendants))
-        except Category.DoesNotExist:
+    Counts come from the in-memory facet index (products/facets.py), only a
+    free-text search still goes to the database.
+    """
+    try:
+        brand_id_list = [int(b) for b in brand_ids.split(",") if b] if brand_ids else None
+        features = {
+            int(template_id): [str(v) for v in values]
+            for template_id, values in json.loads(feature_filters).items()
+        } if feature_filters else None
+    except (ValueError, TypeError, AttributeError) as e:
+        return {"error": f"Feature filter error: {str(e)}"}
+
+    search_ids = search_listing_ids(search) if search else None
+    category = int(category_id) if category_id else None
+    index = get_facet_index()
+    with index.lock:
+        bits = index.select(
+            category_id=category,
+            estore_id=estore_id,
+            approved=approved,
+            is_service=is_service,
+            brand_ids=brand_id_list,
+            feature_filters=features,
+            min_price=min_price,
+            max_price=max_price,
+            listing_ids=search_ids,
+        )
+        if bits is None:
             return {"error": "Category not found"}
-        
-    if estore_id:
-        qs = qs.filter(estore__id=estore_id)
-
-    if approved is not None:
-        qs = qs.filter(approved=approved)
-    
-    if search:
-        qs = qs.filter(Q(name__icontains=search) | Q(product__name__icontains=search))
-
-
-    # Filter by brands
-    if brand_ids:
-        brand_id_list = brand_ids.split(",")  # Split comma-separated string into list
-        qs = qs.filter(brand__id__in=brand_id_list)
-
-    # Filter by price range
-    if min_price is not None:
-        qs = qs.filter(price__gte=min_price)
-    if max_price is not None:
-        qs = qs.filter(price__lte=max_price)
-
-    if is_service is not None:
-        qs = qs.filter(is_service=is_service)
-
-    if feature_filters:
-        try:
-            for feature_template_id, values in feature_filters.items():
-                qs = qs.filter(
-                    product_listing_features__feature_template__id=feature_template_id,
-                    product_listing_features__value__in=values,
-                )
-        except Exception as e:
-            return {"error": f"Feature filter error: {str(e)}"}
-
-    # Get brand filters
-    filters['brands'] = list(
-        qs.values('brand__id', 'brand__name')
-        .annotate(count=Count('id'))
-        .order_by('-count')
-    )
-
-    # filters['categories'] = list(
-    #     qs.values('category__id', 'category__name')
-    #     .annotate(count=Count('id'))
-    #     .order_by('-count')
-    # )
-
-    filters['features'] = list(
-        qs.values('product_listing_features__feature_template__id', 'product_listing_features__feature_template__name','product_listing_features__value')
-        .annotate(count=Count('id'))
-        .order_by('-count')
-    )
-
-    # print(filters)
-    
-    # Get price range
-    price_range = qs.aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
-
-    filters['price_range'] = {
-        "min_price": price_range.get('min_price', 0),
-        "max_price": price_range.get('max_price', 0)
-    }
-
-    return filters
+        return index.facets(bits, category)
 
 @router.get("/product-listings/related/{product_listing_id}/", response=PaginatedResponseSchema)
-@cache_response()
+@cache_response(tags=["ProductListing:{product_listing_id}"])
 def get_related_products(
     request,
     product_listing_id: int,
@@ -815,7 +786,7 @@ def retrieve_product_listing(request, product_listing_id: int):
     return product_listing
 
 @router.get("/product-listings/slug/{product_listing_slug}/", response=ProductListingOneOutSchema)
-@cache_response()
+@cache_response(tags=["ProductListing:slug:{product_listing_slug}"])
 def retrieve_product_listing_slug(request, product_listing_slug: str):
     product_listing = get_object_or_404(ProductListing, slug=product_listing_slug)
     return ProductListingOneOutSchema.from_orm(product_listing)
@@ -0,0 +1,174 @@
+import bisect
+import threading
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from utils.cache import get_tag_versions
+from .models import Category
+
+
+SNAPSHOT_KEY = "category_tree:{}"
+SNAPSHOT_TAG = "Category"
+
+# estore key -> (tag version, CategorySnapshot), so a hit costs one cache get
+_local = {}
+_tree = None
+_tree_lock = threading.Lock()
+
+
+class CategorySnapshot:
+    """
+    Category ids keyed by treebeard path, sorted by path. A subtree is the
+    contiguous range of paths starting with the root's path, so lookups are a
+    bisect instead of get_descendants().
+    """
+
+    def __init__(self, rows):
+        rows = sorted(rows)
+        self.paths = [path for path, _ in rows]
+        self.ids = [category_id for _, category_id in rows]
+        self.path_by_id = {category_id: path for path, category_id in rows}
+
+    def path(self, category_id):
+        return self.path_by_id.get(category_id)
+
+    def subtree_range(self, category_id):
+        path = self.path(category_id)
+        if path is None:
+            return None
+        start = bisect.bisect_left(self.paths, path)
+        end = bisect.bisect_right(self.paths, path + "\uffff")
+        return start, end
+
+    def subtree_ids(self, category_id):
+        bounds = self.subtree_range(category_id)
+        if bounds is None:
+            return []
+        return self.ids[bounds[0]:bounds[1]]
+
+
+def _estore_key(estore_id):
+    return "all" if estore_id is None else str(estore_id)
+
+
+def get_category_snapshot(estore_id=None):
+    """
+    The category tree of an estore (or all categories), cached in the shared
+    cache and refreshed whenever the "Category" tag is invalidated, i.e. on
+    Category save, delete and move.
+    """
+    key = _estore_key(estore_id)
+    version = get_tag_versions([SNAPSHOT_TAG])[SNAPSHOT_TAG]
+
+    local = _local.get(key)
+    if local is not None and local[0] == version:
+        return local[1]
+
+    cached = cache.get(SNAPSHOT_KEY.format(key))
+    if cached is not None and cached[0] == version:
+        snapshot = CategorySnapshot(cached[1])
+    else:
+        qs = Category.objects.all()
+        if estore_id is not None:
+            qs = qs.filter(estore_id=estore_id)
+        rows = list(qs.values_list("path", "id"))
+        cache.set(SNAPSHOT_KEY.format(key), (version, rows), timeout=None)
+        snapshot = CategorySnapshot(rows)
+
+    _local[key] = (version, snapshot)
+    return snapshot
+
+
+def category_subtree_q(category_id, field="category", estore_id=None):
+    """
+    Q matching rows whose `field` is the category or one of its descendants,
+    as a single path__startswith predicate. None if the category doesn't exist.
+    """
+    try:
+        category_id = int(category_id)
+    except (TypeError, ValueError):
+        return None
+    path = get_category_snapshot(estore_id).path(category_id)
+    if path is None:
+        return None
+    return Q(**{f"{field}__path__startswith": path})
+
+
+class CategoryTree(CategorySnapshot):
+    """
+    Every category of every estore, held per process. Tree structure is kept
+    as arrays in path order (parent position, depth, approved, estore id) next
+    to the Category instances used for rendering, so breadcrumbs, children
+    and siblings need no queries.
+    """
+
+    def __init__(self, categories, version):
+        categories = sorted(categories, key=lambda c: c.path)
+        super().__init__([(c.path, c.id) for c in categories])
+        self.version = version
+        self.nodes = categories
+        self.position = {c.id: i for i, c in enumerate(categories)}
+        self.by_slug = {c.slug: c for c in categories}
+        self.depth = [c.depth for c in categories]
+        self.approved = [c.approved for c in categories]
+        self.estore = [c.estore_id for c in categories]
+
+        steplen = Category.steplen
+        self.parent = [self.position.get(self._id_by_path(c.path[:-steplen]), -1) for c in categories]
+        self.children = [[] for _ in categories]
+        self.roots = []
+        for i, parent in enumerate(self.parent):
+            (self.children[parent] if parent >= 0 else self.roots).append(i)
+
+    def _id_by_path(self, path):
+        index = bisect.bisect_left(self.paths, path)
+        if path and index < len(self.paths) and self.paths[index] == path:
+            return self.ids[index]
+        return None
+
+    def _visible(self, position, estore_id=None):
+        return self.approved[position] and (estore_id is None or self.estore[position] == estore_id)
+
+    def get(self, category_id):
+        position = self.position.get(category_id)
+        return self.nodes[position] if position is not None else None
+
+    def get_by_slug(self, slug):
+        return self.by_slug.get(slug)
+
+    def ancestors(self, category_id, estore_id=None):
+        """Approved ancestors, root first"""
+        result = []
+        position = self.parent[self.position[category_id]]
+        while position >= 0:
+            if self._visible(position, estore_id):
+                result.append(self.nodes[position])
+            position = self.parent[position]
+        result.reverse()
+        return result
+
+    def get_children(self, category_id, estore_id=None):
+        return [self.nodes[i] for i in self.children[self.position[category_id]] if self._visible(i, estore_id)]
+
+    def siblings(self, category_id, estore_id=None):
+        position = self.position[category_id]
+        parent = self.parent[position]
+        candidates = self.children[parent] if parent >= 0 else self.roots
+        return [self.nodes[i] for i in candidates if i != position and self._visible(i, estore_id)]
+
+
+def get_category_tree():
+    """
+    The process-wide CategoryTree, reloaded from the database when the
+    "Category" tag version moves (Category save, delete or move).
+    """
+    global _tree
+    version = get_tag_versions([SNAPSHOT_TAG])[SNAPSHOT_TAG]
+    tree = _tree
+    if tree is not None and tree.version == version:
+        return tree
+    with _tree_lock:
+        if _tree is None or _tree.version != version:
+            _tree = CategoryTree(list(Category.objects.all()), version)
+        return _tree
@@ -0,0 +1,167 @@
+"""
+Streaming catalog export used by /product/export-products/.
+
+Listings are read with values() through a server side iterator, a batch at a
+time, and their features are fetched with one query per batch, so memory stays
+flat whatever the catalog size. The first columns follow the upload-products
+layout (see products.importer), so an exported file can be edited and uploaded
+again; the remaining columns are informational and ignored on import.
+"""
+import csv
+import json
+import os
+import tempfile
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from openpyxl import Workbook
+
+from .models import Feature
+
+
+BATCH_SIZE = 2000
+# Chunks handed over per thread switch by as_async()
+ASYNC_CHUNKS = 256
+
+# column -> ProductListing values() lookup
+IMPORT_COLUMNS = {
+    "product_name": "product__name",
+    "product_about": "product__about",
+    "product_description": "product__description",
+    "base_price": "product__base_price",
+    "is_service": "is_service",
+    "category_id": "category_id",
+    "brand_name": "brand__name",
+    "unit_size": "product__unit_size",
+    "size_unit": "product__size_unit",
+    "tax_category_id": "product__tax_category_id",
+    "variant_name": "variant__name",
+    "variant_attributes": "variant__attributes",
+    "price": "price",
+    "mrp": "mrp",
+    "stock": "stock",
+    "units_per_pack": "units_per_pack",
+    "seller_id": "seller_id",
+    "estore_id": "estore_id",
+}
+EXTRA_COLUMNS = {
+    "listing_id": "id",
+    "listing_name": "name",
+    "slug": "slug",
+    "category_name": "category__name",
+    "approved": "approved",
+    "featured": "featured",
+}
+COLUMNS = list(IMPORT_COLUMNS) + list(EXTRA_COLUMNS) + ["features"]
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def iter_listings(queryset):
+    """Yield one dict per listing, keyed by COLUMNS"""
+    lookups = {**IMPORT_COLUMNS, **EXTRA_COLUMNS}
+    rows = queryset.order_by("id").values(*lookups.values()).iterator(chunk_size=BATCH_SIZE)
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch:
+            return
+
+        features = {}
+        for listing_id, name, value in Feature.objects.filter(
+            product_listing_id__in=[row["id"] for row in batch]
+        ).order_by("id").values_list("product_listing_id", "feature_template__name", "value"):
+            features.setdefault(listing_id, {})[name] = value
+
+        for row in batch:
+            item = {column: row[lookup] for column, lookup in lookups.items()}
+            item["features"] = features.get(row["id"], {})
+            yield item
+
+
+############################ Writers ############################
+
+class _Echo:
+    """File-like object whose write() returns the data, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def _cell(column, value):
+    # variant_attributes is read back with literal_eval, so keep Python syntax
+    if column == "variant_attributes":
+        return repr(value) if value is not None else ""
+    if column == "features":
+        return json.dumps(value) if value else ""
+    return "" if value is None else value
+
+
+def stream_csv(items):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for item in items:
+        yield writer.writerow([_cell(column, item[column]) for column in COLUMNS])
+
+
+def stream_ndjson(items):
+    for item in items:
+        yield json.dumps(item, default=str) + "\n"
+
+
+def stream_xlsx(items, chunk_size=64 * 1024):
+    """
+    XLSX is a zip archive and can't be written incrementally to the client;
+    rows go to a write-only workbook on disk and the file is streamed back.
+    """
+    wb = Workbook(write_only=True)
+    sheet = wb.create_sheet("Products")
+    sheet.append(COLUMNS)
+    for item in items:
+        sheet.append([_cell(column, item[column]) for column in COLUMNS])
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(path)
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                yield data
+    finally:
+        os.remove(path)
+
+
+WRITERS = {
+    "csv": stream_csv,
+    "ndjson": stream_ndjson,
+    "xlsx": stream_xlsx,
+}
+
+
+def export_listings(queryset, format="csv"):
+    """Iterator of encoded chunks for a StreamingHttpResponse"""
+    return WRITERS[format](iter_listings(queryset))
+
+
+async def as_async(chunks):
+    """
+    Async iterator over export_listings() for StreamingHttpResponse under ASGI,
+    where Django reads a sync iterator with sync_to_async(list), i.e. the whole
+    export in memory. The chunks are read ASYNC_CHUNKS at a time in the
+    request's thread-sensitive thread, which holds the server side cursor.
+    """
+    read = sync_to_async(lambda: list(islice(chunks, ASYNC_CHUNKS)))
+    try:
+        while True:
+            batch = await read()
+            if not batch:
+                return
+            for chunk in batch:
+                yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,469 @@
+"""
+In-process facet index for the product listing sidebar.
+
+Every listing gets a bit position; each facet value (brand, feature value,
+category, estore, seller, product, approved, is_service, featured) keeps a Python int used as a bitmap of
+the listings that have it. A filter combination is answered by AND/OR of
+those ints, and counts are popcounts, instead of GROUP BY queries over
+ProductListing x Feature.
+
+Positions are assigned in price order when the index is built, so the price
+range of a result is its lowest and highest set bit. Listings changed
+afterwards get new positions in an unsorted tail that is scanned directly and
+folded back in by the next rebuild.
+
+Saves are applied incrementally: the signal handlers call record_change(),
+which bumps a shared sequence in the cache once the transaction commits.
+Every worker checks that sequence once per request and reloads just the
+changed listings. When a full rebuild is needed (names or categories changed,
+the change log expired, the unsorted tail grew too long) a fresh index is
+built in a background thread and swapped in; requests keep using the current
+one meanwhile. A worker's first index is built the same way and its first
+requests wait for it. The database is never queried while the index lock is
+held, the lock only guards reading and mutating the bitmaps.
+"""
+import bisect
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .category_tree import get_category_snapshot
+from .models import Feature, FeatureTemplate, ProductListing
+from users.models import Entity
+
+
+logger = logging.getLogger("facets")
+
+SEQUENCE_KEY = "facets:seq"
+CHANGE_KEY = "facets:change:{}"
+CHANGE_TIMEOUT = 60 * 60
+# Rebuild once this many changed listings sit in the unsorted tail
+MAX_TAIL = 2000
+REBUILD = "rebuild"
+# The orderings listing_ids() can sort by
+ORDERINGS = ("id", "-id", "price", "-price")
+LISTING_FIELDS = ("id", "price", "brand_id", "category_id", "estore_id", "seller_id", "product_id",
+                  "approved", "is_service", "featured")
+
+
+def _bits(positions):
+    value = 0
+    for position in positions:
+        value |= 1 << position
+    return value
+
+
+_BYTE_POSITIONS = [tuple(i for i in range(8) if byte >> i & 1) for byte in range(256)]
+
+
+def _iter_bits(value):
+    """Positions of the set bits, scanning a byte at a time"""
+    data = value.to_bytes((value.bit_length() + 7) // 8, "little")
+    for offset, byte in enumerate(data):
+        if byte:
+            base = offset * 8
+            for i in _BYTE_POSITIONS[byte]:
+                yield base + i
+
+
+class FacetIndex:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.sequence = 0
+        self.built_at = None
+        self._reset()
+
+    def _reset(self):
+        self.positions = {}          # listing id -> bit position
+        self.next_position = 0
+        self.listings = {}           # bit position -> (id, price, brand_id, category_id, estore_id, seller_id, product_id, feature keys)
+        self.all = 0
+        self.sorted_limit = 0        # positions below this are in price order
+        self.sorted_prices = []
+        self.brands = {}             # brand id (or None) -> bits
+        self.features = {}           # (feature template id, value) -> bits
+        self.categories = {}         # category id -> bits of listings directly in it
+        self.category_features = {}  # category id -> {(feature template id, value): listings directly in it}
+        self.estores = {}
+        self.sellers = {}
+        self.products = {}
+        self.approved = 0
+        self.service = 0
+        self.featured = 0
+        self.with_features = 0
+        self.brand_names = {}
+        self.template_names = {}
+        self._subtrees = {}
+        self._subtree_features = {}
+
+    ############################ Build / update ############################
+
+    def rebuild(self):
+        listings, features = _load_listings()
+        brand_names, template_names = _load_names({row[2] for row in listings})
+
+        with self.lock:
+            self._reset()
+            for row in listings:
+                self._add(row, features.get(row[0], ()))
+            self.sorted_limit = self.next_position
+            self.sorted_prices = [row[1] for row in listings]
+            self.brand_names = brand_names
+            self.template_names = template_names
+            self.built_at = time.time()
+
+    def _add(self, row, feature_keys):
+        listing_id, price, brand_id, category_id, estore_id, seller_id, product_id, approved, is_service, featured = row
+        position = self.next_position
+        self.next_position += 1
+        bit = 1 << position
+        self.positions[listing_id] = position
+        self.listings[position] = (
+            listing_id, price, brand_id, category_id, estore_id, seller_id, product_id, tuple(feature_keys)
+        )
+        self.all |= bit
+        self.brands[brand_id] = self.brands.get(brand_id, 0) | bit
+        self.categories[category_id] = self.categories.get(category_id, 0) | bit
+        self.estores[estore_id] = self.estores.get(estore_id, 0) | bit
+        self.sellers[seller_id] = self.sellers.get(seller_id, 0) | bit
+        self.products[product_id] = self.products.get(product_id, 0) | bit
+        if approved:
+            self.approved |= bit
+        if is_service:
+            self.service |= bit
+        if featured:
+            self.featured |= bit
+        counts = self.category_features.setdefault(category_id, {})
+        for key in feature_keys:
+            self.features[key] = self.features.get(key, 0) | bit
+            counts[key] = counts.get(key, 0) + 1
+        if feature_keys:
+            self.with_features |= bit
+        self._subtrees = {}
+        self._subtree_features = {}
+
+    def _remove(self, listing_id):
+        position = self.positions.pop(listing_id, None)
+        if position is None:
+            return
+        _, _, brand_id, category_id, estore_id, seller_id, product_id, feature_keys = self.listings.pop(position)
+        mask = ~(1 << position)
+        self.all &= mask
+        self.approved &= mask
+        self.service &= mask
+        self.featured &= mask
+        self.with_features &= mask
+        for index, key in (
+            (self.brands, brand_id), (self.categories, category_id), (self.estores, estore_id),
+            (self.sellers, seller_id), (self.products, product_id),
+        ):
+            index[key] &= mask
+        counts = self.category_features[category_id]
+        for key in feature_keys:
+            self.features[key] &= mask
+            counts[key] -= 1
+            if not counts[key]:
+                del counts[key]
+        self._subtrees = {}
+        self._subtree_features = {}
+
+    def apply_changes(self, listing_ids, rows, features, brand_names):
+        """
+        Replace the given listings with their reloaded rows (see _load_listings),
+        dropping deleted ones. Returns False once the unsorted tail is long
+        enough to need a rebuild.
+        """
+        with self.lock:
+            for listing_id in listing_ids:
+                self._remove(listing_id)
+            for row in rows:
+                self._add(row, features.get(row[0], ()))
+            self.brand_names.update(brand_names)
+            return self.next_position - self.sorted_limit <= MAX_TAIL
+
+    ############################ Queries ############################
+
+    def subtree(self, category_id):
+        bits = self._subtrees.get(category_id)
+        if bits is None:
+            snapshot = get_category_snapshot()
+            if snapshot.path(category_id) is None:
+                return None
+            bits = _bits_or(self.categories.get(i, 0) for i in snapshot.subtree_ids(category_id))
+            self._subtrees[category_id] = bits
+        return bits
+
+    def subtree_features(self, category_id):
+        """The (feature template id, value) keys used by listings in the category's subtree"""
+        keys = self._subtree_features.get(category_id)
+        if keys is None:
+            keys = set()
+            for i in get_category_snapshot().subtree_ids(category_id):
+                keys.update(self.category_features.get(i, ()))
+            self._subtree_features[category_id] = keys
+        return keys
+
+    def select(self, category_id=None, estore_id=None, seller_id=None, product_id=None, approved=None,
+               is_service=None, featured=None, brand_ids=None, feature_filters=None, min_price=None,
+               max_price=None, listing_ids=None):
+        """Bitmap of the listings matching the filters, or None for an unknown category"""
+        bits = self.all
+        if category_id is not None:
+            subtree = self.subtree(category_id)
+            if subtree is None:
+                return None
+            bits &= subtree
+        if estore_id is not None:
+            bits &= self.estores.get(estore_id, 0)
+        if seller_id is not None:
+            bits &= self.sellers.get(seller_id, 0)
+        if product_id is not None:
+            bits &= self.products.get(product_id, 0)
+        if approved is not None:
+            bits &= self.approved if approved else ~self.approved
+        if is_service is not None:
+            bits &= self.service if is_service else ~self.service
+        if featured is not None:
+            bits &= self.featured if featured else ~self.featured
+        if brand_ids:
+            bits &= _bits_or(self.brands.get(b, 0) for b in brand_ids)
+        for template_id, values in (feature_filters or {}).items():
+            bits &= _bits_or(self.features.get((template_id, v), 0) for v in values)
+        if listing_ids is not None:
+            bits &= _bits(self.positions[i] for i in listing_ids if i in self.positions)
+        if min_price is not None or max_price is not None:
+            bits &= self._price_mask(bits, min_price, max_price)
+        return bits
+
+    def _price_mask(self, bits, min_price, max_price):
+        # The sorted region is a contiguous range of positions per price range
+        low = bisect.bisect_left(self.sorted_prices, min_price) if min_price is not None else 0
+        high = bisect.bisect_right(self.sorted_prices, max_price) if max_price is not None else self.sorted_limit
+        mask = ((1 << high) - 1) & ~((1 << low) - 1)
+        for position in _iter_bits(bits >> self.sorted_limit << self.sorted_limit):
+            price = self.listings[position][1]
+            if (min_price is None or price >= min_price) and (max_price is None or price <= max_price):
+                mask |= 1 << position
+        return mask
+
+    def listing_ids(self, bits, ordering=None):
+        """
+        Ids of the listings in a bitmap, sorted like order_by(ordering) would.
+        Returns None for orderings the index doesn't hold (see ORDERINGS).
+        """
+        ordering = ordering or "-id"
+        if ordering not in ORDERINGS:
+            return None
+        if ordering in ("id", "-id"):
+            return sorted((self.listings[p][0] for p in _iter_bits(bits)), reverse=ordering == "-id")
+        if ordering in ("price", "-price"):
+            rows = sorted(
+                ((self.listings[p][1], self.listings[p][0]) for p in _iter_bits(bits)),
+                reverse=ordering == "-price",
+            )
+            return [listing_id for _, listing_id in rows]
+        return None
+
+    def price_range(self, bits):
+        sorted_mask = (1 << self.sorted_limit) - 1
+        head = bits & sorted_mask
+        prices = [self.listings[p][1] for p in _iter_bits(bits & ~sorted_mask)]
+        if head:
+            prices.append(self.listings[(head & -head).bit_length() - 1][1])
+            prices.append(self.listings[head.bit_length() - 1][1])
+        if not prices:
+            return {"min_price": None, "max_price": None}
+        return {"min_price": min(prices), "max_price": max(prices)}
+
+    def facets(self, bits, category_id=None):
+        """
+        Brand, feature and price facets of a bitmap. With a category only the
+        feature values used in its subtree are counted, not the whole catalog's.
+        """
+        keys = self.features if category_id is None else self.subtree_features(category_id)
+        brands = [
+            {"brand__id": brand_id, "brand__name": self.brand_names.get(brand_id), "count": (bits & b).bit_count()}
+            for brand_id, b in self.brands.items()
+        ]
+        features = [
+            {
+                "product_listing_features__feature_template__id": template_id,
+                "product_listing_features__feature_template__name": self.template_names.get(template_id),
+                "product_listing_features__value": value,
+                "count": (bits & self.features[(template_id, value)]).bit_count(),
+            }
+            for template_id, value in keys
+        ]
+        without_features = (bits & ~self.with_features).bit_count()
+        if without_features:
+            features.append({
+                "product_listing_features__feature_template__id": None,
+                "product_listing_features__feature_template__name": None,
+                "product_listing_features__value": None,
+                "count": without_features,
+            })
+        return {
+            "brands": sorted((b for b in brands if b["count"]), key=lambda b: -b["count"]),
+            "features": sorted((f for f in features if f["count"]), key=lambda f: -f["count"]),
+            "price_range": self.price_range(bits),
+        }
+
+
+def _bits_or(values):
+    result = 0
+    for value in values:
+        result |= value
+    return result
+
+
+def _load_listings(listing_ids=None):
+    """
+    The index rows (LISTING_FIELDS, in price order) and feature keys of the
+    given listings, or of every listing
+    """
+    listings = ProductListing.objects.order_by("price", "id")
+    feature_rows = Feature.objects.all()
+    if listing_ids is not None:
+        listings = listings.filter(id__in=listing_ids)
+        feature_rows = feature_rows.filter(product_listing_id__in=listing_ids)
+    rows = list(listings.values_list(*LISTING_FIELDS))
+    features = {}
+    for listing_id, template_id, value in feature_rows.values_list(
+        "product_listing_id", "feature_template_id", "value"
+    ):
+        features.setdefault(listing_id, set()).add((template_id, value))
+    return rows, features
+
+
+def _load_names(brand_ids):
+    brand_ids = [b for b in brand_ids if b is not None]
+    brand_names = dict(Entity.objects.filter(id__in=brand_ids).values_list("id", "name")) if brand_ids else {}
+    return brand_names, dict(FeatureTemplate.objects.values_list("id", "name"))
+
+
+############################ Shared change log ############################
+
+_index = FacetIndex()
+_builder = None              # the thread building the next index
+_builder_lock = threading.Lock()
+
+
+def _publish(listing_id):
+    try:
+        sequence = cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        cache.add(SEQUENCE_KEY, 0, timeout=None)
+        sequence = cache.incr(SEQUENCE_KEY)
+    cache.set(CHANGE_KEY.format(sequence), listing_id, timeout=CHANGE_TIMEOUT)
+
+
+def record_change(listing_id=REBUILD):
+    """
+    Tell every worker that a listing changed (or that names/categories did).
+    Published after commit, so no worker reloads the listing before the
+    change is visible to it.
+    """
+    transaction.on_commit(lambda: _publish(listing_id))
+
+
+def _rebuild(sequence):
+    global _index
+    index = FacetIndex()
+    index.rebuild()
+    index.sequence = sequence
+    _index = index
+
+
+def _rebuild_in_background(sequence):
+    """Build a fresh index in a thread, unless one is already being built. Returns the thread."""
+    global _builder
+    with _builder_lock:
+        if _builder is not None and _builder.is_alive():
+            return _builder
+
+        def run():
+            try:
+                _rebuild(sequence)
+            except Exception:
+                logger.exception("Facet index rebuild failed")
+            finally:
+                connection.close()
+
+        _builder = threading.Thread(target=run, name="facet-rebuild", daemon=True)
+        _builder.start()
+        return _builder
+
+
+def _index_sync(index, current):
+    start = index.sequence
+    if current == start:
+        return index
+    if current < start or current - start > MAX_TAIL:
+        # The cache was reset or too much changed: serve this index until
+        # the new one is ready
+        _rebuild_in_background(current)
+        return index
+
+    keys = [CHANGE_KEY.format(s) for s in range(start + 1, current + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        _rebuild_in_background(current)
+        return index
+
+    # Everything is read from the database before the index is locked
+    listing_ids = {change for change in changes.values() if change != REBUILD}
+    rows, features = _load_listings(listing_ids) if listing_ids else ([], {})
+    renamed = REBUILD in changes.values()
+    with index.lock:
+        known_brands = set(index.brand_names)
+        brand_ids = set(index.brands) if renamed else set()
+    brand_ids.update(row[2] for row in rows if row[2] not in known_brands)
+    brand_names, template_names = _load_names(brand_ids)
+
+    with index.lock:
+        if index.sequence != start:
+            # Another request applied these changes meanwhile
+            return index
+        complete = index.apply_changes(listing_ids, rows, features, brand_names)
+        if renamed:
+            # Names and the category tree are cheap to refresh now; listings
+            # moved by a category delete are picked up by the rebuild
+            index.template_names = template_names
+            index._subtrees = {}
+            index._subtree_features = {}
+        index.sequence = current
+    if renamed or not complete:
+        _rebuild_in_background(current)
+    return index
+
+
+def get_facet_index():
+    """The worker's facet index, brought up to date with the shared change log"""
+    current = cache.get(SEQUENCE_KEY)
+    if current is None:
+        cache.add(SEQUENCE_KEY, 0, timeout=None)
+        current = cache.get(SEQUENCE_KEY, 0)
+    if _index.built_at is None:
+        # The worker's first index: one background thread builds it and the
+        # requests wait for that thread, without holding the index lock
+        _rebuild_in_background(current).join()
+        if _index.built_at is None:
+            raise RuntimeError("The facet index could not be built")
+    return _index_sync(_index, current)
+
+
+def search_listing_ids(search):
+    """
+    Free-text search isn't indexed, it narrows the bitmap with the matching
+    ids. Call it before taking the index lock, it scans the listings table.
+    """
+    return set(
+        ProductListing.objects.filter(
+            Q(name__icontains=search) | Q(product__name__icontains=search)
+        ).values_list("id", flat=True)
+    )
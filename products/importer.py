@@ -0,0 +1,405 @@
+"""
+Streaming catalog import used by /product/upload-products/.
+
+Rows are read lazily (openpyxl read-only mode, or csv), lookups are resolved
+from dicts filled once per file or per chunk, and Product / Variant /
+ProductListing rows are written with bulk_create, one transaction per chunk.
+A chunk that fails is retried row by row so errors point at the bad rows.
+"""
+import csv
+import os
+import threading
+from ast import literal_eval
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from estores.models import EStore
+from taxations.models import TaxCategory
+from users.models import Entity
+from utils.cache import invalidate_tags
+from . import facets
+from .models import Category, Product, ProductImportJob, ProductListing, Variant
+
+
+CHUNK_SIZE = 500
+MAX_STORED_ERRORS = 1000
+# A job saves its progress after every chunk. One that has not been updated
+# for this long lost its thread (the process restarted) and is marked failed.
+LEASE_SECONDS = 10 * 60
+
+
+class RowError(Exception):
+    pass
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value.strip().lower() in ['true', '1', 'yes']
+    if isinstance(value, int):
+        return value == 1
+    return False
+
+
+def _decimal(value, default=0):
+    if value in (None, ""):
+        return Decimal(default)
+    try:
+        return Decimal(str(value).strip())
+    except InvalidOperation:
+        raise RowError(f"Invalid number: {value!r}")
+
+
+def _int(value, default=0):
+    if value in (None, ""):
+        return default
+    try:
+        return int(Decimal(str(value).strip()))
+    except InvalidOperation:
+        raise RowError(f"Invalid integer: {value!r}")
+
+
+def _id(value):
+    return _int(value, None) if value not in (None, "") else None
+
+
+############################ Readers ############################
+
+def iter_rows(path):
+    """Yield (row number, {header: value}) for an .xlsx or .csv file"""
+    if path.lower().endswith(".csv"):
+        rows = _iter_csv(path)
+    else:
+        rows = _iter_xlsx(path)
+
+    headers = None
+    empty_row_count = 0
+    for idx, row in rows:
+        if headers is None:
+            headers = [str(h).strip() if h is not None else None for h in row]
+            continue
+
+        if not any(cell not in (None, "", " ") for cell in row):
+            empty_row_count += 1
+            if empty_row_count >= 2:
+                break  # stop after 2 consecutive empty rows
+            continue
+        empty_row_count = 0
+
+        yield idx, dict(zip(headers, row))
+
+
+def _iter_xlsx(path):
+    wb = load_workbook(filename=path, read_only=True, data_only=True)
+    try:
+        for idx, row in enumerate(wb.active.iter_rows(values_only=True), start=1):
+            yield idx, row
+    finally:
+        wb.close()
+
+
+def _iter_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for idx, row in enumerate(csv.reader(f), start=1):
+            yield idx, row
+
+
+def count_rows(path):
+    """Data rows for Excel files from the sheet dimensions, None for CSV"""
+    if path.lower().endswith(".csv"):
+        return None
+    wb = load_workbook(filename=path, read_only=True)
+    try:
+        max_row = wb.active.max_row
+    finally:
+        wb.close()
+    return max(max_row - 1, 0) if max_row else None
+
+
+############################ Import ############################
+
+class CatalogImporter:
+    """
+    Imports parsed rows in chunks. Small lookup tables (categories, tax
+    categories, estores) are loaded once; entities, products and variants
+    are fetched per chunk with one IN query each and created in bulk.
+    """
+
+    def __init__(self, seller_id=None, estore_id=None):
+        self.default_seller_id = seller_id
+        self.default_estore_id = estore_id
+        self.categories = Category.objects.in_bulk()
+        self.tax_categories = TaxCategory.objects.in_bulk()
+        self.estores = EStore.objects.in_bulk()
+        self.brands = {}      # (name, estore_id) -> Entity
+        self.products = {}    # name -> Product
+        self.variants = {}    # (product_id, name) -> Variant
+        self.created = 0
+        self.created_estore_ids = set()
+        self.errors = []
+
+    def import_chunk(self, chunk):
+        """chunk is a list of (row number, row dict)"""
+        parsed = []
+        for idx, row_data in chunk:
+            try:
+                parsed.append((idx, row_data, self._parse(row_data)))
+            except RowError as e:
+                self._error(idx, e, row_data)
+
+        try:
+            self._write_atomic(parsed)
+        except (DatabaseError, ValueError):
+            # Find the offending rows, the rest of the chunk still goes in
+            for idx, row_data, values in parsed:
+                try:
+                    self._write_atomic([(idx, row_data, values)])
+                except (DatabaseError, ValueError) as e:
+                    self._error(idx, e, row_data)
+
+    def _write_atomic(self, parsed):
+        known = [set(d) for d in (self.brands, self.products, self.variants)]
+        try:
+            with transaction.atomic():
+                self._write(parsed)
+        except Exception:
+            # Objects created in the rolled back transaction must not be reused
+            for cache_dict, keys in zip((self.brands, self.products, self.variants), known):
+                for key in set(cache_dict) - keys:
+                    del cache_dict[key]
+            raise
+
+    def _error(self, idx, error, row_data):
+        self.errors.append({
+            "row": idx,
+            "error": str(error),
+            "data": {k: (v if isinstance(v, (int, float, bool, type(None))) else str(v)) for k, v in row_data.items() if k},
+        })
+
+    def _parse(self, row_data):
+        name = row_data.get('product_name')
+        if not name or not str(name).strip():
+            raise RowError("product_name is required")
+
+        try:
+            attributes = literal_eval(row_data.get('variant_attributes') or "[]")
+        except Exception:
+            attributes = []
+
+        estore_id = _id(row_data.get('estore_id')) or self.default_estore_id
+        return {
+            "product_name": str(name).strip(),
+            "about": row_data.get('product_about') or "",
+            "description": row_data.get('product_description') or "",
+            "base_price": _decimal(row_data.get('base_price')),
+            "is_service": parse_bool(row_data.get('is_service')),
+            "category_id": _id(row_data.get('category_id')),
+            "brand_name": str(row_data.get('brand_name') or "").strip() or None,
+            "unit_size": _decimal(row_data.get('unit_size'), 1),
+            "size_unit": row_data.get('size_unit') or None,
+            "tax_category_id": _id(row_data.get('tax_category_id')),
+            "variant_name": str(row_data.get('variant_name') or "").strip() or None,
+            "attributes": attributes,
+            "price": _decimal(row_data.get('price')),
+            "mrp": _decimal(row_data.get('mrp')),
+            "stock": _int(row_data.get('stock')),
+            "units_per_pack": _int(row_data.get('units_per_pack'), 1) or 1,
+            "seller_id": _id(row_data.get('seller_id')) or self.default_seller_id,
+            "estore_id": estore_id if estore_id in self.estores else None,
+        }
+
+    def _resolve_brands(self, parsed):
+        wanted = {(v["brand_name"], v["estore_id"]) for _, _, v in parsed if v["brand_name"]}
+        missing = wanted - self.brands.keys()
+        if not missing:
+            return
+        for entity in Entity.objects.filter(
+            entity_type='brand', name__in={name for name, _ in missing}
+        ).order_by('id'):
+            self.brands.setdefault((entity.name, entity.estore_id), entity)
+        to_create = [
+            Entity(name=name, entity_type='brand', estore=self.estores.get(estore_id))
+            for name, estore_id in missing if (name, estore_id) not in self.brands
+        ]
+        for entity in Entity.objects.bulk_create(to_create):
+            self.brands[(entity.name, entity.estore_id)] = entity
+
+    def _resolve_products(self, parsed):
+        missing = {v["product_name"] for _, _, v in parsed} - self.products.keys()
+        if not missing:
+            return
+        for product in Product.objects.filter(name__in=missing).order_by('id'):
+            self.products.setdefault(product.name, product)
+
+        to_create = {}
+        for _, _, v in parsed:
+            name = v["product_name"]
+            if name in self.products or name in to_create:
+                continue
+            to_create[name] = Product(
+                name=name,
+                about=v["about"],
+                description=v["description"],
+                base_price=v["base_price"],
+                is_service=v["is_service"],
+                category=self.categories.get(v["category_id"]),
+                brand=self.brands.get((v["brand_name"], v["estore_id"])) if v["brand_name"] else None,
+                unit_size=v["unit_size"],
+                size_unit=v["size_unit"],
+                tax_category=self.tax_categories.get(v["tax_category_id"]),
+            )
+        for product in Product.objects.bulk_create(list(to_create.values())):
+            self.products[product.name] = product
+
+    def _resolve_variants(self, parsed):
+        wanted = {
+            (self.products[v["product_name"]].id, v["variant_name"])
+            for _, _, v in parsed if v["variant_name"]
+        }
+        missing = wanted - self.variants.keys()
+        if not missing:
+            return
+        for variant in Variant.objects.filter(
+            product_id__in={p for p, _ in missing}, name__in={n for _, n in missing}
+        ).order_by('id'):
+            self.variants.setdefault((variant.product_id, variant.name), variant)
+
+        to_create = {}
+        for _, _, v in parsed:
+            if not v["variant_name"]:
+                continue
+            product = self.products[v["product_name"]]
+            key = (product.id, v["variant_name"])
+            if key not in self.variants and key not in to_create:
+                to_create[key] = Variant(product=product, name=v["variant_name"], attributes=v["attributes"])
+        for variant in Variant.objects.bulk_create(list(to_create.values())):
+            self.variants[(variant.product_id, variant.name)] = variant
+
+    def _write(self, parsed):
+        if not parsed:
+            return
+        self._resolve_brands(parsed)
+        self._resolve_products(parsed)
+        self._resolve_variants(parsed)
+
+        sellers = Entity.objects.in_bulk({v["seller_id"] for _, _, v in parsed if v["seller_id"]})
+        listings = []
+        for _, _, v in parsed:
+            product = self.products[v["product_name"]]
+            listing = ProductListing(
+                product=product,
+                variant=self.variants.get((product.id, v["variant_name"])) if v["variant_name"] else None,
+                name="",
+                price=v["price"],
+                mrp=v["mrp"],
+                stock=v["stock"],
+                approved=False,
+                featured=False,
+                units_per_pack=v["units_per_pack"],
+                seller=sellers.get(v["seller_id"]),
+                estore=self.estores.get(v["estore_id"]),
+            )
+            # Same naming and inherited fields as ProductListing.save()
+            listing.inherit_from_product()
+            listings.append(listing)
+
+        ProductListing.objects.bulk_create(listings)
+        self.created += len(listings)
+        self.created_estore_ids.update(listing.estore_id for listing in listings if listing.estore_id)
+
+
+def import_file(path, seller_id=None, estore_id=None, progress=None):
+    """
+    Import a saved upload chunk by chunk and return the CatalogImporter.
+    progress(processed_rows, importer) is called after every chunk.
+    """
+    importer = CatalogImporter(seller_id=seller_id, estore_id=estore_id)
+    chunk = []
+    processed = 0
+    try:
+        for row in iter_rows(path):
+            chunk.append(row)
+            processed += 1
+            if len(chunk) >= CHUNK_SIZE:
+                importer.import_chunk(chunk)
+                chunk = []
+                if progress:
+                    progress(processed, importer)
+        if chunk:
+            importer.import_chunk(chunk)
+            if progress:
+                progress(processed, importer)
+    finally:
+        # bulk_create sends no post_save, refresh caches and the facet index once
+        if importer.created:
+            invalidate_tags("Product", "ProductListing", *[f"estore:{i}" for i in importer.created_estore_ids])
+            facets.record_change()
+    return importer
+
+
+def run_import(job_id, path):
+    """Run import_file for a ProductImportJob, saving its progress per chunk"""
+    close_old_connections()
+    job = ProductImportJob.objects.get(id=job_id)
+
+    def progress(processed, importer):
+        job.processed_rows = processed
+        job.created_count = importer.created
+        job.error_count = len(importer.errors)
+        job.errors = importer.errors[:MAX_STORED_ERRORS]
+        job.save(update_fields=['processed_rows', 'created_count', 'error_count', 'errors', 'updated'])
+
+    try:
+        job.status = 'running'
+        job.save(update_fields=['status', 'updated'])
+        job.total_rows = count_rows(path)
+        job.save(update_fields=['total_rows', 'updated'])
+
+        import_file(path, job.seller_id, job.estore_id, progress=progress)
+        job.status = 'completed'
+    except Exception as e:
+        _fail(job, str(e))
+    finally:
+        job.finished = timezone.now()
+        job.save()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        connection.close()
+
+
+def _fail(job, error):
+    job.status = 'failed'
+    job.errors = job.errors[:MAX_STORED_ERRORS - 1] + [{"row": None, "error": error, "data": None}]
+    job.error_count += 1
+
+
+def expire_if_stale(job):
+    """Mark a pending or running job failed once its lease ran out, returns the job"""
+    if job.status not in ('pending', 'running'):
+        return job
+    now = timezone.now()
+    if job.updated >= now - timedelta(seconds=LEASE_SECONDS):
+        return job
+    last_seen = (job.status, job.updated)
+    _fail(job, "Import stopped without finishing (the server restarted), upload the file again")
+    job.finished = now
+    # Only while nothing saved the job meanwhile, so a slow import isn't failed under its thread
+    ProductImportJob.objects.filter(id=job.id, status=last_seen[0], updated=last_seen[1]).update(
+        status=job.status, errors=job.errors, error_count=job.error_count, finished=now, updated=now
+    )
+    job.refresh_from_db()
+    return job
+
+
+def start_import(job, path):
+    """Run the import in a background thread once the job row is committed"""
+    transaction.on_commit(
+        lambda: threading.Thread(target=run_import, args=(job.id, path), daemon=True).start()
+    )
@@ -80,6 +80,21 @@ class Category(MP_Node):
 
     def __str__(self):
         return self.name
+
+    def move(self, target, pos=None):
+        # treebeard rewrites descendant paths with a bulk UPDATE, no post_save
+        super().move(target, pos)
+        from utils.cache import invalidate_tags
+        from products import facets
+        invalidate_tags("Category", f"Category:{self.id}")
+        facets.record_change()
+
+    class Meta:
+        indexes = [
+            # Subtree filters are path LIKE 'prefix%', which needs a pattern
+            # opclass to use an index on PostgreSQL (ignored elsewhere)
+            models.Index(fields=["path"], name="category_path_prefix_idx", opclasses=["varchar_pattern_ops"]),
+        ]
     
 
 class FeatureGroup(models.Model):
@@ -255,6 +270,14 @@ class ProductListing(models.Model):
         ordering = ['-id']
     
     def save(self, *args, **kwargs):
+        self.inherit_from_product()
+        super().save(*args, **kwargs)
+
+    def inherit_from_product(self):
+        """
+        Copy category/tax/brand/size from the product and build name and slug.
+        Also used by the bulk importer, which skips save().
+        """
         # Default values
         # Inherit values from product
         if self.product:
@@ -293,8 +316,6 @@ class ProductListing(models.Model):
         self.name = new_name.strip(",")
         self.slug = slugify(new_name)
 
-        super().save(*args, **kwargs)
-
     def get_full_main_image_url(self):
         """
         Returns the full URL for the main image stored in Cloudinary.
@@ -354,3 +375,35 @@ class Feature(models.Model):
 
     class Meta:
         ordering = ['-id']  # Default ordering by 'id'
+
+
+
+class ProductImportJob(models.Model):
+    """A catalog file imported in the background by products.importer"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    file_name = models.CharField(max_length=255)
+    seller = models.ForeignKey(Entity, on_delete=models.SET_NULL, null=True, blank=True, related_name="seller_import_jobs")
+    estore = models.ForeignKey(EStore, on_delete=models.SET_NULL, null=True, blank=True, related_name="estore_import_jobs")
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total_rows = models.PositiveIntegerField(null=True, blank=True, help_text="Known up front for Excel files only")
+    processed_rows = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True, help_text="First errors as {row, error, data}")
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.file_name} ({self.status})"
+
+    class Meta:
+        ordering = ['-id']  # Default ordering by 'id'
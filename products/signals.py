@@ -1,47 +1,48 @@
-
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import ProductListing, Product
-from django.core.cache import cache
+from .models import ProductListing, Product, Category, Feature, FeatureTemplate
+from users.models import Entity
+from utils.cache import invalidate_tags
+from . import facets
 
-@receiver(post_save, sender=Product)
+@receiver([post_save, post_delete], sender=Product)
 def clear_product_cache(sender, instance, **kwargs):
-    try:
-        pattern = f"*:/api/product/products/{instance.id}*"
-        # print(pattern);
-        for key in cache.client.get_client().scan_iter(pattern):
-            print("Deleted", key);
-            cache.client.get_client().delete(key)
-
-    except Exception as e:
-        print(f"Error clearing product cache: {e}")
-        print("Non-Redis cache backend detected, clearing all cache.")
-        cache.clear()
-
-    # clear product listing cache
-    if instance.product_listings.exists():  
-        try:
-            pattern = f"*:/api/product/product-listings/?product_id={instance.id}*"
-            # print(pattern);
-            for key in cache.client.get_client().scan_iter(pattern):
-                print("Deleted", key);
-                cache.client.get_client().delete(key)
-        except Exception as e:
-            print(f"Error clearing cache: {e}")
-            print("Non-Redis cache backend detected, clearing all cache.")
-            cache.clear()
-
-
-
-@receiver(post_save, sender=ProductListing)
+    # product detail, product list and product listings filtered by this product
+    invalidate_tags("Product", f"Product:{instance.id}")
+
+
+
+def product_listing_tags(listing):
+    """The listing's own pages and the listing lists that can show it"""
+    tags = [f"ProductListing:{listing.id}", f"ProductListing:slug:{listing.slug}", "ProductListing"]
+    if listing.estore_id:
+        tags.append(f"estore:{listing.estore_id}")
+    if listing.product_id:
+        tags.append(f"Product:{listing.product_id}")
+    if listing.category_id:
+        tags.append(f"Category:{listing.category_id}")
+    return tags
+
+
+@receiver([post_save, post_delete], sender=ProductListing)
 def clear_product_listing_cache(sender, instance, **kwargs):
-    try:
-        pattern = f"*:/api/product/product-listings/slug/{instance.slug}*"
-        # print(pattern);
-        for key in cache.client.get_client().scan_iter(pattern):
-            print("Deleted", key);
-            cache.client.get_client().delete(key)
-    except Exception as e:
-        print(f"Error clearing order cache: {e}")
-        print("Non-Redis cache backend detected, clearing all cache.")
-        cache.clear()
\ No newline at end of file
+    invalidate_tags(*product_listing_tags(instance))
+    facets.record_change(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def clear_category_cache(sender, instance, **kwargs):
+    invalidate_tags("Category", f"Category:{instance.id}")
+    facets.record_change()
+
+
+@receiver([post_save, post_delete], sender=Feature)
+def update_feature_facets(sender, instance, **kwargs):
+    facets.record_change(instance.product_listing_id)
+
+
+@receiver([post_save, post_delete], sender=FeatureTemplate)
+@receiver([post_save], sender=Entity)
+def rebuild_facet_names(sender, instance, **kwargs):
+    # Brand and feature names are denormalized into the facet index
+    facets.record_change()
@@ -1,3 +1,8 @@
 from django.contrib import admin
+from .models import SearchOutbox
 
-# Register your models here.
+
+@admin.register(SearchOutbox)
+class SearchOutboxAdmin(admin.ModelAdmin):
+    list_display = ("index", "object_id", "id", "created")
+    list_filter = ("index",)
@@ -4,13 +4,14 @@ router = Router()
 from typing import List, Optional
 
 
-from .client import client
+from .backends import get_search_backend
+from .suggest import suggest
 
 router = Router()
 
 
 @router.get("/products")
-def search_products(
+async def search_products(
     request,
     q: str,
     estore_id: int,
@@ -20,95 +21,65 @@ def search_products(
     max_price: Optional[int] = None,
     limit: int = 10,
     ):
-    filter_parts = [f"estore_id = {estore_id}"]
+    filters = {"estore_id": estore_id}
 
     # print(brand_ids)
 
     if brand_ids:
-        brand_id_list = [id.strip() for id in brand_ids.split(",") if id.strip().isdigit()]
+        brand_id_list = [int(id.strip()) for id in brand_ids.split(",") if id.strip().isdigit()]
         if brand_id_list:
-            filter_parts.append(f"brand_id IN [{', '.join(brand_id_list)}]")
+            filters["brand_id"] = brand_id_list
 
     if category_id:
-        filter_parts.append(f"category_id = {category_id}")
+        filters["category_id"] = category_id
 
-    if min_price is not None and max_price is not None:
-        filter_parts.append(f"price >= {min_price} AND price <= {max_price}")
+    if min_price is not None or max_price is not None:
+        filters["price"] = (min_price, max_price)
 
-    filter_query = " AND ".join(filter_parts)
-
-    result = client.index("product_listings").search(
-        q,
-        {
-            "filter": filter_query,
-            "limit": limit,
-            "facets": ["brand", "category"]
-        }
+    return await get_search_backend().asearch(
+        "product_listings", q, filters=filters, limit=limit, facets=["brand", "category"]
     )
-    return result
 
 ## autocomplete 
+@router.get("/suggest")
+def search_suggest(request, q: str, estore_id: int, limit: int = 5):
+    """
+    Product, brand and category suggestions in one call, searched concurrently
+    and served from a prefix cache where possible. `timings` reports ms and
+    cache status ("hit", "prefix", "miss") per source.
+    """
+    return suggest(q, estore_id, limit)
+
+
 @router.get("/autocomplete/products")
-def autocomplete_products(request, q: str, estore_id: int, limit: int = 5):
-    result = client.index("product_listings").search(
-        q,
-        {
-            "filter": f"estore_id = {estore_id}",
-            "limit": limit,
-            "attributesToHighlight": ["name"]
-        }
-    )
+async def autocomplete_products(request, q: str, estore_id: int, limit: int = 5):
+    result = await get_search_backend().asearch("product_listings", q, filters={"estore_id": estore_id}, limit=limit)
     return [hit["name"] for hit in result["hits"]]
 
 
 @router.get("/categories")
-def search_categories(request, q: str, estore_id: int):
-    result = client.index("categories").search(q, 
-        {
-            "filter": f"estore_id = {estore_id}",
-            "limit": 10
-        }                                           
-    )
+async def search_categories(request, q: str, estore_id: int):
+    result = await get_search_backend().asearch("categories", q, filters={"estore_id": estore_id}, limit=10)
     return result["hits"]
 
 ### autocomplete 
 
 @router.get("/autocomplete/brands")
-def autocomplete_brands(request, q: str, estore_id: int, limit: int = 5):
-    result = client.index("brands").search(
-        q,
-        {
-            "filter": f"estore_id = {estore_id}",
-            "limit": limit,
-            "attributesToHighlight": ["name"]
-        }
-    )
+async def autocomplete_brands(request, q: str, estore_id: int, limit: int = 5):
+    result = await get_search_backend().asearch("brands", q, filters={"estore_id": estore_id}, limit=limit)
     return [hit["name"] for hit in result["hits"]]
 
 
 
 @router.get("/brands")
-def search_brands(request, q: str, estore_id: int):
-    result = client.index("brands").search(q,
-        {
-            "filter": f"estore_id = {estore_id}",
-            "limit": 10
-        }
-    )
+async def search_brands(request, q: str, estore_id: int):
+    result = await get_search_backend().asearch("brands", q, filters={"estore_id": estore_id}, limit=10)
     return result["hits"]
 
 ## autocomplete 
 
 @router.get("/autocomplete/categories")
-def autocomplete_categories(request, q: str, estore_id: int, limit: int = 5):
-    result = client.index("categories").search(
-        q,
-        {
-            "filter": f"estore_id = {estore_id}",
-            "limit": limit,
-            "attributesToHighlight": ["name"]
-        }
-    )
+async def autocomplete_categories(request, q: str, estore_id: int, limit: int = 5):
+    result = await get_search_backend().asearch("categories", q, filters={"estore_id": estore_id}, limit=limit)
     return [hit["name"] for hit in result["hits"]]
 
-
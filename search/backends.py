@@ -0,0 +1,161 @@
+"""
+Search backends behind search/api.py.
+
+All backends take the same arguments and return a Meilisearch-shaped result
+({"hits": [...], "estimatedTotalHits": ..., "facetDistribution": ...}).
+Filters are a dict: {"estore_id": 1, "brand_id": [2, 3], "category_id": 4,
+"price": (min, max)}; None values are ignored.
+
+SEARCH_BACKEND selects "meilisearch" or "local". With SEARCH_FALLBACK on,
+Meilisearch errors and timeouts are answered by the local engine, and after a
+connection failure or timeout Meilisearch is skipped for
+SEARCH_FALLBACK_RETRY seconds. Whenever the local engine may answer, its
+indexes are built in the background as soon as the backend is created, not
+when Meilisearch first fails.
+
+asearch() is the same call for async views: Meilisearch is queried over the
+shared httpx client (utils/async_http.py), the local engine runs in a thread.
+"""
+import logging
+import threading
+import time
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from meilisearch.errors import MeilisearchCommunicationError, MeilisearchError, MeilisearchTimeoutError
+
+from utils.async_http import async_http_client
+
+from .local_index import get_local_index, warm_local_indexes
+
+
+logger = logging.getLogger("search")
+
+
+class SearchBackend:
+    name = None
+
+    def search(self, index, q, filters=None, limit=10, facets=None):
+        raise NotImplementedError
+
+    async def asearch(self, index, q, filters=None, limit=10, facets=None):
+        return await sync_to_async(self.search)(index, q, filters=filters, limit=limit, facets=facets)
+
+
+def meilisearch_filter(filters):
+    parts = []
+    for attribute, value in (filters or {}).items():
+        if value is None:
+            continue
+        if attribute == "price":
+            low, high = value
+            if low is not None:
+                parts.append(f"price >= {low}")
+            if high is not None:
+                parts.append(f"price <= {high}")
+        elif isinstance(value, (list, tuple, set)):
+            parts.append(f"{attribute} IN [{', '.join(str(v) for v in value)}]")
+        else:
+            parts.append(f"{attribute} = {value}")
+    return " AND ".join(parts)
+
+
+def meilisearch_params(filters, limit, facets):
+    params = {"limit": limit}
+    filter_query = meilisearch_filter(filters)
+    if filter_query:
+        params["filter"] = filter_query
+    if facets:
+        params["facets"] = facets
+    return params
+
+
+class MeilisearchBackend(SearchBackend):
+    name = "meilisearch"
+
+    def search(self, index, q, filters=None, limit=10, facets=None):
+        from .client import client
+
+        return client.index(index).search(q, meilisearch_params(filters, limit, facets))
+
+    async def asearch(self, index, q, filters=None, limit=10, facets=None):
+        from .client import MEILISEARCH_KEY, MEILISEARCH_TIMEOUT, MEILISEARCH_URL
+
+        headers = {"Authorization": f"Bearer {MEILISEARCH_KEY}"} if MEILISEARCH_KEY else {}
+        async with async_http_client() as client:
+            response = await client.post(
+                f"{MEILISEARCH_URL.rstrip('/')}/indexes/{index}/search",
+                json={"q": q, **meilisearch_params(filters, limit, facets)},
+                headers=headers,
+                timeout=MEILISEARCH_TIMEOUT,
+            )
+        response.raise_for_status()
+        return response.json()
+
+
+class LocalSearchBackend(SearchBackend):
+    name = "local"
+
+    def search(self, index, q, filters=None, limit=10, facets=None):
+        return get_local_index(index).search(q, filters=filters, limit=limit, facets=facets)
+
+
+class FallbackSearchBackend(SearchBackend):
+
+    def __init__(self, primary, fallback, retry_after=30):
+        self.primary = primary
+        self.fallback = fallback
+        self.retry_after = retry_after
+        self.down_until = 0
+        self.lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.primary.name
+
+    def search(self, index, q, filters=None, limit=10, facets=None):
+        if time.monotonic() >= self.down_until:
+            try:
+                return self.primary.search(index, q, filters=filters, limit=limit, facets=facets)
+            except (MeilisearchCommunicationError, MeilisearchTimeoutError) as e:
+                logger.warning("Search backend %s unavailable, using %s: %s", self.primary.name, self.fallback.name, e)
+                with self.lock:
+                    self.down_until = time.monotonic() + self.retry_after
+            except MeilisearchError as e:
+                logger.warning("Search backend %s failed, using %s: %s", self.primary.name, self.fallback.name, e)
+        return self.fallback.search(index, q, filters=filters, limit=limit, facets=facets)
+
+    async def asearch(self, index, q, filters=None, limit=10, facets=None):
+        if time.monotonic() >= self.down_until:
+            try:
+                return await self.primary.asearch(index, q, filters=filters, limit=limit, facets=facets)
+            except (httpx.TransportError, MeilisearchCommunicationError, MeilisearchTimeoutError) as e:
+                logger.warning("Search backend %s unavailable, using %s: %s", self.primary.name, self.fallback.name, e)
+                with self.lock:
+                    self.down_until = time.monotonic() + self.retry_after
+            except (httpx.HTTPStatusError, MeilisearchError) as e:
+                logger.warning("Search backend %s failed, using %s: %s", self.primary.name, self.fallback.name, e)
+        return await self.fallback.asearch(index, q, filters=filters, limit=limit, facets=facets)
+
+
+BACKENDS = {
+    "meilisearch": MeilisearchBackend,
+    "local": LocalSearchBackend,
+}
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        backend = BACKENDS[getattr(settings, "SEARCH_BACKEND", "meilisearch")]()
+        if getattr(settings, "SEARCH_FALLBACK", True) and backend.name != "local":
+            backend = FallbackSearchBackend(
+                backend, LocalSearchBackend(), retry_after=getattr(settings, "SEARCH_FALLBACK_RETRY", 30)
+            )
+        if backend.name == "local" or isinstance(backend, FallbackSearchBackend):
+            warm_local_indexes()
+        _backend = backend
+    return _backend
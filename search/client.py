@@ -2,4 +2,8 @@ import meilisearch
 from decouple import config
 
 
-client = meilisearch.Client(config("MEILISEARCH_URL"), config("MEILISEARCH_KEY"))
\ No newline at end of file
+MEILISEARCH_URL = config("MEILISEARCH_URL", default="http://localhost:7700")
+MEILISEARCH_KEY = config("MEILISEARCH_KEY", default="")
+MEILISEARCH_TIMEOUT = config("MEILISEARCH_TIMEOUT", default=2, cast=float)
+
+client = meilisearch.Client(MEILISEARCH_URL, MEILISEARCH_KEY, timeout=MEILISEARCH_TIMEOUT)
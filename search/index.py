@@ -1,24 +1,45 @@
 # search/index.py
-from products.models import ProductListing  
+import logging
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction, connection
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from products.models import ProductListing
 from products.models import Category
 from users.models import Entity
 from .client import client
+from .models import SearchOutbox
 from meilisearch.errors import MeilisearchApiError
 
 
+logger = logging.getLogger("search")
+
+BATCH_SIZE = 1000
+TASK_TIMEOUT_MS = 5 * 60 * 1000
+# Claimed outbox rows are taken again after this long, e.g. when the worker died
+LEASE_SECONDS = 2 * TASK_TIMEOUT_MS // 1000
+# Set while an index is rebuilt: the highest outbox id the rebuild started after
+REINDEX_KEY = "search:reindex:{}"
+REINDEX_TIMEOUT = 24 * 60 * 60
+
+
 def serialize_product_listing(listing):
     return {
         "id": listing.id,
         "name": listing.name,
         "slug": listing.slug,
         "brand": listing.brand.name if listing.brand else "",
-        "brand_id": listing.brand.id if listing.brand else "",
+        "brand_id": listing.brand_id if listing.brand_id else "",
         "category": listing.category.name if listing.category else "",
-        "category_id": listing.category.id if listing.category else "",
+        "category_id": listing.category_id if listing.category_id else "",
         "description": listing.product.description if listing.product else "",
         "price": float(listing.price),
-        "mrp": float(listing.mrp),
-        "estore_id": listing.estore.id if listing.estore else None,
+        "mrp": float(listing.mrp or 0),
+        "estore_id": listing.estore_id,
         "featured": listing.featured,
         "rating": float(listing.rating or 0),
         "main_image": listing.main_image.url if listing.main_image else None,
@@ -31,7 +52,7 @@ def serialize_category(cat):
         "name": cat.name,
         "slug": cat.slug,
         "description": cat.description or "",
-        "estore_id": cat.estore.id if cat.estore else None,
+        "estore_id": cat.estore_id,
         "image": cat.image.url if cat.image else None
     }
 
@@ -41,85 +62,230 @@ def serialize_brand(entity):
         "name": entity.name,
         "slug": entity.name.lower().replace(" ", "-"),
         "details": entity.details or "",
-        "estore_id": entity.estore.id if (entity.estore) else None,
+        "estore_id": entity.estore_id,
         "logo": entity.logo.url if entity.logo else None,
 
     }
 
 
-def index_product_listings():
-    
-    listings = ProductListing.objects.filter(approved=True)
-    # print(listings);
-    data = [serialize_product_listing(p) for p in listings]
+# uid -> what goes in it. `queryset` is the set of indexed objects, loaded
+# with everything `serialize` touches.
+INDEXES = {
+    "product_listings": {
+        "queryset": lambda: ProductListing.objects.filter(approved=True).select_related("brand", "category", "product"),
+        "serialize": serialize_product_listing,
+        "settings": {
+            "searchableAttributes": ["name", "brand", "category"],
+            "displayedAttributes": ["id", "name", "slug", "brand", "category", "price", "main_image", "mrp", "stock"],
+            "rankingRules": [
+                "words", "typo", "proximity", "attribute", "exactness"
+            ],
+            "filterableAttributes": ["estore_id", "brand_id", "brand" , "category" ,"category_id", "price", "featured"],
+            "sortableAttributes": ["price", "rating"],
+        },
+    },
+    "categories": {
+        "queryset": lambda: Category.objects.filter(approved=True),
+        "serialize": serialize_category,
+        "settings": {
+            "searchableAttributes": ["name"],
+            "displayedAttributes": ["id", "name", "slug", "estore_id", "image"],
+            "filterableAttributes": ["estore_id"],
+        },
+    },
+    "brands": {
+        "queryset": lambda: Entity.objects.filter(entity_type="brand"),
+        "serialize": serialize_brand,
+        "settings": {
+            "searchableAttributes": ["name"],
+            "displayedAttributes": ["id", "name", "slug", "estore_id", "logo"],
+            "filterableAttributes": ["estore_id"],
+        },
+    },
+}
 
-     # ✅ Create index with primary key
-    try:
-        client.create_index("product_listings", {"primaryKey": "id"})
-    except MeilisearchApiError:
-        # Index already exists
-        pass
 
-    index = client.index("product_listings")
-    
-    index.update_settings({
-        "searchableAttributes": ["name", "brand", "category"],
-        "displayedAttributes": ["id", "name", "slug", "brand", "category", "price", "main_image", "mrp", "stock"],
-        "rankingRules": [
-            "words", "typo", "proximity", "attribute", "exactness"
-        ]
-    })
+class SearchTaskFailed(Exception):
+    pass
 
-    index.update_filterable_attributes(["estore_id", "brand_id", "brand" , "category" ,"category_id", "price", "featured"])
-    index.update_sortable_attributes(["price", "rating"])
 
-    task = index.add_documents(data)
+def wait_for_tasks(tasks):
+    """Block until the Meilisearch tasks finish, raise if any of them failed"""
+    for task in tasks:
+        result = client.wait_for_task(task.task_uid, timeout_in_ms=TASK_TIMEOUT_MS)
+        if result.status != "succeeded":
+            raise SearchTaskFailed(f"Task {task.task_uid} {result.status}: {result.error}")
 
 
+def ensure_index(uid):
+    try:
+        client.get_index(uid)
+    except MeilisearchApiError:
+        wait_for_tasks([client.create_index(uid, {"primaryKey": "id"})])
 
-def index_categories():
-    categories = Category.objects.filter(approved=True)
-    data = [serialize_category(c) for c in categories]
 
-    
+def drop_index(uid):
     try:
-        client.create_index("categories", {"primaryKey": "id"})
+        client.get_index(uid)
     except MeilisearchApiError:
-        # Index already exists
-        pass
+        return
+    wait_for_tasks([client.delete_index(uid)])
+
+
+############################ Full reindex ############################
+
+def reindex(name):
+    """
+    Rebuild an index without downtime: documents are pushed in batches to a
+    shadow index with the same settings, which is then swapped with the live
+    one in a single step.
+
+    The shadow may read an object before a change to it, so outbox rows
+    written during the rebuild are kept by sync_outbox after it applies them
+    to the live index, and are replayed on the new index after the swap.
+    """
+    key = REINDEX_KEY.format(name)
+    marker = SearchOutbox.objects.aggregate(last=Max("id"))["last"] or 0
+    cache.set(key, marker, timeout=REINDEX_TIMEOUT)
+    try:
+        _build_and_swap(name)
+        # Read while the key is still set, so no sync deletes them first
+        rows = list(SearchOutbox.objects.filter(index=name, id__gt=marker).values_list("id", "index", "object_id"))
+    finally:
+        cache.delete(key)
+    if rows:
+        _send(rows)
+        SearchOutbox.objects.filter(id__in=[row[0] for row in rows]).delete()
+
+
+def _build_and_swap(name):
+    config = INDEXES[name]
+    shadow = f"{name}_shadow"
 
-    index = client.index("categories")
-    
+    drop_index(shadow)
+    ensure_index(name)
+    ensure_index(shadow)
 
-    index.update_settings({
-        "searchableAttributes": ["name"],
-        "displayedAttributes": ["id", "name", "slug", "estore_id", "image"],
-    })
+    index = client.index(shadow)
+    tasks = [index.update_settings(config["settings"])]
 
-    index.update_filterable_attributes(["estore_id"])
+    batch = []
+    for obj in config["queryset"]().order_by("id").iterator(chunk_size=BATCH_SIZE):
+        batch.append(config["serialize"](obj))
+        if len(batch) >= BATCH_SIZE:
+            tasks.append(index.add_documents(batch, primary_key="id"))
+            batch = []
+    if batch:
+        tasks.append(index.add_documents(batch, primary_key="id"))
+    wait_for_tasks(tasks)
 
-    index.add_documents(data)
+    wait_for_tasks([client.swap_indexes([{"indexes": [name, shadow]}])])
+    # The shadow now holds the old documents
+    drop_index(shadow)
+
+
+def index_product_listings():
+    reindex("product_listings")
+
+
+def index_categories():
+    reindex("categories")
 
 
 def index_brands():
-    brands = Entity.objects.filter(entity_type="brand")
-    data = [serialize_brand(b) for b in brands]
+    reindex("brands")
+
+
+############################ Incremental sync ############################
+
+def _claim_batch(batch_size):
+    """Lease a batch of outbox rows in a short transaction, returns (claimed, rows)"""
+    now = timezone.now()
+    with transaction.atomic():
+        qs = SearchOutbox.objects.filter(
+            Q(claimed__isnull=True) | Q(claimed__lt=now - timedelta(seconds=LEASE_SECONDS))
+        ).order_by("id")
+        if connection.features.has_select_for_update_skip_locked:
+            # Several workers can drain the outbox side by side
+            qs = qs.select_for_update(skip_locked=True)
+        rows = list(qs.values_list("id", "index", "object_id")[:batch_size])
+        SearchOutbox.objects.filter(id__in=[row[0] for row in rows]).update(claimed=now)
+    return now, rows
+
+
+def _send(rows):
+    dirty = {}
+    for _, name, object_id in rows:
+        dirty.setdefault(name, set()).add(object_id)
+
+    tasks = []
+    for name, object_ids in dirty.items():
+        config = INDEXES.get(name)
+        if config is None:
+            continue
+        objects = config["queryset"]().in_bulk(object_ids)
+        index = client.index(name)
+        if objects:
+            tasks.append(index.update_documents(
+                [config["serialize"](obj) for obj in objects.values()], primary_key="id"
+            ))
+        removed = [object_id for object_id in object_ids if object_id not in objects]
+        if removed:
+            tasks.append(index.delete_documents(removed))
+    wait_for_tasks(tasks)
+
+
+def sync_outbox(batch_size=BATCH_SIZE):
+    """
+    Apply one batch of outbox rows: changed objects are re-serialized and sent
+    with update_documents, objects that are gone or no longer indexed are
+    removed with delete_documents. Rows are claimed with a lease and committed
+    before Meilisearch is called, so no transaction or row lock is held while
+    waiting on it; they are deleted only once Meilisearch reports the tasks
+    as succeeded. Returns the number of rows processed.
+    """
+    claimed, rows = _claim_batch(batch_size)
+    if not rows:
+        return 0
+    ids = [row[0] for row in rows]
 
     try:
-        client.create_index("brands", {"primaryKey": "id"})
-    except MeilisearchApiError:
-        # Index already exists
-        pass
+        _send(rows)
+    except Exception:
+        # Let the next sync retry them without waiting for the lease
+        SearchOutbox.objects.filter(id__in=ids, claimed=claimed).update(claimed=None)
+        raise
+
+    # Rows a running reindex() will replay stay claimed until it does
+    kept = _replayed(rows)
+    SearchOutbox.objects.filter(id__in=[i for i in ids if i not in kept], claimed=claimed).delete()
+    return len(rows)
 
-    index = client.index("brands")
 
+def _replayed(rows):
+    markers = cache.get_many({REINDEX_KEY.format(name) for _, name, _ in rows})
+    return {
+        row_id for row_id, name, _ in rows
+        if row_id > markers.get(REINDEX_KEY.format(name), row_id)
+    }
 
-    index.update_settings({
-        "searchableAttributes": ["name"],
-        "displayedAttributes": ["id", "name", "slug", "estore_id", "logo"],
-    })
 
-    index.update_filterable_attributes(["estore_id"])
+def sync_search(batch_size=BATCH_SIZE):
+    """Drain the whole outbox, returns the number of rows processed"""
+    total = 0
+    while True:
+        processed = sync_outbox(batch_size)
+        if not processed:
+            return total
+        total += processed
 
 
-    index.add_documents(data)
+def run_sync_worker(interval=2, batch_size=BATCH_SIZE):
+    while True:
+        try:
+            processed = sync_search(batch_size)
+            if processed:
+                logger.info("Search sync: %s changes applied", processed)
+        except Exception:
+            logger.exception("Search sync failed")
+        time.sleep(interval)
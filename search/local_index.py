@@ -0,0 +1,304 @@
+"""
+In-process search engine over the same documents search.index sends to
+Meilisearch, used by LocalSearchBackend (search/backends.py).
+
+Every searchable word maps to {document id: weighted BM25 term score} and
+the vocabulary is kept sorted, so the last query word is matched as a prefix
+with a bisect, like Meilisearch does while the user types. Words of 5+ letters
+also match vocabulary words one edit away (two edits from 9 letters).
+Documents must contain every query word; when nothing does, trailing words are
+dropped one at a time (Meilisearch's "words" ranking rule).
+"""
+import bisect
+import logging
+import math
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+
+K1 = 1.2
+B = 0.75
+MAX_PREFIX_TERMS = 50
+PREFIX_FACTOR = 0.8
+TYPO_FACTORS = {1: 0.5, 2: 0.3}
+# Earlier searchable attributes weigh more, as with Meilisearch's "attribute" rule
+ATTRIBUTE_WEIGHTS = [3.0, 2.0, 1.0, 0.5]
+
+VERSION_KEY = "search:local:version:{}"
+
+logger = logging.getLogger("search")
+
+_word_re = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _word_re.findall(str(text).lower()) if text not in (None, "") else []
+
+
+def max_typos(word):
+    if len(word) >= 9:
+        return 2
+    if len(word) >= 5:
+        return 1
+    return 0
+
+
+def edit_distance(a, b, limit):
+    """
+    Edit distance with adjacent swaps counted as one edit, or limit + 1 as
+    soon as it must exceed limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                value = min(value, before[j - 2] + 1)
+            current.append(value)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class LocalIndex:
+
+    def __init__(self, documents, searchable, displayed=None, filterable=()):
+        self.documents = {doc["id"]: doc for doc in documents}
+        self.displayed = displayed
+        self.order = sorted(self.documents)
+
+        # term -> {doc id: sum over attributes of weight * BM25 tf part}
+        self.postings = {}
+        lengths = {attribute: {} for attribute in searchable}
+        for doc_id, doc in self.documents.items():
+            for attribute in searchable:
+                lengths[attribute][doc_id] = len(tokenize(doc.get(attribute)))
+        averages = {
+            attribute: (sum(values.values()) / len(values) if values else 0) or 1
+            for attribute, values in lengths.items()
+        }
+        for doc_id, doc in self.documents.items():
+            for rank, attribute in enumerate(searchable):
+                weight = ATTRIBUTE_WEIGHTS[min(rank, len(ATTRIBUTE_WEIGHTS) - 1)]
+                counts = {}
+                for term in tokenize(doc.get(attribute)):
+                    counts[term] = counts.get(term, 0) + 1
+                norm = K1 * (1 - B + B * lengths[attribute][doc_id] / averages[attribute])
+                for term, tf in counts.items():
+                    postings = self.postings.setdefault(term, {})
+                    postings[doc_id] = postings.get(doc_id, 0) + weight * tf * (K1 + 1) / (tf + norm)
+
+        self.terms = sorted(self.postings)
+        self.by_first_letter = {}
+        for term in self.terms:
+            self.by_first_letter.setdefault(term[0], []).append(term)
+        total = len(self.documents)
+        self.idf = {
+            term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+        # attribute -> value -> set of doc ids, for equality / IN filters
+        self.values = {attribute: {} for attribute in filterable}
+        for doc_id, doc in self.documents.items():
+            for attribute in filterable:
+                self.values[attribute].setdefault(doc.get(attribute), set()).add(doc_id)
+
+    ############################ Matching ############################
+
+    def candidates(self, word, prefix=False):
+        """[(term, factor)] the query word matches"""
+        matches = {}
+        if word in self.postings:
+            matches[word] = 1.0
+        if prefix:
+            start = bisect.bisect_left(self.terms, word)
+            for term in self.terms[start:start + MAX_PREFIX_TERMS]:
+                if not term.startswith(word):
+                    break
+                matches.setdefault(term, PREFIX_FACTOR)
+        limit = max_typos(word)
+        if limit:
+            for term in self.by_first_letter.get(word[0], ()):
+                if term in matches:
+                    continue
+                distance = edit_distance(word, term[:len(word)] if prefix else term, limit)
+                if distance <= limit:
+                    matches[term] = TYPO_FACTORS[distance]
+        return list(matches.items())
+
+    def _score_words(self, words):
+        scores = None
+        for i, word in enumerate(words):
+            word_scores = {}
+            for term, factor in self.candidates(word, prefix=i == len(words) - 1):
+                idf = self.idf[term]
+                for doc_id, value in self.postings[term].items():
+                    score = factor * idf * value
+                    if score > word_scores.get(doc_id, 0):
+                        word_scores[doc_id] = score
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {doc_id: s + word_scores[doc_id] for doc_id, s in scores.items() if doc_id in word_scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+    def _allowed(self, filters):
+        """Doc ids passing the filters, or None for no restriction"""
+        allowed = None
+        for attribute, value in (filters or {}).items():
+            if value is None or attribute == "price":
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            ids = set()
+            for v in values:
+                ids |= self.values.get(attribute, {}).get(v, set())
+            allowed = ids if allowed is None else allowed & ids
+        return allowed
+
+    def _in_price(self, doc_id, price_range):
+        low, high = price_range
+        price = self.documents[doc_id].get("price")
+        return (low is None or price >= low) and (high is None or price <= high)
+
+    ############################ Search ############################
+
+    def search(self, q, filters=None, limit=10, facets=None):
+        """Same response shape as a Meilisearch search"""
+        started = time.perf_counter()
+        words = tokenize(q)
+        allowed = self._allowed(filters)
+        price_range = (filters or {}).get("price")
+
+        if words:
+            scores = {}
+            while words and not scores:
+                scores = self._score_words(words)
+                if allowed is not None:
+                    scores = {doc_id: s for doc_id, s in scores.items() if doc_id in allowed}
+                if price_range:
+                    scores = {doc_id: s for doc_id, s in scores.items() if self._in_price(doc_id, price_range)}
+                words = words[:-1]
+            matched = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+        else:
+            matched = [doc_id for doc_id in self.order if allowed is None or doc_id in allowed]
+            if price_range:
+                matched = [doc_id for doc_id in matched if self._in_price(doc_id, price_range)]
+
+        result = {
+            "hits": [self._display(self.documents[doc_id]) for doc_id in matched[:limit]],
+            "query": q,
+            "processingTimeMs": int((time.perf_counter() - started) * 1000),
+            "limit": limit,
+            "offset": 0,
+            "estimatedTotalHits": len(matched),
+        }
+        if facets:
+            distribution = {}
+            for attribute in facets:
+                counts = distribution.setdefault(attribute, {})
+                for doc_id in matched:
+                    value = self.documents[doc_id].get(attribute)
+                    if value not in (None, ""):
+                        counts[str(value)] = counts.get(str(value), 0) + 1
+            result["facetDistribution"] = distribution
+        return result
+
+    def _display(self, doc):
+        if not self.displayed:
+            return dict(doc)
+        return {attribute: doc.get(attribute) for attribute in self.displayed if attribute in doc}
+
+
+############################ Per-process indexes ############################
+
+_indexes = {}    # name -> (version, built at, LocalIndex)
+_builders = {}   # name -> thread building the next LocalIndex
+_builders_lock = threading.Lock()
+
+
+def mark_stale(name):
+    """Called when documents of an index change (see search.signals)"""
+    try:
+        cache.incr(VERSION_KEY.format(name))
+    except ValueError:
+        cache.add(VERSION_KEY.format(name), 1, timeout=None)
+
+
+def _build(name):
+    from .index import INDEXES
+
+    config = INDEXES[name]
+    index_settings = config["settings"]
+    documents = [config["serialize"](obj) for obj in config["queryset"]().iterator(chunk_size=2000)]
+    return LocalIndex(
+        documents,
+        searchable=index_settings["searchableAttributes"],
+        displayed=index_settings.get("displayedAttributes"),
+        filterable=[a for a in index_settings.get("filterableAttributes", []) if a != "price"],
+    )
+
+
+def _build_in_background(name, version):
+    """Build `name` in a thread, unless one is already being built. Returns the thread."""
+    with _builders_lock:
+        thread = _builders.get(name)
+        if thread is not None and thread.is_alive():
+            return thread
+
+        def run():
+            try:
+                _indexes[name] = (version, time.time(), _build(name))
+            except Exception:
+                logger.exception("Local search index %s build failed", name)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run, name=f"local-search-{name}", daemon=True)
+        _builders[name] = thread
+        thread.start()
+        return thread
+
+
+def warm_local_indexes():
+    """Start building every index the worker doesn't have yet, so the first local search doesn't wait"""
+    from .index import INDEXES
+
+    for name in INDEXES:
+        if name not in _indexes:
+            _build_in_background(name, cache.get(VERSION_KEY.format(name), 0))
+
+
+def get_local_index(name):
+    """
+    The worker's LocalIndex for `name`. After changes a fresh index is built
+    in a background thread, at most once per LOCAL_SEARCH_REBUILD_INTERVAL
+    seconds, and requests keep answering from the previous one meanwhile.
+    Only a worker's very first search of an index that wasn't warmed waits
+    for the build.
+    """
+    version = cache.get(VERSION_KEY.format(name), 0)
+    current = _indexes.get(name)
+    if current is None:
+        _build_in_background(name, version).join()
+        current = _indexes.get(name)
+        if current is None:
+            raise RuntimeError(f"The local search index {name} could not be built")
+        return current[2]
+
+    interval = getattr(settings, "LOCAL_SEARCH_REBUILD_INTERVAL", 30)
+    if current[0] != version and time.time() - current[1] >= interval:
+        _build_in_background(name, version)
+    return current[2]
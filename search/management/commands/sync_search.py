@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from search.index import BATCH_SIZE, run_sync_worker, sync_search
+
+class Command(BaseCommand):
+    help = "Apply pending search outbox changes to Meilisearch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep running and poll the outbox")
+        parser.add_argument("--interval", type=float, default=2, help="Seconds between polls with --loop")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options["loop"]:
+            run_sync_worker(interval=options["interval"], batch_size=options["batch_size"])
+            return
+        processed = sync_search(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"{processed} search changes applied."))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_searchoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchoutbox',
+            name='claimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,3 +1,26 @@
 from django.db import models
 
-# Create your models here.
+
+class SearchOutbox(models.Model):
+    """
+    Objects whose search documents are out of date. Rows are written by the
+    signals in search.signals in the same transaction as the change and
+    drained in batches by search.index.sync_outbox (manage.py sync_search).
+    """
+    INDEX_CHOICES = [
+        ('product_listings', 'Product listings'),
+        ('categories', 'Categories'),
+        ('brands', 'Brands'),
+    ]
+
+    index = models.CharField(max_length=50, choices=INDEX_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    # Set while a sync worker is sending the row; expired claims are taken again
+    claimed = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.index}:{self.object_id}"
+
+    class Meta:
+        ordering = ['id']
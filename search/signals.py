@@ -1,11 +1,49 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from products.models import ProductListing
+from products.models import ProductListing, Product, Category
+from users.models import Entity
+from .models import SearchOutbox
+from .local_index import mark_stale
 
-# @receiver(post_save, sender=ProductListing)
-# def update_document(sender, instance, **kwargs):
-#     ProductListingDocument().update(instance)
 
-# @receiver(post_delete, sender=ProductListing)
-# def delete_document(sender, instance, **kwargs):
-#     ProductListingDocument().delete(instance)
+def enqueue(index, object_ids):
+    object_ids = [object_id for object_id in object_ids if object_id]
+    if object_ids:
+        SearchOutbox.objects.bulk_create([SearchOutbox(index=index, object_id=i) for i in object_ids])
+        mark_stale(index)
+
+
+# Documents denormalize product, brand and category fields, so a change to
+# any of them marks the listings that embed it as dirty too.
+
+@receiver([post_save, post_delete], sender=ProductListing)
+def enqueue_product_listing(sender, instance, **kwargs):
+    enqueue("product_listings", [instance.id])
+
+
+@receiver(post_save, sender=Product)
+def enqueue_product(sender, instance, **kwargs):
+    enqueue("product_listings", instance.product_listings.values_list("id", flat=True))
+
+
+@receiver([post_save, post_delete], sender=Category)
+def enqueue_category(sender, instance, **kwargs):
+    enqueue("categories", [instance.id])
+
+
+@receiver([post_save, pre_delete], sender=Category)
+def enqueue_category_listings(sender, instance, **kwargs):
+    # pre_delete: on_delete=SET_NULL clears the listings' category without signals
+    enqueue("product_listings", instance.category_product_listings.values_list("id", flat=True))
+
+
+@receiver([post_save, post_delete], sender=Entity)
+def enqueue_brand(sender, instance, **kwargs):
+    if instance.entity_type == "brand":
+        enqueue("brands", [instance.id])
+
+
+@receiver([post_save, pre_delete], sender=Entity)
+def enqueue_brand_listings(sender, instance, **kwargs):
+    if instance.entity_type == "brand":
+        enqueue("product_listings", instance.brand_product_listings.values_list("id", flat=True))
@@ -0,0 +1,119 @@
+"""
+Combined autocomplete for /search/suggest.
+
+Products, brands and categories are searched concurrently, and every answer
+goes into a per-process LRU keyed by (index, estore, query). An entry that
+holds every hit for its query (fewer hits than SUGGEST_FETCH) also answers
+any longer query starting with it: "sam" is served by filtering the cached
+hits for "sa" without a backend call. Typo-only matches of the longer query
+can be missed that way until the entry expires (SUGGEST_CACHE_TTL).
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .backends import get_search_backend
+from .local_index import tokenize
+
+
+SUGGEST_FETCH = 50
+SOURCES = {
+    # name in the response -> (index, attributes matched when filtering cached hits)
+    "products": ("product_listings", ("name", "brand", "category")),
+    "brands": ("brands", ("name",)),
+    "categories": ("categories", ("name",)),
+}
+
+_executor = ThreadPoolExecutor(max_workers=len(SOURCES) * 4, thread_name_prefix="suggest")
+
+
+class PrefixCache:
+
+    def __init__(self, max_entries=5000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()   # (index, estore_id, query) -> (expires, hits, complete)
+        self.lock = threading.Lock()
+
+    def get(self, index, estore_id, query):
+        """(hits, "hit" | "prefix") or (None, "miss")"""
+        now = time.monotonic()
+        with self.lock:
+            for length in range(len(query), 0, -1):
+                key = (index, estore_id, query[:length])
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                expires, hits, complete = entry
+                if expires < now:
+                    del self.entries[key]
+                    continue
+                if length == len(query):
+                    self.entries.move_to_end(key)
+                    return hits, "hit"
+                if complete:
+                    self.entries.move_to_end(key)
+                    return hits, "prefix"
+        return None, "miss"
+
+    def set(self, index, estore_id, query, hits, complete):
+        with self.lock:
+            self.entries[(index, estore_id, query)] = (time.monotonic() + self.ttl, hits, complete)
+            self.entries.move_to_end((index, estore_id, query))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+prefix_cache = PrefixCache(
+    max_entries=getattr(settings, "SUGGEST_CACHE_SIZE", 5000),
+    ttl=getattr(settings, "SUGGEST_CACHE_TTL", 60),
+)
+
+
+def normalize(q):
+    return " ".join(tokenize(q))
+
+
+def matches(hit, words, attributes):
+    """Every word but the last appears in the hit, the last one as a prefix"""
+    hit_words = set()
+    for attribute in attributes:
+        hit_words.update(tokenize(hit.get(attribute)))
+    *complete, last = words
+    return all(word in hit_words for word in complete) and any(w.startswith(last) for w in hit_words)
+
+
+def suggest_source(source, query, estore_id, limit):
+    started = time.perf_counter()
+    index, attributes = SOURCES[source]
+    hits, status = prefix_cache.get(index, estore_id, query)
+    if status == "prefix":
+        words = query.split(" ")
+        hits = [hit for hit in hits if matches(hit, words, attributes)]
+    elif status == "miss":
+        result = get_search_backend().search(index, query, filters={"estore_id": estore_id}, limit=SUGGEST_FETCH)
+        hits = result["hits"]
+        prefix_cache.set(index, estore_id, query, hits, complete=len(hits) < SUGGEST_FETCH)
+    names = [hit["name"] for hit in hits[:limit]]
+    return names, {"ms": round((time.perf_counter() - started) * 1000, 2), "cache": status}
+
+
+def suggest(q, estore_id, limit=5):
+    """{"products": [...], "brands": [...], "categories": [...], "timings": {...}}"""
+    query = normalize(q)
+    result = {source: [] for source in SOURCES}
+    result["timings"] = {}
+    if not query:
+        return result
+
+    futures = {source: _executor.submit(suggest_source, source, query, estore_id, limit) for source in SOURCES}
+    for source, future in futures.items():
+        try:
+            result[source], result["timings"][source] = future.result()
+        except Exception as e:
+            print(f"Suggest {source} failed: {e}")
+            result["timings"][source] = {"ms": None, "cache": "error"}
+    return result
@@ -454,7 +454,7 @@ def create_shipping_address(request, payload: ShippingAddressCreateSchema):
 
 # Read ShippingAddresss (List)
 @router.get("/shipping-addresses/", response=PaginatedResponseSchema)
-@cache_response()
+@cache_response(tags=["ShippingAddress:user:{user_id}"])
 def shipping_addresses(request,  page: int = 1, page_size: int = 10, user_id:int = None , is_default: bool = None, ordering: str = None,):
     qs = ShippingAddress.objects.all()
 
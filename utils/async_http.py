@@ -0,0 +1,55 @@
+"""
+Outbound HTTP for async views (payment gateways, Meilisearch).
+
+Under ASGI (ecommerce/asgi.py calls enable_shared_clients()) every event loop
+keeps one httpx.AsyncClient, so connections and TLS sessions to the gateways
+are reused across requests. Under WSGI Django runs each async view on a fresh
+event loop, so there a client is opened and closed per call instead of
+leaking one per request.
+"""
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+import httpx
+from django.conf import settings
+
+
+_shared = False
+_clients = weakref.WeakKeyDictionary()   # event loop -> httpx.AsyncClient
+
+
+def enable_shared_clients():
+    global _shared
+    _shared = True
+
+
+def new_async_client():
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            getattr(settings, "OUTBOUND_HTTP_TIMEOUT", 10),
+            connect=getattr(settings, "OUTBOUND_HTTP_CONNECT_TIMEOUT", 3),
+        ),
+        limits=httpx.Limits(
+            max_connections=getattr(settings, "OUTBOUND_HTTP_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=getattr(settings, "OUTBOUND_HTTP_MAX_KEEPALIVE", 20),
+        ),
+    )
+
+
+@asynccontextmanager
+async def async_http_client():
+    """
+        async with async_http_client() as client:
+            response = await client.post(url, json=payload)
+    """
+    if not _shared:
+        async with new_async_client() as client:
+            yield client
+        return
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = new_async_client()
+    yield client
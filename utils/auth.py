@@ -0,0 +1,9 @@
+from ninja_jwt.authentication import JWTAuth
+
+
+class AdminJWTAuth(JWTAuth):
+    """JWTAuth for staff users only, e.g. for endpoints exposing internal metrics"""
+
+    def authenticate(self, request, token):
+        user = super().authenticate(request, token)
+        return user if user.is_staff else None
@@ -0,0 +1,48 @@
+"""
+In-process worker threads for DB-backed queues (payment links, webhook inbox).
+
+A worker sleeps until wake() is called, typically from transaction.on_commit
+after a row was queued, then runs its drain function until the queue is
+empty. A worker with a poll interval also drains every `interval` seconds, so
+rows scheduled for later (retries with backoff) run without a new wake-up.
+Rows left behind by a process that restarted are picked up by the queue's
+management command.
+"""
+import logging
+import threading
+
+from django.db import close_old_connections
+
+
+logger = logging.getLogger("background")
+
+
+class BackgroundWorker:
+
+    def __init__(self, name, drain, interval=None):
+        self.name = name
+        self.drain = drain
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _work(self):
+        while True:
+            self.wakeup.wait(timeout=self.interval)
+            self.wakeup.clear()
+            close_old_connections()
+            try:
+                self.drain()
+            except Exception:
+                logger.exception("%s worker failed", self.name)
+            finally:
+                close_old_connections()
+
+    def wake(self):
+        """Start the thread if needed and have it drain the queue"""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._work, name=self.name, daemon=True)
+                self.thread.start()
+        self.wakeup.set()
@@ -1,6 +1,12 @@
+import gzip
 import json
+import math
+import random
+import time
 from functools import wraps
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
 from pydantic import BaseModel
 from ninja.schema import Schema
 from ninja.orm import ModelSchema
@@ -9,6 +15,11 @@ from django.db.models.query import QuerySet
 from django.db.models import Model
 from django.forms.models import model_to_dict
 
+from utils import local_cache as l1
+
+
+TAG_KEY_PREFIX = "tag:"
+
 
 def convert_pydantic(obj):
     """Recursively convert Pydantic models to dicts"""
@@ -24,7 +35,196 @@ def convert_pydantic(obj):
         return model_to_dict(obj)
     return obj
 
-def cache_response(timeout=60 * 5, cache_key_func=None):
+
+############################ Cache tags ############################
+
+def tag_key(tag):
+    return f"{TAG_KEY_PREFIX}{tag}"
+
+
+def resolve_tags(tags, request, *args, **kwargs):
+    """
+    Build the concrete tag list for a request.
+
+    `tags` is either a callable (request, *args, **kwargs) -> list or a list of
+    templates such as "Product:{product_id}". Templates are filled from the path
+    kwargs and the query params; a template whose value is missing is skipped.
+    """
+    if not tags:
+        return []
+    if callable(tags):
+        return [str(t) for t in tags(request, *args, **kwargs) if t]
+
+    context = {k: v for k, v in request.GET.items() if v not in (None, "")}
+    context.update({k: v for k, v in kwargs.items() if v is not None})
+
+    resolved = []
+    for template in tags:
+        try:
+            resolved.append(template.format(**context))
+        except (KeyError, IndexError):
+            continue
+    return resolved
+
+
+def _new_tag_version():
+    return int(time.time() * 1000)
+
+
+def get_tag_versions(tags, known=None):
+    """
+    Return {tag: version} for the given tags, creating a version for tags that
+    have none yet. `known` is an already fetched {tag_key: version} dict.
+    """
+    known = known if known is not None else cache.get_many([tag_key(t) for t in tags])
+    versions = {}
+    for tag in tags:
+        version = known.get(tag_key(tag))
+        if version is None:
+            version = _new_tag_version()
+            if not cache.add(tag_key(tag), version, timeout=None):
+                version = cache.get(tag_key(tag), version)
+        versions[tag] = version
+    return versions
+
+
+def invalidate_tags(*tags):
+    """
+    Invalidate every cached response recorded against any of the given tags.
+
+    Each tag holds a version number that cached entries remember at write time,
+    so invalidation is one INCR per tag (pipelined on Redis) instead of a SCAN
+    over the keyspace.
+    """
+    tags = [t for t in tags if t]
+    if not tags:
+        return
+
+    l1_enabled = l1.is_enabled()
+    if l1_enabled:
+        l1.local_cache.invalidate_tags(tags)
+
+    try:
+        client = cache.client.get_client(write=True)
+    except AttributeError:
+        client = None
+
+    if client is not None:
+        pipe = client.pipeline(transaction=False)
+        for tag in tags:
+            pipe.incr(cache.make_key(tag_key(tag)))
+        if l1_enabled:
+            # Other workers evict their L1 copies when they see this message
+            pipe.publish(l1.INVALIDATION_CHANNEL, json.dumps(tags))
+        pipe.execute()
+        return
+
+    # Non-Redis backends: incr one by one, a tag without a version has nothing cached
+    for tag in tags:
+        try:
+            cache.incr(tag_key(tag))
+        except ValueError:
+            pass
+
+
+############################ Cached responses ############################
+
+def build_cache_entry(response, tag_versions, compress=True, timeout=None, delta=0):
+    """
+    Snapshot a rendered response as body bytes plus headers. Bodies above
+    GZIP_MIN_LENGTH are stored gzipped so hits can be sent without re-encoding.
+    """
+    body = response.content
+    encoding = None
+    if compress and len(body) >= getattr(settings, "GZIP_MIN_LENGTH", 200):
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+        encoding = "gzip"
+    return {
+        "body": body,
+        "encoding": encoding,
+        "headers": {"Content-Type": response["Content-Type"]},
+        "status": response.status_code,
+        "tags": tag_versions,
+        "expires_at": time.time() + timeout if timeout else None,
+        "delta": delta,
+    }
+
+
+def response_from_entry(request, entry):
+    body = entry["body"]
+    accepts_gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+
+    if entry.get("encoding") == "gzip" and not accepts_gzip:
+        body = gzip.decompress(body)
+
+    response = HttpResponse(body, status=entry.get("status", 200))
+    for header, value in entry["headers"].items():
+        response[header] = value
+
+    if entry.get("encoding") == "gzip":
+        # GZipMiddleware leaves responses with a Content-Encoding alone
+        if accepts_gzip:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def is_fresh(entry, found, early_expiration=0):
+    """
+    An entry is fresh when all its tags still have the recorded versions and
+    its soft TTL has not passed. With early_expiration (beta > 0) an entry may
+    be treated as expired a little early, more likely the closer it is to
+    expiry and the slower it was to compute (probabilistic early recompute).
+    """
+    if not all(found.get(tag_key(t)) == v for t, v in entry.get("tags", {}).items()):
+        return False
+    expires_at = entry.get("expires_at")
+    if expires_at is None:
+        return True
+    now = time.time()
+    if early_expiration and entry.get("delta"):
+        now -= entry["delta"] * early_expiration * math.log(1.0 - random.random())
+    return now < expires_at
+
+
+def _wait_for_entry(key, request_tags, wait):
+    """Poll for an entry being computed by the worker holding the lock"""
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        found = cache.get_many([key] + [tag_key(t) for t in request_tags])
+        entry = found.get(key)
+        if isinstance(entry, dict) and "body" in entry and is_fresh(entry, found):
+            return entry
+    return None
+
+
+def cache_response(
+        timeout=60 * 5,
+        cache_key_func=None,
+        tags=None,
+        local=False,
+        compress=True,
+        stale_timeout=0,
+        single_flight=False,
+        early_expiration=0,
+        lock_timeout=10,
+    ):
+    """
+    Cache the rendered JSON body of a view in the shared cache (L2).
+
+    Entries hold the final response bytes, so a hit is returned as-is without
+    decoding and re-encoding JSON. With local=True and CACHE_L1_ENABLED the
+    entry is also kept in a per-worker LRU (L1) that is served without a
+    network round trip and evicted through the Redis invalidation channel.
+
+    Stampede protection, all opt-in:
+    - stale_timeout: keep entries this many seconds past `timeout` (or past a
+      tag invalidation) and serve them while one worker recomputes.
+    - single_flight: on a cold miss only the worker holding the lock runs the
+      view, the others wait up to lock_timeout for its result.
+    - early_expiration: beta for probabilistic early recompute, 1.0 is typical.
+    """
     def decorator(view_func):
         @wraps(view_func)
         def wrapped_view(request, *args, **kwargs):
@@ -36,20 +236,82 @@ def cache_response(timeout=60 * 5, cache_key_func=None):
                 if cache_key_func
                 else f"cache:{request.path}?{query_params}"
             )
+            lock_key = f"lock:{key}"
+
+            use_l1 = local and l1.is_enabled()
+            if use_l1:
+                l1.ensure_listener()
+                entry = l1.local_cache.get(key)
+                l1.record("l1", entry is not None)
+                if entry is not None:
+                    response = response_from_entry(request, entry)
+                    response["X-Cache"] = "L1-HIT"
+                    return response
+
+            request_tags = resolve_tags(tags, request, *args, **kwargs)
+            # An invalidation after this point keeps what is read below out of L1
+            generation = l1.local_cache.generation
+
+            # One round trip for the entry and the current versions of its tags
+            found = cache.get_many([key] + [tag_key(t) for t in request_tags])
+            cached = found.get(key)
+            if not (isinstance(cached, dict) and "body" in cached):
+                cached = None
 
-            cached = cache.get(key)
-            if cached is not None:
+            if cached is not None and is_fresh(cached, found, early_expiration):
                 print("Returning from cache")
-                return JsonResponse(json.loads(cached), safe=False)
+                l1.record("l2", True)
+                if use_l1:
+                    ttl = cached["expires_at"] - time.time() if cached.get("expires_at") else None
+                    l1.local_cache.set(key, cached, len(cached["body"]), cached.get("tags", {}),
+                                       ttl=min(ttl, l1.local_cache.ttl) if ttl else None, generation=generation)
+                response = response_from_entry(request, cached)
+                response["X-Cache"] = "L2-HIT"
+                return response
+            l1.record("l2", False)
+
+            locked = False
+            if (cached is not None and stale_timeout) or single_flight:
+                locked = cache.add(lock_key, 1, timeout=lock_timeout)
+
+                if not locked and cached is not None and stale_timeout:
+                    # Another worker is recomputing, serve what we have
+                    response = response_from_entry(request, cached)
+                    response["X-Cache"] = "STALE"
+                    return response
+
+                if not locked and single_flight:
+                    entry = _wait_for_entry(key, request_tags, lock_timeout)
+                    if entry is not None:
+                        response = response_from_entry(request, entry)
+                        response["X-Cache"] = "L2-HIT"
+                        return response
+
+            try:
+                # Read versions before running the view so a concurrent invalidation
+                # makes this entry stale instead of being lost
+                tag_versions = get_tag_versions(request_tags, found)
+
+                started = time.monotonic()
+                result = view_func(request, *args, **kwargs)
 
-            response = view_func(request, *args, **kwargs)
+                # Convert nested Pydantic objects to dict
+                data = convert_pydantic(result)
+                response = JsonResponse(data, safe=False)
+                delta = time.monotonic() - started
 
-            # Convert nested Pydantic objects to dict
-            data = convert_pydantic(response)
+                print("Storing to cache")
+                entry = build_cache_entry(response, tag_versions, compress, timeout, delta)
+                cache.set(key, entry, timeout=timeout + stale_timeout)
+                if use_l1:
+                    l1.local_cache.set(key, entry, len(entry["body"]), tag_versions,
+                                       ttl=min(timeout, l1.local_cache.ttl), generation=generation)
+            finally:
+                if locked:
+                    cache.delete(lock_key)
 
-            print("Storing to cache")
-            cache.set(key, json.dumps(data, default=str), timeout=timeout)
-            return JsonResponse(data, safe=False)
+            response["X-Cache"] = "MISS"
+            return response
 
         return wrapped_view
     return decorator
@@ -0,0 +1,127 @@
+import typing
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.query import QuerySet
+from pydantic import BaseModel
+
+
+MAX_DEPTH = 3
+
+
+class LoadPlan:
+    """select_related / prefetch_related / only() paths for one schema"""
+
+    def __init__(self):
+        self.select_related = []
+        self.prefetch_related = []
+        self.only = []
+        # False once a field can't be mapped to a column, only() is then unsafe
+        self.complete = True
+
+
+def _nested_schema(annotation):
+    """Return the Schema class inside Optional[...] / List[...], if any"""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in typing.get_args(annotation):
+        found = _nested_schema(arg)
+        if found is not None:
+            return found
+    return None
+
+
+def _field_path(name, info):
+    alias = info.alias or info.validation_alias
+    if isinstance(alias, str) and alias:
+        return alias.split(".")
+    return [name]
+
+
+def _plan_schema(schema, model, plan, prefix="", prefetched=False, depth=0):
+    """
+    Walk the schema fields against the model. Forward FK/one-to-one paths go to
+    select_related, reverse and many-to-many paths to prefetch_related, and
+    concrete columns to only(). Paths below a prefetch stay in prefetch_related.
+    """
+    for name, info in schema.model_fields.items():
+        path = _field_path(name, info)
+        current_model = model
+        current_prefix = prefix
+        is_prefetch = prefetched
+
+        for index, part in enumerate(path):
+            try:
+                field = current_model._meta.get_field(part)
+            except FieldDoesNotExist:
+                field = next((f for f in current_model._meta.concrete_fields if f.attname == part), None)
+                if field is None:
+                    # Property, resolver or computed value: can't restrict columns safely
+                    if not is_prefetch:
+                        plan.complete = False
+                    break
+
+            lookup = f"{current_prefix}{field.name}"
+            last = index == len(path) - 1
+
+            if not field.is_relation or (field.attname == part and field.attname != field.name):
+                if not is_prefetch:
+                    plan.only.append(lookup)
+                break
+
+            if field.many_to_many or field.one_to_many or (field.one_to_one and not field.concrete):
+                is_prefetch = True
+
+            if is_prefetch:
+                plan.prefetch_related.append(lookup)
+            else:
+                plan.select_related.append(lookup)
+                plan.only.append(lookup)
+
+            current_model = field.related_model
+            current_prefix = f"{lookup}__"
+
+            if last:
+                nested = _nested_schema(info.annotation)
+                if nested is not None and depth < MAX_DEPTH:
+                    _plan_schema(nested, current_model, plan, current_prefix, is_prefetch, depth + 1)
+                elif not is_prefetch:
+                    # Whole related row is used, e.g. a resolver reading obj.relation
+                    plan.only = [p for p in plan.only if not p.startswith(current_prefix)]
+                    plan.complete = False
+
+
+def plan_eager_loading(schema, model):
+    plan = LoadPlan()
+    _plan_schema(schema, model, plan)
+    return plan
+
+
+def eager_load(queryset, schema, only=True):
+    """
+    Apply the select_related / prefetch_related / only() that `schema` needs
+    to serialize rows of `queryset` without lazy loads per row.
+
+    only() is applied when every field of the schema maps to a model column
+    and the queryset has no select_related or deferred fields of its own.
+    """
+    if not isinstance(queryset, QuerySet) or queryset.query.values_select:
+        return queryset
+
+    had_select_related = bool(queryset.query.select_related)
+    had_deferred = bool(queryset.query.deferred_loading[0])
+
+    plan = plan_eager_loading(schema, queryset.model)
+    if plan.select_related:
+        queryset = queryset.select_related(*dict.fromkeys(plan.select_related))
+    seen = {getattr(lookup, "prefetch_to", lookup) for lookup in queryset._prefetch_related_lookups}
+    prefetch = [p for p in dict.fromkeys(plan.prefetch_related) if p not in seen]
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+
+    if only and plan.complete and plan.only and not had_select_related and not had_deferred:
+        ordering = [
+            o.lstrip("-") for o in (queryset.query.order_by or queryset.model._meta.ordering)
+            if isinstance(o, str) and "__" not in o and o.lstrip("-") not in ("?", "pk")
+        ]
+        queryset = queryset.only(*dict.fromkeys(plan.only + ordering))
+    return queryset
@@ -0,0 +1,251 @@
+"""
+Transport for the payment gateway calls in utils/payment.py.
+
+One GatewayClient per gateway holds:
+- a requests.Session with a connection pool, so sync calls reuse keep-alive
+  connections (async calls go over the httpx client from utils/async_http.py)
+- (connect, read) timeouts on every call
+- retries with jittered exponential backoff: GETs on connection errors,
+  timeouts and 5xx; POSTs only when no connection was made, so a payment
+  request is never sent twice
+- a circuit breaker: after PAYMENT_GATEWAY_BREAKER_THRESHOLD failed calls in a
+  row the gateway is skipped (GatewayUnavailable) for
+  PAYMENT_GATEWAY_BREAKER_RESET seconds, then a single trial call decides
+  whether it closes again
+- latency samples of the last calls, reported by gateway_metrics()
+
+Breaker state and metrics are per worker process.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+logger = logging.getLogger("gateway")
+
+LATENCY_SAMPLES = 1000
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class GatewayUnavailable(requests.ConnectionError):
+    """Raised without calling the gateway while its circuit breaker is open"""
+
+
+class CircuitBreaker:
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, threshold=5, reset_after=30):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_after:
+                # Let one trial call through; the rest keep failing fast until it finishes
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info("%s circuit breaker closed", self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    logger.warning("%s circuit breaker opened after %s failures", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def not_sent(error):
+    """True when the request failed before a connection was made"""
+    if isinstance(error, (requests.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class GatewayClient:
+
+    def __init__(self, name):
+        self.name = name
+        self.connect_timeout = getattr(settings, "PAYMENT_GATEWAY_CONNECT_TIMEOUT", 3)
+        self.read_timeout = getattr(settings, "PAYMENT_GATEWAY_READ_TIMEOUT", 10)
+        self.retries = getattr(settings, "PAYMENT_GATEWAY_RETRIES", 2)
+        self.backoff = getattr(settings, "PAYMENT_GATEWAY_BACKOFF", 0.2)
+        self.breaker = CircuitBreaker(
+            name,
+            threshold=getattr(settings, "PAYMENT_GATEWAY_BREAKER_THRESHOLD", 5),
+            reset_after=getattr(settings, "PAYMENT_GATEWAY_BREAKER_RESET", 30),
+        )
+        self._session = None
+        self._session_lock = threading.Lock()
+
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.counts = {"calls": 0, "failures": 0, "retries": 0, "rejected": 0}
+        self.stats_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    pool_size = getattr(settings, "PAYMENT_GATEWAY_POOL_SIZE", 10)
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    ############################ Bookkeeping ############################
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.counts[key] += 1
+
+    def _before_call(self):
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise GatewayUnavailable(f"{self.name} circuit breaker is open")
+
+    def _after_call(self, started, failed):
+        with self.stats_lock:
+            self.counts["calls"] += 1
+            self.latencies.append(time.perf_counter() - started)
+            if failed:
+                self.counts["failures"] += 1
+        if failed:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+    def _retry_delay(self, attempt):
+        # Full jitter, so retrying workers don't hit the gateway in lockstep
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def _should_retry(self, method, attempt, error=None, response=None):
+        if attempt >= self.retries:
+            return False
+        if error is not None:
+            return method in IDEMPOTENT_METHODS or not_sent(error)
+        return method in IDEMPOTENT_METHODS and response.status_code >= 500
+
+    ############################ Calls ############################
+
+    def request(self, method, url, **kwargs):
+        """requests.request() through the pool, timeouts, retries and breaker"""
+        method = method.upper()
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        attempt = 0
+        while True:
+            self._before_call()
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self._after_call(started, failed=True)
+                if not self._should_retry(method, attempt, error=e):
+                    raise
+            else:
+                self._after_call(started, failed=response.status_code >= 500)
+                if not self._should_retry(method, attempt, response=response):
+                    return response
+            self._count("retries")
+            time.sleep(self._retry_delay(attempt))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    async def arequest(self, client, method, url, **kwargs):
+        """request() over an httpx.AsyncClient"""
+        method = method.upper()
+        kwargs.setdefault("timeout", httpx.Timeout(self.read_timeout, connect=self.connect_timeout))
+        attempt = 0
+        while True:
+            self._before_call()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                self._after_call(started, failed=True)
+                if not self._should_retry(method, attempt, error=e):
+                    raise
+            else:
+                self._after_call(started, failed=response.status_code >= 500)
+                if not self._should_retry(method, attempt, response=response):
+                    return response
+            self._count("retries")
+            await asyncio.sleep(self._retry_delay(attempt))
+            attempt += 1
+
+    async def aget(self, client, url, **kwargs):
+        return await self.arequest(client, "GET", url, **kwargs)
+
+    async def apost(self, client, url, **kwargs):
+        return await self.arequest(client, "POST", url, **kwargs)
+
+    ############################ Metrics ############################
+
+    def metrics(self):
+        with self.stats_lock:
+            latencies = list(self.latencies)
+            counts = dict(self.counts)
+        counts["state"] = self.breaker.state
+        for name, fraction in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+            value = percentile(latencies, fraction)
+            counts[name] = round(value * 1000, 1) if value is not None else None
+        return counts
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_gateway_client(name):
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = GatewayClient(name)
+        return _clients[name]
+
+
+def gateway_metrics():
+    """Calls, failures, retries, breaker state and latency percentiles per gateway for this worker"""
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {"pid": os.getpid(), "gateways": {client.name: client.metrics() for client in clients}}
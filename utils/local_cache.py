@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+INVALIDATION_CHANNEL = getattr(settings, "CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+
+logger = logging.getLogger("cache")
+
+
+class LocalCache:
+    """
+    Per-process LRU cache bounded by total bytes, with a TTL per entry and a
+    tag index so tag invalidations evict only the affected keys.
+
+    `generation` counts invalidations. A caller that read an entry from L2
+    passes the generation it saw before that read to set(), so an entry an
+    invalidation overtook on its way into L1 is dropped instead of being
+    served without a tag check until its TTL.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, tags, value)
+        self._tag_index = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[3]
+
+    def set(self, key, value, size, tags=(), ttl=None, generation=None):
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (ttl or self.ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, tuple(tags), value)
+            self._size += size
+            for tag in tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            while self._size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self._tag_index.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tag_index.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        expires_at, size, tags, value = self._entries.pop(key)
+        self._size -= size
+        for tag in tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._size
+
+
+local_cache = LocalCache(
+    max_bytes=getattr(settings, "CACHE_L1_MAX_BYTES", 32 * 1024 * 1024),
+    ttl=getattr(settings, "CACHE_L1_TTL", 30),
+)
+
+
+def is_enabled():
+    return getattr(settings, "CACHE_L1_ENABLED", False)
+
+
+############################ Stats ############################
+
+_stats_lock = threading.Lock()
+_stats = {
+    "l1": {"hits": 0, "misses": 0},
+    "l2": {"hits": 0, "misses": 0},
+}
+
+
+def record(tier, hit):
+    with _stats_lock:
+        _stats[tier]["hits" if hit else "misses"] += 1
+
+
+def get_cache_stats():
+    """Hit/miss counters per tier for this worker process"""
+    with _stats_lock:
+        stats = {tier: dict(counts) for tier, counts in _stats.items()}
+    stats["l1"]["entries"] = len(local_cache)
+    stats["l1"]["bytes"] = local_cache.size
+    stats["pid"] = os.getpid()
+    return stats
+
+
+############################ Pub/Sub invalidation ############################
+
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def _listen(client):
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(INVALIDATION_CHANNEL)
+    for message in pubsub.listen():
+        try:
+            local_cache.invalidate_tags(json.loads(message["data"]))
+        except Exception:
+            logger.exception("Error applying cache invalidation message")
+
+
+def _run_listener(client):
+    # Reconnect forever, dropping local entries since messages may have been missed
+    while True:
+        try:
+            _listen(client)
+        except Exception:
+            logger.exception("Cache invalidation listener disconnected")
+        local_cache.clear()
+        time.sleep(1)
+
+
+def ensure_listener():
+    """
+    Start the invalidation subscriber for this process. Called lazily so every
+    gunicorn worker gets its own thread after fork.
+    """
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        try:
+            client = cache.client.get_client()
+        except AttributeError:
+            # Non-Redis backend: a single process, local invalidation is enough
+            return
+        local_cache.clear()
+        threading.Thread(target=_run_listener, args=(client,), daemon=True).start()
+
@@ -1,5 +1,13 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.core.paginator import Paginator
+from django.db.models import Q
+from django.db.models.query import QuerySet
 from ninja import Query
+from ninja.errors import HttpError
+from utils.eager_loading import eager_load
 from pydantic import BaseModel
 from typing import List, Optional, Type, TypeVar
 
@@ -15,21 +23,50 @@ class PaginatedResponseSchema(BaseModel):
     class Config:
         arbitrary_types_allowed = True
 
-def paginate_queryset(request, queryset, schema: Type[T], page_number: int = 1, page_size: int = 10, query: str =""):
-    paginator = Paginator(queryset, page_size)
-    page_obj = paginator.get_page(page_number)
 
+def _base_url(request):
     # Build the base URL without query parameters
     base_url = request.build_absolute_uri(request.path)
 
     if base_url.startswith('http://'):
         base_url = base_url.replace('http://', 'https://', 1)
-        
+    return base_url
+
+
+def paginate_queryset(request, queryset, schema: Type[T], page_number: int = 1, page_size: int = 10, query: str ="", transform=None):
+    """
+    Paginate a queryset (or list) into PaginatedResponseSchema.
+
+    `transform`, if given, is called with the objects of the current page only
+    and returns what gets validated against `schema` (e.g. hand-built dicts),
+    so serialization never touches rows outside the page. Without a transform
+    the queryset gets the eager loading `schema` needs (utils.eager_loading).
+
+    Clients opt into keyset pagination on any list endpoint with
+    ?pagination=cursor and then follow the `next`/`previous` links, which
+    carry an opaque `cursor`. The response shape stays the same.
+    """
+    if transform is None:
+        queryset = eager_load(queryset, schema)
+
+    if request.GET.get("pagination") == "cursor" or request.GET.get("cursor"):
+        if isinstance(queryset, QuerySet) and get_keyset_fields(queryset) is not None:
+            return cursor_paginate_queryset(request, queryset, schema, page_size, query, transform=transform)
+
+    paginator = Paginator(queryset, page_size)
+    page_obj = paginator.get_page(page_number)
+
+    base_url = _base_url(request)
+
     next_url = f"{base_url}?page={page_obj.next_page_number()}&page_size={str(page_size)}{query}" if page_obj.has_next() else None
     previous_url = f"{base_url}?page={page_obj.previous_page_number()}{query}" if page_obj.has_previous() else None
 
+    objects = page_obj.object_list
+    if transform:
+        objects = transform(list(objects))
+
     # Convert queryset to list of dictionaries
-    results = [schema.from_orm(obj) for obj in page_obj.object_list]
+    results = [schema.from_orm(obj) for obj in objects]
 
     return PaginatedResponseSchema(
         count=paginator.count,
@@ -37,3 +74,157 @@ def paginate_queryset(request, queryset, schema: Type[T], page_number: int = 1,
         previous=previous_url,
         results=results
     )
+
+
+############################ Cursor (keyset) pagination ############################
+
+def get_keyset_fields(queryset):
+    """
+    Return [(attname, descending), ...] for the queryset ordering with the
+    primary key appended as a tie-breaker, or None when the ordering can't be
+    used as a keyset (expressions, related lookups, nullable columns).
+    """
+    model = queryset.model
+    ordering = list(queryset.query.order_by) or list(model._meta.ordering)
+    pk_name = model._meta.pk.attname
+
+    fields = []
+    for item in ordering:
+        if not isinstance(item, str) or item == "?":
+            return None
+        name = item.lstrip("-")
+        if name == "pk":
+            name = model._meta.pk.name
+        if "__" in name:
+            return None
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if field.null or not field.concrete:
+            return None
+        fields.append((field.attname, item.startswith("-")))
+
+    if not any(name == pk_name for name, _ in fields):
+        fields.append((pk_name, fields[-1][1] if fields else True))
+    return fields
+
+
+def encode_cursor(values, backwards=False):
+    payload = json.dumps({"v": values, "b": backwards}, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return payload["v"], bool(payload.get("b"))
+    except (ValueError, KeyError, TypeError):
+        return None, False
+
+
+def _cursor_values(model, fields, values):
+    """
+    Convert decoded cursor values to the keyset fields' Python types. A cursor
+    that doesn't match the keyset is a client error, not a server one.
+    """
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise HttpError(400, "Invalid cursor")
+    try:
+        return [model._meta.get_field(name).to_python(value) for (name, _), value in zip(fields, values)]
+    except (ValidationError, ValueError, TypeError):
+        raise HttpError(400, "Invalid cursor")
+
+
+def _keyset_filter(fields, values, backwards):
+    condition = Q()
+    for i, (name, descending) in enumerate(fields):
+        lookup = "lt" if descending != backwards else "gt"
+        step = Q(**{f"{name}__{lookup}": values[i]})
+        for j in range(i):
+            step &= Q(**{fields[j][0]: values[j]})
+        condition |= step
+    return condition
+
+
+def estimate_count(queryset):
+    """
+    Cheap row count: pg_class.reltuples for an unfiltered table, the planner's
+    row estimate for a filtered one, and a real COUNT(*) on other databases.
+    """
+    from django.db import connections
+
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset.count()
+
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] is not None and row[0] >= 0:
+            return int(row[0])
+        return queryset.count()
+
+    try:
+        plan = json.loads(queryset.order_by().explain(format="json"))
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except (ValueError, KeyError, IndexError, TypeError):
+        return queryset.count()
+
+
+def cursor_paginate_queryset(request, queryset, schema: Type[T], page_size: int = 10, query: str = "", count: str = "estimate", transform=None):
+    """
+    Keyset pagination on (ordering fields..., id). Each page is one indexed
+    range query with no OFFSET, however deep the client goes.
+
+    count is "estimate" (see estimate_count) or "exact".
+    """
+    page_size = int(page_size)
+    fields = get_keyset_fields(queryset)
+    ordered = queryset.order_by(*[("-" if desc else "") + name for name, desc in fields])
+
+    values, backwards = (None, False)
+    token = request.GET.get("cursor")
+    if token:
+        values, backwards = decode_cursor(token)
+        values = _cursor_values(queryset.model, fields, values)
+
+    page_qs = ordered
+    if values is not None:
+        page_qs = page_qs.filter(_keyset_filter(fields, values, backwards))
+    if backwards:
+        page_qs = page_qs.reverse()
+
+    rows = list(page_qs[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    def row_values(obj):
+        return [getattr(obj, name) for name, _ in fields]
+
+    base_url = _base_url(request)
+    link = f"{base_url}?pagination=cursor&page_size={page_size}{query}&cursor="
+
+    next_url = None
+    previous_url = None
+    if rows:
+        if has_more or backwards:
+            next_url = link + encode_cursor(row_values(rows[-1]))
+        if (values is not None and not backwards) or (backwards and has_more):
+            previous_url = link + encode_cursor(row_values(rows[0]), backwards=True)
+
+    total = queryset.count() if count == "exact" else estimate_count(queryset)
+
+    return PaginatedResponseSchema(
+        count=total,
+        next=next_url,
+        previous=previous_url,
+        results=[schema.from_orm(obj) for obj in (transform(rows) if transform else rows)],
+    )
@@ -1,7 +1,16 @@
 import requests
+import httpx
+import asyncio
 import json
+import threading
+import time
 from uuid import uuid4
+from asgiref.sync import sync_to_async
 from decouple import config
+from django.core.cache import cache
+
+from utils.async_http import async_http_client
+from utils.gateway_client import get_gateway_client
 
 # PhonePe Configuration
 PHONEPE_CLIENT_ID = config('PHONEPE_CLIENT_ID', default="", cast=str)
@@ -29,29 +38,30 @@ CASHFREE_BASE_URL = (
     else "https://sandbox.cashfree.com/pg"
 )
 
-# Token cache for authentication
+# Pooled sessions with timeouts, retries and a circuit breaker per gateway
+phonepe = get_gateway_client("phonepe")
+cashfree = get_gateway_client("cashfree")
+
+# PhonePe OAuth token, shared by all workers through the Django cache. One
+# worker at a time (TOKEN_LOCK_KEY) fetches a token; the others wait for it on
+# a cold start, and once a token is within PHONEPE_TOKEN_REFRESH_MARGIN seconds
+# of expires_at it is replaced from a background thread while requests keep
+# using the current one.
+TOKEN_CACHE_KEY = "phonepe:auth_token"
+TOKEN_LOCK_KEY = "phonepe:auth_token:lock"
+TOKEN_LOCK_TIMEOUT = 30
+TOKEN_WAIT = 5
+TOKEN_REFRESH_MARGIN = config('PHONEPE_TOKEN_REFRESH_MARGIN', default=300, cast=int)
+
+# This process's copy of the shared token
 _auth_token_cache = {
     "access_token": None,
     "expires_at": 0
 }
+_refreshing = threading.Lock()
 
 
-def _get_auth_token():
-    """
-    Get authentication token from PhonePe API.
-    Caches the token and reuses it until expiry.
-    
-    Returns:
-        str: Access token for API authentication
-    """
-    import time
-    
-    # Check if cached token is still valid
-    current_time = time.time()
-    if _auth_token_cache["access_token"] and _auth_token_cache["expires_at"] > current_time:
-        return _auth_token_cache["access_token"]
-    
-    # Get new token
+def _auth_token_request():
     if PHONEPE_ENV == "PRODUCTION":
         url = "https://api.phonepe.com/apis/identity-manager/v1/oauth/token"
     else:
@@ -67,26 +77,496 @@ def _get_auth_token():
     headers = {
         "Content-Type": "application/x-www-form-urlencoded"
     }
+    return url, {"data": payload, "headers": headers}
+
+
+def _needs_refresh(token):
+    return token["expires_at"] - TOKEN_REFRESH_MARGIN <= time.time()
+
+
+def _cached_auth_token():
+    """The current token as {"access_token", "expires_at"}, or None"""
+    token = dict(_auth_token_cache)
+    if _needs_refresh(token):
+        # Another worker may already have refreshed it
+        shared = cache.get(TOKEN_CACHE_KEY)
+        if shared and shared["expires_at"] > token["expires_at"]:
+            _auth_token_cache.update(shared)
+            token = shared
+
+    # Check if cached token is still valid
+    if token["access_token"] and token["expires_at"] > time.time():
+        return token
+    return None
+
+
+def _parse_auth_token(response):
+    response.raise_for_status()
     
+    auth_data = response.json()
+    token = {
+        "access_token": auth_data.get("access_token"),
+        "expires_at": auth_data.get("expires_at", 0),
+    }
+    # Never log the token itself
+    print(f"PhonePe auth token refreshed, expires at {token['expires_at']}")
+    return token
+
+
+def _save_auth_token(token):
+    _auth_token_cache.update(token)
+    ttl = token["expires_at"] - time.time()
+    if ttl > 0:
+        cache.set(TOKEN_CACHE_KEY, token, timeout=ttl)
+    return token["access_token"]
+
+
+def _newer_shared_token(expires_at):
+    shared = cache.get(TOKEN_CACHE_KEY)
+    if shared and shared["expires_at"] > max(expires_at, time.time()):
+        _auth_token_cache.update(shared)
+        return shared["access_token"]
+    return None
+
+
+def _refresh_auth_token(expires_at=0):
+    """
+    Replace the token expiring at `expires_at` unless another worker holds the
+    lock. The new token, or None when the lock was taken.
+    """
+    if not cache.add(TOKEN_LOCK_KEY, 1, timeout=TOKEN_LOCK_TIMEOUT):
+        return None
     try:
-        response = requests.post(url, data=payload, headers=headers)
-        response.raise_for_status()
-        
-        auth_data = response.json()
-        access_token = auth_data.get("access_token")
-        expires_at = auth_data.get("expires_at", 0)
-        
-        # Cache the token
-        _auth_token_cache["access_token"] = access_token
-        _auth_token_cache["expires_at"] = expires_at
-        
-        print(f"Auth token: {auth_data}")
-        return access_token
+        # Someone may have refreshed between our read and taking the lock
+        access_token = _newer_shared_token(expires_at)
+        if access_token:
+            return access_token
+        url, kwargs = _auth_token_request()
+        return _save_auth_token(_parse_auth_token(phonepe.post(url, **kwargs)))
+    finally:
+        cache.delete(TOKEN_LOCK_KEY)
+
+
+def _refresh_in_background(expires_at):
+    if not _refreshing.acquire(blocking=False):
+        return
+
+    def refresh():
+        try:
+            _refresh_auth_token(expires_at)
+        except Exception as e:
+            print(f"Error refreshing auth token: {e}")
+        finally:
+            _refreshing.release()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def _get_auth_token():
+    """
+    Get authentication token from PhonePe API.
+    Shares the token between workers and refreshes it before expiry.
+    
+    Returns:
+        str: Access token for API authentication
+    """
+    token = _cached_auth_token()
+    if token:
+        if _needs_refresh(token):
+            _refresh_in_background(token["expires_at"])
+        return token["access_token"]
+
+    # No token yet: one worker fetches it, the others wait for theirs
+    try:
+        deadline = time.monotonic() + TOKEN_WAIT
+        while True:
+            access_token = _refresh_auth_token()
+            if access_token:
+                return access_token
+            token = _cached_auth_token()
+            if token:
+                return token["access_token"]
+            if time.monotonic() >= deadline:
+                url, kwargs = _auth_token_request()
+                return _save_auth_token(_parse_auth_token(phonepe.post(url, **kwargs)))
+            time.sleep(0.05)
+    except Exception as e:
+        print(f"Error getting auth token: {e}")
+        raise
+
+
+async def _aget_auth_token(client):
+    """_get_auth_token() over a shared httpx.AsyncClient"""
+    token = dict(_auth_token_cache)
+    if not token["access_token"] or _needs_refresh(token):
+        token = await sync_to_async(_cached_auth_token)()
+    if token:
+        if _needs_refresh(token):
+            _refresh_in_background(token["expires_at"])
+        return token["access_token"]
+
+    try:
+        deadline = time.monotonic() + TOKEN_WAIT
+        while True:
+            locked = await cache.aadd(TOKEN_LOCK_KEY, 1, timeout=TOKEN_LOCK_TIMEOUT)
+            if locked or time.monotonic() >= deadline:
+                try:
+                    access_token = await sync_to_async(_newer_shared_token)(0)
+                    if access_token:
+                        return access_token
+                    url, kwargs = _auth_token_request()
+                    token = _parse_auth_token(await phonepe.apost(client, url, **kwargs))
+                    return await sync_to_async(_save_auth_token)(token)
+                finally:
+                    if locked:
+                        await cache.adelete(TOKEN_LOCK_KEY)
+            token = await sync_to_async(_cached_auth_token)()
+            if token:
+                return token["access_token"]
+            await asyncio.sleep(0.05)
     except Exception as e:
         print(f"Error getting auth token: {e}")
         raise
 
 
+############################ Requests and responses ############################
+# Each gateway call is split into a request builder and a response parser so
+# the sync (requests) and async (httpx) variants below share them; both
+# libraries' responses have status_code, text, json() and raise_for_status().
+
+def _phonepe_pay_request(amount, redirect_url, merchant_order_id, auth_token):
+    amount_in_paise = int(amount * 100)  # Convert to paise (e.g., 100 = 1 INR)
+
+    # Prepare API request
+    url = f"{PHONEPE_BASE_URL}/checkout/v2/pay"
+    
+    payload = {
+        "amount": amount_in_paise,
+        "merchantOrderId": merchant_order_id,
+        "paymentFlow": {
+            "type": "PG_CHECKOUT",
+            "merchantUrls": {
+                "redirectUrl": redirect_url
+            },
+            "paymentModeConfig": {
+                "enabledPaymentModes": [
+                    {
+                        "type": "UPI_INTENT"
+                    },
+                    {
+                        "type": "UPI_COLLECT"
+                    },
+                    {
+                        "type": "UPI_QR"
+                    },
+                    {
+                        "type": "NET_BANKING"
+                    },
+                    {
+                        "type": "CARD",
+                        "cardTypes": [
+                            "DEBIT_CARD",
+                            "CREDIT_CARD"
+                        ]
+                    }
+                ],
+                "disabledPaymentModes": [
+                    {
+                        "type": "UPI_INTENT"
+                    },
+                    {
+                        "type": "UPI_COLLECT"
+                    },
+                    {
+                        "type": "UPI_QR"
+                    },
+                    {
+                        "type": "NET_BANKING"
+                    },
+                    {
+                        "type": "CARD",
+                        "cardTypes": [
+                            "DEBIT_CARD",
+                            "CREDIT_CARD"
+                        ]
+                    }
+                ]
+            }
+        },
+        "metaInfo":{
+
+        }
+    }
+    
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"O-Bearer {auth_token}"
+    }
+    return url, {"json": payload, "headers": headers}
+
+
+def _phonepe_pay_response(response):
+    print(f"Payment response: {response.json()}")
+
+    # Check if response is successful
+    if response.status_code != 200:
+        print(f"PhonePe API returned non-200 status: {response.status_code}")
+        raise Exception(f"Payment creation failed with HTTP {response.status_code}")
+    
+    response_data = response.json()
+    
+    # PhonePe API wraps the actual payment response in a 'data' field
+    # Extract the nested data if it exists, otherwise use the response as is
+    if 'data' in response_data and response_data['data']:
+        payment_response = response_data['data']
+    else:
+        payment_response = response_data
+    
+    # Save the merchant_order_id for later use
+    return payment_response
+
+
+def _cashfree_link_request(amount, redirect_url, merchant_order_id, customer_details, link_purpose):
+    # Prepare API request
+    url = f"{CASHFREE_BASE_URL}/links"
+    
+    # Default customer details if not provided
+    if customer_details is None:
+        customer_details = {
+            "customer_name": "Customer",
+            "customer_email": "testemail@gmail.com",
+            "customer_phone": "9999999999"
+        }
+    
+    # Build notify_url (webhook URL) - same domain as return_url
+    notify_url = redirect_url.replace("/checkout/", "/api/payment/cashfree-webhook/")
+    if not notify_url.startswith("http"):
+        # If redirect_url is relative, construct full URL
+        base_url = redirect_url.split("/checkout/")[0] if "/checkout/" in redirect_url else "https://nm.thelearningsetu.com"
+        notify_url = f"{base_url}/api/payment/cashfree-webhook/"
+    
+    payload = {
+        "link_id": merchant_order_id,
+        "link_amount": float(amount),
+        "link_currency": "INR",
+        "link_purpose": link_purpose,
+        "customer_details": customer_details,
+        "link_meta": {
+            "notify_url": notify_url,
+            "return_url": redirect_url,
+            "upi_intent": False
+        },
+        "link_notify": {
+            "send_email": False,
+            "send_sms": False
+        }
+    }
+    
+    headers = {
+        "Content-Type": "application/json",
+        "x-api-version": CASHFREE_API_VERSION,
+        "x-client-id": CASHFREE_CLIENT_ID,
+        "x-client-secret": CASHFREE_CLIENT_SECRET
+    }
+    return url, {"json": payload, "headers": headers}
+
+
+def _cashfree_link_response(response):
+    print(f"Cashfree payment response: {response.status_code}, {response.text}")
+    
+    # Check if response is successful
+    if response.status_code != 200:
+        print(f"Cashfree API returned non-200 status: {response.status_code}")
+        raise Exception(f"Cashfree payment creation failed with HTTP {response.status_code}: {response.text}")
+    
+    response_data = response.json()
+    
+    # Cashfree returns the response directly, no nesting
+    return {
+        "redirectUrl": response_data.get("link_url"),
+        "link_url": response_data.get("link_url"),
+        "orderId": response_data.get("cf_link_id"),  # Cashfree's link ID
+        "cf_link_id": response_data.get("cf_link_id"),
+        "link_id": response_data.get("link_id"),
+        "link_status": response_data.get("link_status")
+    }
+
+
+def _cashfree_status_request(link_id):
+    # Use Cashfree's Get Payment Link Details endpoint
+    url = f"{CASHFREE_BASE_URL}/links/{link_id}"
+    
+    headers = {
+        "x-api-version": CASHFREE_API_VERSION,
+        "x-client-id": CASHFREE_CLIENT_ID,
+        "x-client-secret": CASHFREE_CLIENT_SECRET
+    }
+    return url, {"headers": headers}
+
+
+def _cashfree_status_response(link_id, response):
+    print(f"Cashfree status check response: {response.status_code}")
+    
+    if response.status_code == 404:
+        return {
+            "state": "PENDING",
+            "message": "Payment link not found or still processing",
+            "error_type": "API_NOT_FOUND",
+            "link_id": link_id
+        }
+    
+    if response.status_code != 200:
+        return {
+            "state": "PENDING",
+            "message": f"Payment status check failed - HTTP {response.status_code}",
+            "error_type": "API_HTTP_ERROR",
+            "link_id": link_id
+        }
+    
+    response_data = response.json()
+    
+    # Map Cashfree status to our payment status format
+    link_status = response_data.get("link_status", "PENDING")
+    link_amount_paid = response_data.get("link_amount_paid", 0)
+    link_amount = response_data.get("link_amount", 0)
+    
+    # Determine state based on Cashfree status and payment amount
+    if link_status == "PAID" or (link_amount_paid > 0 and link_amount_paid >= link_amount):
+        state = "SUCCESS"
+    elif link_status == "EXPIRED" or link_status == "CANCELLED":
+        state = "FAILED"
+    elif link_status == "PARTIALLY_PAID":
+        state = "PENDING"  # Or handle as partial payment
+    else:
+        state = "PENDING"
+    
+    return {
+        "state": state,
+        "link_status": link_status,
+        "link_amount": link_amount,
+        "link_amount_paid": link_amount_paid,
+        "cf_link_id": response_data.get("cf_link_id"),
+        "link_id": response_data.get("link_id"),
+        "link_url": response_data.get("link_url")
+    }
+
+
+def _cashfree_status_error(link_id, e):
+    print(f"Error checking Cashfree payment status: {e}")
+    return {
+        "state": "PENDING",
+        "message": f"Payment status check failed - {str(e)[:100]}",
+        "error_type": "UNKNOWN_ERROR",
+        "link_id": link_id
+    }
+
+
+def _phonepe_status_request(merchant_order_id, auth_token):
+    # Prepare API request
+    url = f"{PHONEPE_BASE_URL}/checkout/v2/order/{merchant_order_id}/status"
+    
+    headers = {
+        # "Content-Type": "application/json",
+        "Authorization": f"O-Bearer {auth_token}"
+    }
+    return url, {"headers": headers}
+
+
+def _phonepe_status_response(merchant_order_id, response):
+    # print(f"HTTP Response Status Code: {response.status_code}")
+    
+    # Handle HTTP 204 (No Content) - valid success response but no body
+    if response.status_code == 204:
+        # print("PhonePe API returned 204 No Content - payment may still be processing")
+        return {
+            "state": "PENDING",
+            "message": "Payment status unavailable - order may still be processing",
+            "error_type": "API_NO_CONTENT",
+            "merchant_order_id": merchant_order_id
+        }
+    
+    # Check if response is successful (200-299 range)
+    if not (200 <= response.status_code < 300):
+        # print(f"PhonePe API returned error status: {response.status_code}")
+        return {
+            "state": "PENDING",
+            "message": f"Payment status check failed - HTTP {response.status_code}",
+            "error_type": "API_HTTP_ERROR",
+            "merchant_order_id": merchant_order_id
+        }
+    
+    # Try to parse JSON response
+    try:
+        order_status_response = response.json()
+    except (json.JSONDecodeError, ValueError) as e:
+        # If response is empty or not valid JSON, treat as no content
+        print(f"PhonePe API returned non-JSON response: {e}")
+        return {
+            "state": "PENDING",
+            "message": "Payment status unavailable - invalid response format",
+            "error_type": "API_INVALID_RESPONSE",
+            "merchant_order_id": merchant_order_id
+        }
+    
+    # print(f"PhonePe API Response: {json.dumps(order_status_response, indent=2)}")
+    
+    # PhonePe API wraps the actual order status in a 'data' field
+    # Extract the nested data if it exists
+    if 'data' in order_status_response and order_status_response['data']:
+        # Return the nested data which contains the actual order status
+        return order_status_response['data']
+    elif 'state' in order_status_response:
+        # If state is directly in the response, return as is (backward compatibility)
+        return order_status_response
+    else:
+        # If neither structure is found, return error
+        # print("Unexpected PhonePe API response structure")
+        return {
+            "state": "PENDING",
+            "message": "Payment status check failed - Unexpected API response structure",
+            "error_type": "API_INVALID_RESPONSE",
+            "merchant_order_id": merchant_order_id,
+            "raw_response": order_status_response
+        }
+
+
+def _phonepe_status_error(merchant_order_id, e):
+    # print(f"Error checking order status: {e}")
+    # print(f"Error type: {type(e).__name__}")
+    
+    # Handle specific JSON decode errors from PhonePe API
+    if "JSONDecodeError" in str(e) or "Expecting value" in str(e):
+        print("PhonePe API returned empty/invalid response. This might happen for very new transactions.")
+        return {
+            "state": "PENDING",
+            "message": "Payment status check failed - API returned empty response",
+            "error_type": "API_EMPTY_RESPONSE",
+            "merchant_order_id": merchant_order_id
+        }
+    
+    # Handle other API errors
+    elif "HTTP" in str(e) or "timeout" in str(e).lower() or isinstance(e, (requests.RequestException, httpx.HTTPError)):
+        print("PhonePe API connection issue")
+        return {
+            "state": "PENDING", 
+            "message": "Payment status check failed - API connection issue",
+            "error_type": "API_CONNECTION_ERROR",
+            "merchant_order_id": merchant_order_id
+        }
+        
+    # Handle unknown errors
+    else:
+        print(f"Unknown error type: {e}")
+        return {
+            "state": "UNKNOWN",
+            "message": f"Payment status check failed - {str(e)[:100]}",
+            "error_type": "UNKNOWN_ERROR",
+            "merchant_order_id": merchant_order_id
+        }
+
+
+############################ Payment creation ############################
+
 def create_payment_phonepay(amount, redirect_url, merchant_order_id=None):
     """
     Create payment with PhonePe
@@ -101,102 +581,14 @@ def create_payment_phonepay(amount, redirect_url, merchant_order_id=None):
     """
     if merchant_order_id is None:
         merchant_order_id = str(uuid4())  # Generate unique order ID if not provided
-    amount_in_paise = int(amount * 100)  # Convert to paise (e.g., 100 = 1 INR)
     
     # print(f"Using redirect URL: {redirect_url}")
     
     try:
         # Get authentication token
         auth_token = _get_auth_token()
-
-        # print(auth_token)
-        
-        # Prepare API request
-        url = f"{PHONEPE_BASE_URL}/checkout/v2/pay"
-        
-        payload = {
-            "amount": amount_in_paise,
-            "merchantOrderId": merchant_order_id,
-            "paymentFlow": {
-                "type": "PG_CHECKOUT",
-                "merchantUrls": {
-                    "redirectUrl": redirect_url
-                },
-                "paymentModeConfig": {
-                    "enabledPaymentModes": [
-                        {
-                            "type": "UPI_INTENT"
-                        },
-                        {
-                            "type": "UPI_COLLECT"
-                        },
-                        {
-                            "type": "UPI_QR"
-                        },
-                        {
-                            "type": "NET_BANKING"
-                        },
-                        {
-                            "type": "CARD",
-                            "cardTypes": [
-                                "DEBIT_CARD",
-                                "CREDIT_CARD"
-                            ]
-                        }
-                    ],
-                    "disabledPaymentModes": [
-                        {
-                            "type": "UPI_INTENT"
-                        },
-                        {
-                            "type": "UPI_COLLECT"
-                        },
-                        {
-                            "type": "UPI_QR"
-                        },
-                        {
-                            "type": "NET_BANKING"
-                        },
-                        {
-                            "type": "CARD",
-                            "cardTypes": [
-                                "DEBIT_CARD",
-                                "CREDIT_CARD"
-                            ]
-                        }
-                    ]
-                }
-            },
-            "metaInfo":{
-
-            }
-        }
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"O-Bearer {auth_token}"
-        }
-        
-        response = requests.post(url, json=payload, headers=headers)
-        print(f"Payment response: {response.json()}")
-
-        # Check if response is successful
-        if response.status_code != 200:
-            print(f"PhonePe API returned non-200 status: {response.status_code}")
-            raise Exception(f"Payment creation failed with HTTP {response.status_code}")
-        
-        response_data = response.json()
-        
-        # PhonePe API wraps the actual payment response in a 'data' field
-        # Extract the nested data if it exists, otherwise use the response as is
-        if 'data' in response_data and response_data['data']:
-            payment_response = response_data['data']
-        else:
-            payment_response = response_data
-        
-        # Save the merchant_order_id for later use
-        return payment_response
-        
+        url, kwargs = _phonepe_pay_request(amount, redirect_url, merchant_order_id, auth_token)
+        return _phonepe_pay_response(phonepe.post(url, **kwargs))
     except Exception as e:
         print(f"Error creating PhonePe payment: {e}")
         raise
@@ -216,70 +608,9 @@ def create_payment_cashfree(amount, redirect_url, merchant_order_id=None, custom
     Returns:
         dict: Payment response with link_url and cf_link_id
     """
-
     try:
-        # Prepare API request
-        url = f"{CASHFREE_BASE_URL}/links"
-        
-        # Default customer details if not provided
-        if customer_details is None:
-            customer_details = {
-                "customer_name": "Customer",
-                "customer_email": "testemail@gmail.com",
-                "customer_phone": "9999999999"
-            }
-        
-        # Build notify_url (webhook URL) - same domain as return_url
-        notify_url = redirect_url.replace("/checkout/", "/api/payment/cashfree-webhook/")
-        if not notify_url.startswith("http"):
-            # If redirect_url is relative, construct full URL
-            base_url = redirect_url.split("/checkout/")[0] if "/checkout/" in redirect_url else "https://nm.thelearningsetu.com"
-            notify_url = f"{base_url}/api/payment/cashfree-webhook/"
-        
-        payload = {
-            "link_id": merchant_order_id,
-            "link_amount": float(amount),
-            "link_currency": "INR",
-            "link_purpose": link_purpose,
-            "customer_details": customer_details,
-            "link_meta": {
-                "notify_url": notify_url,
-                "return_url": redirect_url,
-                "upi_intent": False
-            },
-            "link_notify": {
-                "send_email": False,
-                "send_sms": False
-            }
-        }
-        
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-version": CASHFREE_API_VERSION,
-            "x-client-id": CASHFREE_CLIENT_ID,
-            "x-client-secret": CASHFREE_CLIENT_SECRET
-        }
-        
-        response = requests.post(url, json=payload, headers=headers)
-        print(f"Cashfree payment response: {response.status_code}, {response.text}")
-        
-        # Check if response is successful
-        if response.status_code != 200:
-            print(f"Cashfree API returned non-200 status: {response.status_code}")
-            raise Exception(f"Cashfree payment creation failed with HTTP {response.status_code}: {response.text}")
-        
-        response_data = response.json()
-        
-        # Cashfree returns the response directly, no nesting
-        return {
-            "redirectUrl": response_data.get("link_url"),
-            "link_url": response_data.get("link_url"),
-            "orderId": response_data.get("cf_link_id"),  # Cashfree's link ID
-            "cf_link_id": response_data.get("cf_link_id"),
-            "link_id": response_data.get("link_id"),
-            "link_status": response_data.get("link_status")
-        }
-        
+        url, kwargs = _cashfree_link_request(amount, redirect_url, merchant_order_id, customer_details, link_purpose)
+        return _cashfree_link_response(cashfree.post(url, **kwargs))
     except Exception as e:
         print(f"Error creating Cashfree payment: {e}")
         raise
@@ -309,6 +640,32 @@ def create_payment(amount, redirect_url, merchant_order_id=None, gateway="PhoneP
         return create_payment_phonepay(amount, redirect_url, merchant_order_id)
 
 
+async def acreate_payment(amount, redirect_url, merchant_order_id=None, gateway="PhonePe", customer_details=None, link_purpose="Payment"):
+    """create_payment() for async views, over the shared httpx.AsyncClient"""
+    gateway = gateway.strip() if gateway else "PhonePe"
+    if merchant_order_id is None:
+        merchant_order_id = str(uuid4())
+
+    async with async_http_client() as client:
+        if gateway.lower() == "cashfree":
+            try:
+                url, kwargs = _cashfree_link_request(amount, redirect_url, merchant_order_id, customer_details, link_purpose)
+                return _cashfree_link_response(await cashfree.apost(client, url, **kwargs))
+            except Exception as e:
+                print(f"Error creating Cashfree payment: {e}")
+                raise
+
+        try:
+            auth_token = await _aget_auth_token(client)
+            url, kwargs = _phonepe_pay_request(amount, redirect_url, merchant_order_id, auth_token)
+            return _phonepe_pay_response(await phonepe.apost(client, url, **kwargs))
+        except Exception as e:
+            print(f"Error creating PhonePe payment: {e}")
+            raise
+
+
+############################ Payment status ############################
+
 def check_payment_status_cashfree(link_id):
     """
     Check payment status with Cashfree API
@@ -320,68 +677,10 @@ def check_payment_status_cashfree(link_id):
         dict: Payment status response
     """
     try:
-        # Use Cashfree's Get Payment Link Details endpoint
-        url = f"{CASHFREE_BASE_URL}/links/{link_id}"
-        
-        headers = {
-            "x-api-version": CASHFREE_API_VERSION,
-            "x-client-id": CASHFREE_CLIENT_ID,
-            "x-client-secret": CASHFREE_CLIENT_SECRET
-        }
-        
-        response = requests.get(url, headers=headers)
-        print(f"Cashfree status check response: {response.status_code}")
-        
-        if response.status_code == 404:
-            return {
-                "state": "PENDING",
-                "message": "Payment link not found or still processing",
-                "error_type": "API_NOT_FOUND",
-                "link_id": link_id
-            }
-        
-        if response.status_code != 200:
-            return {
-                "state": "PENDING",
-                "message": f"Payment status check failed - HTTP {response.status_code}",
-                "error_type": "API_HTTP_ERROR",
-                "link_id": link_id
-            }
-        
-        response_data = response.json()
-        
-        # Map Cashfree status to our payment status format
-        link_status = response_data.get("link_status", "PENDING")
-        link_amount_paid = response_data.get("link_amount_paid", 0)
-        link_amount = response_data.get("link_amount", 0)
-        
-        # Determine state based on Cashfree status and payment amount
-        if link_status == "PAID" or (link_amount_paid > 0 and link_amount_paid >= link_amount):
-            state = "SUCCESS"
-        elif link_status == "EXPIRED" or link_status == "CANCELLED":
-            state = "FAILED"
-        elif link_status == "PARTIALLY_PAID":
-            state = "PENDING"  # Or handle as partial payment
-        else:
-            state = "PENDING"
-        
-        return {
-            "state": state,
-            "link_status": link_status,
-            "link_amount": link_amount,
-            "link_amount_paid": link_amount_paid,
-            "cf_link_id": response_data.get("cf_link_id"),
-            "link_id": response_data.get("link_id")
-        }
-        
+        url, kwargs = _cashfree_status_request(link_id)
+        return _cashfree_status_response(link_id, cashfree.get(url, **kwargs))
     except Exception as e:
-        print(f"Error checking Cashfree payment status: {e}")
-        return {
-            "state": "PENDING",
-            "message": f"Payment status check failed - {str(e)[:100]}",
-            "error_type": "UNKNOWN_ERROR",
-            "link_id": link_id
-        }
+        return _cashfree_status_error(link_id, e)
 
 
 def check_payment_status_phonepe(merchant_order_id):
@@ -399,105 +698,10 @@ def check_payment_status_phonepe(merchant_order_id):
         
         # Get authentication token
         auth_token = _get_auth_token()
-        
-        # Prepare API request
-        url = f"{PHONEPE_BASE_URL}/checkout/v2/order/{merchant_order_id}/status"
-        
-        headers = {
-            # "Content-Type": "application/json",
-            "Authorization": f"O-Bearer {auth_token}"
-        }
-        
-        response = requests.get(url, headers=headers)
-        # print(f"HTTP Response Status Code: {response.status_code}")
-        
-        # Handle HTTP 204 (No Content) - valid success response but no body
-        if response.status_code == 204:
-            # print("PhonePe API returned 204 No Content - payment may still be processing")
-            return {
-                "state": "PENDING",
-                "message": "Payment status unavailable - order may still be processing",
-                "error_type": "API_NO_CONTENT",
-                "merchant_order_id": merchant_order_id
-            }
-        
-        # Check if response is successful (200-299 range)
-        if not (200 <= response.status_code < 300):
-            # print(f"PhonePe API returned error status: {response.status_code}")
-            return {
-                "state": "PENDING",
-                "message": f"Payment status check failed - HTTP {response.status_code}",
-                "error_type": "API_HTTP_ERROR",
-                "merchant_order_id": merchant_order_id
-            }
-        
-        # Try to parse JSON response
-        try:
-            order_status_response = response.json()
-        except (json.JSONDecodeError, ValueError) as e:
-            # If response is empty or not valid JSON, treat as no content
-            print(f"PhonePe API returned non-JSON response: {e}")
-            return {
-                "state": "PENDING",
-                "message": "Payment status unavailable - invalid response format",
-                "error_type": "API_INVALID_RESPONSE",
-                "merchant_order_id": merchant_order_id
-            }
-        
-        # print(f"PhonePe API Response: {json.dumps(order_status_response, indent=2)}")
-        
-        # PhonePe API wraps the actual order status in a 'data' field
-        # Extract the nested data if it exists
-        if 'data' in order_status_response and order_status_response['data']:
-            # Return the nested data which contains the actual order status
-            return order_status_response['data']
-        elif 'state' in order_status_response:
-            # If state is directly in the response, return as is (backward compatibility)
-            return order_status_response
-        else:
-            # If neither structure is found, return error
-            # print("Unexpected PhonePe API response structure")
-            return {
-                "state": "PENDING",
-                "message": "Payment status check failed - Unexpected API response structure",
-                "error_type": "API_INVALID_RESPONSE",
-                "merchant_order_id": merchant_order_id,
-                "raw_response": order_status_response
-            }
-        
+        url, kwargs = _phonepe_status_request(merchant_order_id, auth_token)
+        return _phonepe_status_response(merchant_order_id, phonepe.get(url, **kwargs))
     except Exception as e:
-        # print(f"Error checking order status: {e}")
-        # print(f"Error type: {type(e).__name__}")
-        
-        # Handle specific JSON decode errors from PhonePe API
-        if "JSONDecodeError" in str(e) or "Expecting value" in str(e):
-            print("PhonePe API returned empty/invalid response. This might happen for very new transactions.")
-            return {
-                "state": "PENDING",
-                "message": "Payment status check failed - API returned empty response",
-                "error_type": "API_EMPTY_RESPONSE",
-                "merchant_order_id": merchant_order_id
-            }
-        
-        # Handle other API errors
-        elif "HTTP" in str(e) or "timeout" in str(e).lower():
-            print("PhonePe API connection issue")
-            return {
-                "state": "PENDING", 
-                "message": "Payment status check failed - API connection issue",
-                "error_type": "API_CONNECTION_ERROR",
-                "merchant_order_id": merchant_order_id
-            }
-            
-        # Handle unknown errors
-        else:
-            print(f"Unknown error type: {e}")
-            return {
-                "state": "UNKNOWN",
-                "message": f"Payment status check failed - {str(e)[:100]}",
-                "error_type": "UNKNOWN_ERROR",
-                "merchant_order_id": merchant_order_id
-            }
+        return _phonepe_status_error(merchant_order_id, e)
 
 
 def check_payment_status(merchant_order_id, gateway="PhonePe"):
@@ -518,3 +722,87 @@ def check_payment_status(merchant_order_id, gateway="PhonePe"):
     
     # Default to PhonePe for backward compatibility
     return check_payment_status_phonepe(merchant_order_id)
+
+
+async def acheck_payment_status(merchant_order_id, gateway="PhonePe"):
+    """check_payment_status() for async views, over the shared httpx.AsyncClient"""
+    gateway = gateway.strip() if gateway else "PhonePe"
+
+    async with async_http_client() as client:
+        if gateway.lower() == "cashfree":
+            try:
+                url, kwargs = _cashfree_status_request(merchant_order_id)
+                return _cashfree_status_response(merchant_order_id, await cashfree.aget(client, url, **kwargs))
+            except Exception as e:
+                return _cashfree_status_error(merchant_order_id, e)
+
+        try:
+            auth_token = await _aget_auth_token(client)
+            url, kwargs = _phonepe_status_request(merchant_order_id, auth_token)
+            return _phonepe_status_response(merchant_order_id, await phonepe.aget(client, url, **kwargs))
+        except Exception as e:
+            return _phonepe_status_error(merchant_order_id, e)
+
+
+############################ Status mapping ############################
+
+def map_phonepay_status(phonepay_status):
+    """
+    Map PhonePe payment status to our payment model status values
+    
+    PhonePe typically returns: PAYMENT_SUCCESS, PAYMENT_PENDING, PAYMENT_ERROR, etc.
+    We need to map these to: completed, pending, failed
+    
+    Args:
+        phonepay_status: Status string from PhonePe API (case-insensitive)
+    
+    Returns:
+        str: Mapped status value ('completed', 'pending', 'failed', 'refunded')
+    """
+    if not phonepay_status:
+        return 'pending'
+    
+    status_lower = str(phonepay_status).lower()
+    
+    # Map various PhonePe status values to our payment statuses
+    if 'success' in status_lower or 'completed' in status_lower:
+        return 'completed'
+    elif 'pending' in status_lower or 'processing' in status_lower:
+        return 'pending'
+    elif 'fail' in status_lower or 'error' in status_lower:
+        return 'failed'
+    elif 'refund' in status_lower:
+        return 'refunded'
+    else:
+        # Default to pending for unknown statuses
+        print(f"Unknown PhonePe status: {phonepay_status}, defaulting to 'pending'")
+        return 'pending'
+
+def map_cashfree_status(cashfree_status):
+    """
+    Map Cashfree payment status to our payment model status values
+    
+    Args:
+        cashfree_status: Status string from Cashfree API
+    
+    Returns:
+        str: Mapped status value ('completed', 'pending', 'failed', 'refunded')
+    """
+    if not cashfree_status:
+        return 'pending'
+    
+    status_lower = str(cashfree_status).lower()
+    
+    # Map Cashfree payment status values to our payment statuses
+    # Cashfree returns: SUCCESS, PENDING, FAILED, etc.
+    if status_lower == 'success' or status_lower == 'paid':
+        return 'completed'
+    elif status_lower == 'pending' or status_lower == 'active' or 'partially' in status_lower:
+        return 'pending'
+    elif status_lower == 'failed' or status_lower == 'expired' or status_lower == 'cancelled' or status_lower == 'user_dropped':
+        return 'failed'
+    elif status_lower == 'refunded' or 'refund' in status_lower:
+        return 'refunded'
+    else:
+        print(f"Unknown Cashfree status: {cashfree_status}, defaulting to 'pending'")
+        return 'pending'
@@ -0,0 +1,176 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger("query_monitor")
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when QUERY_MONITOR_RAISE is on and a route runs more queries than its budget"""
+
+
+def fingerprint(sql):
+    """Normalize a SQL statement so the same query with different params compares equal"""
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = _IN_LIST_RE.sub("(...)", sql)
+    return " ".join(sql.split())
+
+
+class QueryRecorder:
+    """execute_wrapper that counts and times every query on a connection"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold):
+        return {sql: n for sql, n in self.fingerprints.items() if n >= threshold}
+
+
+def query_budget(max_queries):
+    """
+    Declare the maximum number of SQL queries a view may run, e.g.
+
+        @router.get("/product-listings/")
+        @query_budget(8)
+        def product_listings(request, ...):
+
+    QueryMonitorMiddleware checks it after the response is rendered.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            request.query_budget = max_queries
+            return view_func(request, *args, **kwargs)
+        return wrapped_view
+    return decorator
+
+
+def get_route_budget(request):
+    budget = getattr(request, "query_budget", None)
+    if budget is not None:
+        return budget
+    match = getattr(request, "resolver_match", None)
+    route = "/" + match.route if match is not None else request.path
+    return getattr(settings, "QUERY_BUDGETS", {}).get(route)
+
+
+class QueryMonitorMiddleware:
+    """
+    Records per request the SQL count, total DB time and repeated query
+    fingerprints (the signature of an N+1). Results go out as a Server-Timing
+    header and a JSON log line on the "query_monitor" logger.
+
+    Settings:
+    - QUERY_MONITOR_ENABLED: turn the middleware on
+    - QUERY_MONITOR_DUPLICATE_THRESHOLD: repeats of one fingerprint reported as N+1
+    - QUERY_BUDGETS: {"/api/product/product-listings/": 8, ...} per route,
+      in addition to @query_budget on the view
+    - QUERY_MONITOR_RAISE: raise QueryBudgetExceeded on a budget overrun, for tests
+
+    Runs natively under ASGI too. Connections are per thread, so for async
+    views the recorder is installed in the thread that runs the request's
+    sync_to_async calls (one per request, thread_sensitive).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, "QUERY_MONITOR_ENABLED", False):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with self.recording(recorder):
+            response = self.get_response(request)
+        return self.report(request, response, recorder, started)
+
+    async def __acall__(self, request):
+        if not getattr(settings, "QUERY_MONITOR_ENABLED", False):
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        stack = await sync_to_async(self.recording)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.report(request, response, recorder, started)
+
+    def recording(self, recorder):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        return stack
+
+    def report(self, request, response, recorder, started):
+        total = time.perf_counter() - started
+
+        threshold = getattr(settings, "QUERY_MONITOR_DUPLICATE_THRESHOLD", 3)
+        duplicates = recorder.duplicates(threshold)
+        budget = get_route_budget(request)
+        over_budget = budget is not None and recorder.count > budget
+
+        timings = [
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"',
+            f"total;dur={total * 1000:.1f}",
+        ]
+        if duplicates:
+            timings.append(f'n1;desc="{sum(duplicates.values())} repeated queries"')
+        existing = response.get("Server-Timing")
+        response["Server-Timing"] = ", ".join(([existing] if existing else []) + timings)
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": recorder.count,
+            "db_ms": round(recorder.duration * 1000, 1),
+            "total_ms": round(total * 1000, 1),
+            "budget": budget,
+            "duplicates": [{"sql": sql[:300], "count": n} for sql, n in duplicates.items()],
+        }
+        if over_budget or duplicates:
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+
+        if over_budget and getattr(settings, "QUERY_MONITOR_RAISE", False):
+            raise QueryBudgetExceeded(
+                f"{request.method} {request.path} ran {recorder.count} queries, budget is {budget}"
+            )
+        return response
+